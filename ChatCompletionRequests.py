@@ -1,5 +1,4 @@
-from typing import Literal, Optional, Union, List
-from typing_extensions import TypedDict
+from typing import Literal, Union, List, TypedDict
 
 
 class ChatCompletionRequestSystemMessage(TypedDict):
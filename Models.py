@@ -1,4 +1,7 @@
-import requests
+import threading
+import time
+
+from MultiaInstrumentation import parse_json
 
 
 class Models:
@@ -6,5 +9,192 @@ class Models:
         self.client = client
 
     def list(self):
-        response = requests.get(f"{self.client.base_url}/list/models")
-        return response.json()
+        response = self.client.transport.get("/list/models")
+        return parse_json(response)
+
+
+class AsyncModels:
+    def __init__(self, client):
+        self.client = client
+
+    async def list(self):
+        response = await self.client.transport.get("/list/models")
+        return parse_json(response)
+
+
+# Names used by the catalog for each modality, the catalog keys are matched in lowercase. A key can match
+# several modalities, such as "audio" which groups speech and transcription models.
+MODALITY_ALIASES = {
+    "chat": {"chat", "llm", "llms", "text", "completion", "completions", "chat_completions"},
+    "vision": {"vision", "multimodal", "llava"},
+    "speech": {"speech", "tts", "text_to_speech", "audio_speech", "audio"},
+    "transcription": {"transcription", "transcriptions", "translation", "translations", "stt", "speech_to_text",
+                      "whisper", "audio"},
+    "image": {"image", "images", "image_generation", "images_generations", "diffusion", "text_to_image"},
+}
+
+
+class ModelRegistry:
+    """
+    A class that caches the model catalog of the API and indexes it by name and modality.
+
+    The catalog is fetched on first use and kept for `ttl` seconds. Once it expires, the stale catalog keeps
+    being used while a new one is fetched in the background, so validating a model never waits for the API
+    except the first time or when the model is not found.
+    """
+    def __init__(self, client, ttl: float = 300):
+        """
+        Initializes the `ModelRegistry` class.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        - `ttl` (optional): Seconds the catalog is used before it is refreshed.
+        """
+        self.client = client
+        self.ttl = ttl
+        self.catalog = None
+        self.fetched_at = None
+        self._models = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self):
+        """
+        Fetches the catalog from the API and rebuilds the index.
+        """
+        catalog = self.client.models.list()
+        models = index_catalog(catalog)
+        with self._lock:
+            self.catalog = catalog
+            self._models = models
+            self.fetched_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self.fetched_at is None:
+            self.refresh()
+            return
+        if time.monotonic() - self.fetched_at < self.ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            # The stale catalog keeps being used, the next call will try again.
+            pass
+        finally:
+            self._refreshing = False
+
+    def get(self, name: str):
+        """
+        Returns the catalog entry of a model.
+
+        Parameters:
+        - `name`: The name of the model.
+
+        Returns:
+        - A dictionary with the `modalities` of the model and the metadata listed by the catalog, or None if the
+          model is not in the catalog.
+        """
+        self._ensure_fresh()
+        return self._models.get(name)
+
+    def names(self, modality: str = None):
+        """
+        Returns the names of the models in the catalog.
+
+        Parameters:
+        - `modality` (optional): Only return the models of this modality: "chat", "vision", "speech",
+          "transcription" or "image".
+        """
+        self._ensure_fresh()
+        return [name for name, entry in self._models.items()
+                if modality is None or modality in entry["modalities"]]
+
+    def validate(self, model: str, modality: str):
+        """
+        Checks that a model is served by the API for a modality, without a request in the usual case.
+
+        If the model is not found, the catalog is fetched again before failing, in case it was just added.
+        Models listed without a known modality are accepted for any of them.
+
+        Parameters:
+        - `model`: The name of the model.
+        - `modality`: The modality the model is used for.
+
+        Raises:
+        - `ValueError`: If the model is not served by the API, or not for this modality.
+        """
+        self._ensure_fresh()
+        if not self._models:
+            # The catalog could not be indexed, so there is nothing to validate against.
+            return
+        if not self._accepts(model, modality):
+            self.refresh()
+            if not self._accepts(model, modality):
+                available = ", ".join(sorted(self.names(modality)))
+                raise ValueError(f'The model "{model}" is not available for {modality}, available models: {available}')
+
+    def _accepts(self, model, modality):
+        entry = self._models.get(model)
+        return entry is not None and (not entry["modalities"] or modality in entry["modalities"])
+
+
+def index_catalog(catalog):
+    """
+    Indexes a model catalog returned by `/list/models`.
+
+    Parameters:
+    - `catalog`: The JSON catalog.
+
+    Returns:
+    - A dictionary mapping the name of every model to a dictionary with its set of `modalities` and the
+      metadata listed by the catalog.
+    """
+    models = {}
+    _index(catalog, set(), models)
+    return models
+
+
+def _modalities(key):
+    if not isinstance(key, str):
+        return set()
+    key = key.lower().replace("-", "_").replace("/", "_")
+    return {modality for modality, aliases in MODALITY_ALIASES.items() if key in aliases}
+
+
+def _index(catalog, modalities, models):
+    """
+    Adds the models of a catalog to the index, accepting the usual layouts: lists of names or of objects with
+    a name and a type, or dictionaries grouping them by modality.
+    """
+    if isinstance(catalog, str):
+        _add(models, catalog, modalities, {})
+    elif isinstance(catalog, list):
+        for item in catalog:
+            _index(item, modalities, models)
+    elif isinstance(catalog, dict):
+        name = next((catalog[key] for key in ("name", "id", "model") if isinstance(catalog.get(key), str)), None)
+        if name is not None:
+            item_modalities = set().union(*(_modalities(catalog[key])
+                                            for key in ("modality", "type", "category", "task") if key in catalog))
+            _add(models, name, item_modalities or modalities, catalog)
+            return
+        for key, value in catalog.items():
+            key_modalities = _modalities(key)
+            if key_modalities or key in ("data", "models"):
+                _index(value, key_modalities or modalities, models)
+            elif modalities and isinstance(value, (dict, type(None))):
+                # A dictionary of models of one modality, mapping their names to their metadata.
+                _add(models, key, modalities, value or {})
+
+
+def _add(models, name, modalities, metadata):
+    entry = models.setdefault(name, {"modalities": set()})
+    entry.update({key: value for key, value in metadata.items() if key != "modalities"})
+    entry["modalities"].update(modalities or ())
@@ -1,4 +1,13 @@
-import requests
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from MultiaAudioProcessing import AudioPreprocessor, read_wav, transcribe_segments, wav_header
+from MultiaAudioProcessing import split_sentences as _split_sentences
+from MultiaErrors import acheck_streamed, check_streamed, raise_for_status
+from MultiaInstrumentation import finish, parse_json
+from MultiaStreaming import iter_body
+from MultiaUpload import MultipartEncoder
 
 
 class Audio:
@@ -39,7 +48,9 @@ class Speech:
     def create(self, model: str,
                prompt: str,
                voice_preset: str = None,
-               priority: int = 1):
+               priority: int = 1,
+               split_sentences: bool = False,
+               max_concurrency: int = 4):
         """
         Creates speech synthesis from text.
 
@@ -48,10 +59,28 @@ class Speech:
         - `prompt`: The text to be converted into speech.
         - `voice_preset` (optional): A preset that modifies the characteristics of the generated voice.
         - `priority` (optional): The priority of the speech synthesis task.
+        - `split_sentences` (optional): Whether to split the prompt in sentences that are synthesized concurrently,
+          so the audio of the first sentences is available before the whole prompt has been synthesized. It
+          requires a `voice_preset`, so every sentence is spoken with the same voice.
+        - `max_concurrency` (optional): With `split_sentences`, the maximum number of sentences in flight at the
+          same time.
 
         Returns:
-        - A `ResponseSpeech` object that contains the synthesized response.
+        - A `ResponseSpeech` object that contains the synthesized response, or a `SentenceSpeech` object with
+          `split_sentences`.
+
+        Raises:
+        - `ValueError`: If `split_sentences` is set without a `voice_preset`.
+        - `APIError`: If the API answers with an error status. With `split_sentences`, it is raised by the
+          methods that read the audio.
         """
+        if split_sentences and voice_preset is None:
+            raise ValueError("split_sentences requires a voice_preset, otherwise every sentence can get another voice")
+        if self.client.validate_models:
+            self.client.registry.validate(model, "speech")
+        if split_sentences:
+            return SentenceSpeech(lambda sentence: self.create(model, sentence, voice_preset, priority),
+                                  _split_sentences(prompt), max_concurrency)
         request_json = {
             'prompt': prompt,
             "model": model,
@@ -59,8 +88,9 @@ class Speech:
             'priority': priority
         }
 
-        response_data = requests.post(f"{self.client.base_url}/audio/speech", data=request_json)
-        return ResponseSpeech(response_data)
+        response_data = self.client.transport.post("/audio/speech", model=model, priority=priority,
+                                                   data=request_json, stream=True)
+        return ResponseSpeech(check_streamed(response_data))
 
 
 class Transcription:
@@ -77,10 +107,16 @@ class Transcription:
         self.client = client
 
     def create(self, model: str,
-               file_path: str,
+               file_path: str = None,
                language: str = None,
                initial_prompt: str = None,
-               priority: int = 1):
+               priority: int = 1,
+               file=None,
+               segment_seconds: float = None,
+               segment_overlap: float = 2.0,
+               max_concurrency: int = 4,
+               condition_on_previous_text: bool = False,
+               preprocess=False):
         """
         Transcribes an audio file to text.
 
@@ -90,21 +126,44 @@ class Transcription:
         - `language` (optional): The language of the audio.
         - `initial_prompt` (optional): An initial prompt that can influence the transcription.
         - `priority`(optional): The priority of the transcription task.
+        - `file` (optional): The audio as bytes, a binary file-like object or an iterable of bytes, used instead
+          of `file_path`. It is streamed to the API without being loaded in memory as a whole.
+        - `segment_seconds` (optional): If set, the audio is split client-side in segments of this many seconds that
+          are sent concurrently, and their texts are joined in order. Requires FFmpeg.
+        - `segment_overlap` (optional): The seconds each segment shares with the previous one, the words repeated
+          in the overlap are only kept once.
+        - `max_concurrency` (optional): The maximum number of segments in flight at the same time.
+        - `condition_on_previous_text` (optional): Whether to append the end of the previous segment text to the
+          `initial_prompt` of each segment. Segments are then sent one after the other.
+        - `preprocess` (optional): True to convert the audio to 16 kHz mono Opus before it is uploaded, or an
+          `AudioPreprocessor` with the conversion options. Requires FFmpeg.
 
         Returns:
         - A string containing the transcribed text.
+
+        Raises:
+        - `ValueError`: If neither `file_path` nor `file` are given.
         """
+        if self.client.validate_models:
+            self.client.registry.validate(model, "transcription")
         request_json = {
             'model': model,
             'language': language,
             'initial_prompt': initial_prompt,
             'priority': priority
         }
-        file = open(file_path, "rb")
-        audio_file = {"file": file}
+        if segment_seconds is not None:
+            # The source is converted once, the segments are cut from the conversion.
+            return transcribe_segments(
+                lambda segment, prompt: self.create(model, language=language, initial_prompt=prompt,
+                                                    priority=priority, file=segment),
+                _preprocess(_audio_file(file_path, file), preprocess), segment_seconds, segment_overlap,
+                max_concurrency, initial_prompt, condition_on_previous_text)
 
-        response_data = requests.post(f"{self.client.base_url}/audio/transcriptions", files=audio_file, data=request_json)
-        return response_data.json()["text"]
+        with MultipartEncoder(request_json, "file", _preprocess(_audio_file(file_path, file), preprocess)) as body:
+            response_data = self.client.transport.post("/audio/transcriptions", model=model, priority=priority,
+                                                       data=body, headers=body.headers)
+        return parse_json(response_data)["text"]
 
 
 class Translation:
@@ -121,10 +180,16 @@ class Translation:
         self.client = client
 
     def create(self, model: str,
-               file_path: str,
+               file_path: str = None,
                language: str = None,
                initial_prompt: str = None,
-               priority: int = 1):
+               priority: int = 1,
+               file=None,
+               segment_seconds: float = None,
+               segment_overlap: float = 2.0,
+               max_concurrency: int = 4,
+               condition_on_previous_text: bool = False,
+               preprocess=False):
         """
         Translates an audio file to english language.
 
@@ -134,26 +199,208 @@ class Translation:
         - `language` (optional): The target language of the translation.
         - `initial_prompt` (optional): An initial prompt that can influence the translation.
         - `priority` (optional): The priority of the translation task.
+        - `file` (optional): The audio as bytes, a binary file-like object or an iterable of bytes, used instead
+          of `file_path`. It is streamed to the API without being loaded in memory as a whole.
+        - `segment_seconds` (optional): If set, the audio is split client-side in segments of this many seconds that
+          are sent concurrently, and their texts are joined in order. Requires FFmpeg.
+        - `segment_overlap` (optional): The seconds each segment shares with the previous one, the words repeated
+          in the overlap are only kept once.
+        - `max_concurrency` (optional): The maximum number of segments in flight at the same time.
+        - `condition_on_previous_text` (optional): Whether to append the end of the previous segment text to the
+          `initial_prompt` of each segment. Segments are then sent one after the other.
+        - `preprocess` (optional): True to convert the audio to 16 kHz mono Opus before it is uploaded, or an
+          `AudioPreprocessor` with the conversion options. Requires FFmpeg.
 
         Returns:
         - A string containing the translated text.
+
+        Raises:
+        - `ValueError`: If neither `file_path` nor `file` are given.
         """
+        if self.client.validate_models:
+            self.client.registry.validate(model, "transcription")
         request_json = {
             'model': model,
             'language': language,
             'initial_prompt': initial_prompt,
             'priority': priority
         }
-        file = open(file_path, "rb")
-        audio_file = {"file": file}
+        if segment_seconds is not None:
+            # The source is converted once, the segments are cut from the conversion.
+            return transcribe_segments(
+                lambda segment, prompt: self.create(model, language=language, initial_prompt=prompt,
+                                                    priority=priority, file=segment),
+                _preprocess(_audio_file(file_path, file), preprocess), segment_seconds, segment_overlap,
+                max_concurrency, initial_prompt, condition_on_previous_text)
+
+        with MultipartEncoder(request_json, "file", _preprocess(_audio_file(file_path, file), preprocess)) as body:
+            response_data = self.client.transport.post("/audio/translations", model=model, priority=priority,
+                                                       data=body, headers=body.headers)
+        return parse_json(response_data)["text"]
+
+
+class AsyncAudio:
+    """
+    The asynchronous version of `Audio`, used by `AsyncOpenMultIA`.
+
+    Submodules:
+    - `speech`: For speech synthesis.
+    - `transcriptions`: For audio transcription.
+    - `translations`: For audio translation.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncAudio` class with a specific client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+        self.speech = AsyncSpeech(self.client)
+        self.transcriptions = AsyncTranscription(self.client)
+        self.translations = AsyncTranslation(self.client)
+
 
-        response_data = requests.post(f"{self.client.base_url}/audio/translations", files=audio_file, data=request_json)
-        return response_data.json()["text"]
+class AsyncSpeech:
+    """
+    The asynchronous version of `Speech`.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncSpeech` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def create(self, model: str,
+                     prompt: str,
+                     voice_preset: str = None,
+                     priority: int = 1,
+                     stream: bool = False):
+        """
+        Creates speech synthesis from text without blocking the event loop.
+
+        The parameters are the same as in `Speech.create`, and:
+        - `stream` (optional): Whether to return as soon as the server starts sending the audio, so it is
+          downloaded while it is written instead of being read in memory first.
+
+        Returns:
+        - A `ResponseSpeech` object that contains the synthesized response, or, if `stream` is True, an
+          `AsyncResponseSpeech` whose methods are coroutines.
+
+        Raises:
+        - `APIError`: If the API answers with an error status.
+        """
+        request_json = {
+            'prompt': prompt,
+            "model": model,
+            "voice_preset": voice_preset,
+            'priority': priority
+        }
+
+        if stream:
+            response_data = await self.client.transport.post("/audio/speech", data=request_json, stream=True)
+            return AsyncResponseSpeech(await acheck_streamed(response_data))
+        response_data = await self.client.transport.post("/audio/speech", data=request_json)
+        finish(response_data)
+        raise_for_status(response_data)
+        return ResponseSpeech(response_data)
+
+
+class AsyncTranscription:
+    """
+    The asynchronous version of `Transcription`.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncTranscription` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def create(self, model: str,
+                     file_path: str = None,
+                     language: str = None,
+                     initial_prompt: str = None,
+                     priority: int = 1,
+                     file=None,
+                     preprocess=False):
+        """
+        Transcribes an audio file to text without blocking the event loop.
+
+        The parameters are the same as in `Transcription.create`.
+
+        Returns:
+        - A string containing the transcribed text.
+        """
+        request_json = {
+            'model': model,
+            'language': language,
+            'initial_prompt': initial_prompt,
+            'priority': priority
+        }
+        audio = _audio_file(file_path, file)
+        if preprocess:
+            import asyncio
+            audio = await asyncio.to_thread(_preprocess, audio, preprocess)
+        with MultipartEncoder(request_json, "file", audio) as body:
+            response_data = await self.client.transport.post("/audio/transcriptions", content=body, headers=body.headers)
+        return parse_json(response_data)["text"]
+
+
+class AsyncTranslation:
+    """
+    The asynchronous version of `Translation`.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncTranslation` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def create(self, model: str,
+                     file_path: str = None,
+                     language: str = None,
+                     initial_prompt: str = None,
+                     priority: int = 1,
+                     file=None,
+                     preprocess=False):
+        """
+        Translates an audio file to english language without blocking the event loop.
+
+        The parameters are the same as in `Translation.create`.
+
+        Returns:
+        - A string containing the translated text.
+        """
+        request_json = {
+            'model': model,
+            'language': language,
+            'initial_prompt': initial_prompt,
+            'priority': priority
+        }
+        audio = _audio_file(file_path, file)
+        if preprocess:
+            import asyncio
+            audio = await asyncio.to_thread(_preprocess, audio, preprocess)
+        with MultipartEncoder(request_json, "file", audio) as body:
+            response_data = await self.client.transport.post("/audio/translations", content=body, headers=body.headers)
+        return parse_json(response_data)["text"]
 
 
 class ResponseSpeech:
     """
     Class to manage the response of speech synthesis.
+
+    The audio is downloaded while it is being written, so it is never held in memory as a whole.
+    The body of the response can only be read once.
     """
     def __init__(self, speech):
         """
@@ -164,12 +411,247 @@ class ResponseSpeech:
         """
         self.speech = speech
 
-    def stream_to_file(self, path: str):
+    def iter_bytes(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates over the audio as it is downloaded.
+
+        Parameters:
+        - `chunk_size` (optional): The size of the chunks.
+
+        Returns:
+        - A generator of bytes.
+        """
+        return iter_body(self.speech, chunk_size)
+
+    def stream_to_file(self, path: str, chunk_size: int = 64 * 1024):
         """
         Saves the response content to a file.
 
         Parameters:
         - `path`: The path of the file where the content will be saved.
+        - `chunk_size` (optional): The size of the chunks written to the file.
+        """
+        try:
+            with open(path, 'wb') as f:
+                for chunk in self.iter_bytes(chunk_size):
+                    f.write(chunk)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Closes the response, releasing its connection back to the pool.
+        """
+        # Responses of the async client are already closed once their body has been read.
+        if not getattr(self.speech, "is_closed", False):
+            self.speech.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncResponseSpeech:
+    """
+    The asynchronous version of `ResponseSpeech`, returned by `AsyncSpeech.create` with `stream=True`.
+
+    The audio is downloaded while it is being written, so it is never held in memory as a whole.
+    The body of the response can only be read once.
+    """
+    def __init__(self, speech):
+        """
+        Initializes `AsyncResponseSpeech` with a streamed speech synthesis response.
+
+        Parameters:
+        - `speech`: The streamed `httpx.Response` obtained from the speech synthesis API.
+        """
+        self.speech = speech
+
+    async def iter_bytes(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates with `async for` over the audio as it is downloaded.
+
+        Parameters:
+        - `chunk_size` (optional): The size of the chunks.
+        """
+        async for chunk in self.speech.aiter_bytes(chunk_size):
+            yield chunk
+
+    async def stream_to_file(self, path: str, chunk_size: int = 64 * 1024):
+        """
+        Saves the response content to a file.
+
+        Parameters:
+        - `path`: The path of the file where the content will be saved.
+        - `chunk_size` (optional): The size of the chunks written to the file.
+        """
+        try:
+            with open(path, 'wb') as f:
+                async for chunk in self.iter_bytes(chunk_size):
+                    f.write(chunk)
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Closes the response, releasing its connection back to the pool.
+        """
+        await self.speech.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class SentenceSpeech:
+    """
+    Class to manage the speech synthesis of a text sent sentence by sentence.
+
+    The sentences are synthesized concurrently, at most `max_concurrency` of them at the same time, and their
+    audio is returned in order as soon as each one is ready, so the playback can start once the first sentence
+    has been synthesized.
+    """
+    def __init__(self, send, sentences, max_concurrency: int = 4):
+        """
+        Initializes `SentenceSpeech`.
+
+        Parameters:
+        - `send`: A callable `send(sentence)` returning the `ResponseSpeech` of one sentence.
+        - `sentences`: The sentences of the text, in order.
+        - `max_concurrency` (optional): The maximum number of sentences in flight at the same time.
+        """
+        self.send = send
+        self.sentences = sentences
+        self.max_concurrency = max_concurrency
+        # The format of the joined audio, once `iter_bytes` has read a WAV segment.
+        self.wav_params = None
+        self._reader = None
+
+    def iter_segments(self):
+        """
+        Iterates over the audio of every sentence, in order. Each segment is a whole audio file.
+
+        Returns:
+        - A generator of bytes.
+
+        Raises:
+        - `APIError`: If the API answers with an error status for a sentence.
+        """
+        if self._reader is not None:
+            raise RuntimeError("The speech can only be read once")
+        self._reader = self._read()
+        return self._reader
+
+    def _read(self):
+        pending = deque()
+        stopped = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            try:
+                for sentence in self.sentences:
+                    pending.append(executor.submit(self._synthesize, sentence, stopped))
+                    if len(pending) >= self.max_concurrency:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # A reader that stops early or a failed sentence does not wait for the sentences that will not
+                # be read: the ones not sent yet are cancelled and the ones in flight close their response.
+                stopped.set()
+                for future in pending:
+                    future.cancel()
+
+    def _synthesize(self, sentence, stopped):
+        # `Speech.create` raises an `APIError` instead of returning the error body of a sentence.
+        with self.send(sentence) as response:
+            segment = []
+            for chunk in response.iter_bytes():
+                if stopped.is_set():
+                    return None
+                segment.append(chunk)
+            return b"".join(segment)
+
+    def iter_bytes(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates over the audio of the whole text as one file.
+
+        WAV segments are joined in one WAV file, streamed with the largest possible length in its header since
+        the length is not known in advance. Other formats are concatenated as they are.
+
+        Parameters:
+        - `chunk_size` (optional): Unused, the chunks are the segments of the sentences.
+
+        Returns:
+        - A generator of bytes.
+
+        Raises:
+        - `ValueError`: If the WAV segments do not share the same format.
+        - `APIError`: If the API answers with an error status for a sentence.
+        """
+        for segment in self.iter_segments():
+            if not segment.startswith(b"RIFF"):
+                yield segment
+                continue
+            params, frames = read_wav(segment)
+            if self.wav_params is None:
+                self.wav_params = params
+                yield wav_header(params)
+            elif params != self.wav_params:
+                raise ValueError(f"The WAV segments have different formats: {self.wav_params} and {params}")
+            yield frames
+
+    def stream_to_file(self, path: str, chunk_size: int = 64 * 1024):
+        """
+        Saves the audio of the whole text to one file, writing every sentence as soon as it is ready.
+
+        Parameters:
+        - `path`: The path of the file where the content will be saved.
+        - `chunk_size` (optional): Unused, the chunks are the segments of the sentences.
+        """
+        size = 0
+        with open(path, "wb") as f:
+            for chunk in self.iter_bytes():
+                f.write(chunk)
+                size += len(chunk)
+            if self.wav_params is not None:
+                # The length of the audio is only known now.
+                f.seek(0)
+                f.write(wav_header(self.wav_params, size - len(wav_header(self.wav_params))))
+
+    def close(self):
         """
-        with open(path, 'wb') as f:
-            f.write(self.speech.content)
+        Stops reading the audio, the sentences that have not been sent yet are not synthesized.
+        """
+        if self._reader is not None:
+            self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _audio_file(file_path, file):
+    """
+    Returns the audio to upload, given either as a path or as any source accepted by `MultipartEncoder`.
+    """
+    if file is not None:
+        return file
+    if file_path is None:
+        raise ValueError("An audio file is required, pass either file_path or file")
+    return file_path
+
+
+def _preprocess(file, preprocess):
+    """
+    Returns the audio to upload, converted by `preprocess` if it is set, see `Transcription.create`.
+    """
+    if not preprocess:
+        return file
+    if preprocess is True:
+        preprocess = AudioPreprocessor()
+    return preprocess.convert(file)
@@ -0,0 +1,372 @@
+import contextlib
+import hashlib
+import io
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+
+def probe_duration(path: str):
+    """
+    Returns the duration in seconds of an audio file, read with `ffprobe`.
+
+    Parameters:
+    - `path`: The path of the audio file.
+    """
+    output = _run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                   "-of", "default=noprint_wrappers=1:nokey=1", path])
+    return float(output)
+
+
+def extract_segment(path: str, start: float, duration: float):
+    """
+    Decodes a segment of an audio file with `ffmpeg` into a 16 kHz mono WAV file in memory.
+
+    Parameters:
+    - `path`: The path of the audio file.
+    - `start`: The start of the segment in seconds.
+    - `duration`: The duration of the segment in seconds.
+
+    Returns:
+    - A binary file-like object with the WAV segment.
+    """
+    output = _run(["ffmpeg", "-v", "error", "-ss", str(start), "-t", str(duration), "-i", path,
+                   "-ac", "1", "-ar", "16000", "-f", "wav", "-"], text=False)
+    segment = io.BytesIO(output)
+    segment.name = "segment.wav"
+    return segment
+
+
+def segment_bounds(duration: float, segment_seconds: float, overlap: float):
+    """
+    Splits an audio duration in overlapping segments.
+
+    Parameters:
+    - `duration`: The duration of the audio in seconds.
+    - `segment_seconds`: The duration of every segment in seconds.
+    - `overlap`: The seconds each segment shares with the previous one.
+
+    Returns:
+    - A list of `(start, duration)` tuples.
+
+    Raises:
+    - `ValueError`: If the overlap is not shorter than the segments.
+    """
+    if not 0 <= overlap < segment_seconds:
+        raise ValueError("segment_overlap must be shorter than segment_seconds")
+    bounds = []
+    start = 0.0
+    while True:
+        bounds.append((start, min(segment_seconds, duration - start)))
+        if start + segment_seconds >= duration:
+            return bounds
+        start += segment_seconds - overlap
+
+
+def merge_transcripts(texts, max_overlap_words: int = 50):
+    """
+    Joins the texts of consecutive overlapping segments, removing the words repeated across each boundary.
+
+    The longest run of words (of at least two words) that ends a text and starts the next one is only kept once.
+    Words are compared ignoring case and punctuation.
+
+    Parameters:
+    - `texts`: The texts of the segments in order.
+    - `max_overlap_words` (optional): The maximum number of repeated words searched at each boundary.
+
+    Returns:
+    - The merged text.
+    """
+    merged = []
+    for text in texts:
+        words = text.split()
+        previous = [_normalize(word) for word in merged[-max_overlap_words:]]
+        current = [_normalize(word) for word in words[:max_overlap_words]]
+        for size in range(min(len(previous), len(current)), 1, -1):
+            if previous[-size:] == current[:size]:
+                words = words[size:]
+                break
+        merged.extend(words)
+    return " ".join(merged)
+
+
+def transcribe_segments(send,
+                        file,
+                        segment_seconds: float,
+                        segment_overlap: float = 2.0,
+                        max_concurrency: int = 4,
+                        initial_prompt: str = None,
+                        condition_on_previous_text: bool = False):
+    """
+    Splits an audio file in overlapping segments, sends them concurrently and stitches the returned texts.
+
+    Parameters:
+    - `send`: A callable `send(segment, initial_prompt)` that uploads one segment and returns its text.
+    - `file`: The path of the audio file, or any source accepted by `MultipartEncoder`.
+    - `segment_seconds`: The duration of every segment in seconds.
+    - `segment_overlap` (optional): The seconds each segment shares with the previous one.
+    - `max_concurrency` (optional): The maximum number of segments decoded or in flight at the same time.
+    - `initial_prompt` (optional): The initial prompt sent with every segment.
+    - `condition_on_previous_text` (optional): Whether to append the end of the previous segment text to the
+      initial prompt of each segment. Each segment then waits for the previous one, so only the decoding of
+      the segments runs ahead concurrently.
+
+    Returns:
+    - The text of the whole audio.
+    """
+    with _local_path(file) as path:
+        bounds = segment_bounds(probe_duration(path), segment_seconds, segment_overlap)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            if not condition_on_previous_text:
+                futures = [executor.submit(lambda bound: send(extract_segment(path, *bound), initial_prompt), bound)
+                           for bound in bounds]
+                texts = [future.result() for future in futures]
+            else:
+                texts = []
+                segments = [executor.submit(extract_segment, path, *bound) for bound in bounds[:max_concurrency]]
+                for index in range(len(bounds)):
+                    segment = segments[index].result()
+                    segments[index] = None
+                    if index + max_concurrency < len(bounds):
+                        segments.append(executor.submit(extract_segment, path, *bounds[index + max_concurrency]))
+                    prompt = " ".join(filter(None, [initial_prompt, texts[-1][-200:] if texts else None]))
+                    texts.append(send(segment, prompt or None))
+    return merge_transcripts(texts)
+
+
+def split_sentences(text: str, min_chars: int = 40, max_chars: int = 300):
+    """
+    Splits a text in sentences to synthesize one by one.
+
+    Sentences shorter than `min_chars` are joined with the next ones, except the first sentence, which is kept
+    short so its audio is ready as soon as possible. Sentences longer than `max_chars` are split between words.
+
+    Parameters:
+    - `text`: The text to split.
+    - `min_chars` (optional): The minimum length of every sentence but the first and the last.
+    - `max_chars` (optional): The maximum length of every sentence.
+
+    Returns:
+    - A list of strings.
+    """
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?;:…。！？])\s+|\n\s*\n", text.strip()):
+        words = sentence.split()
+        while words:
+            piece = words.pop(0)
+            while words and len(piece) + 1 + len(words[0]) <= max_chars:
+                piece += " " + words.pop(0)
+            pieces.append(piece)
+
+    sentences = []
+    for piece in pieces:
+        if len(sentences) > 1 and len(sentences[-1]) < min_chars and len(sentences[-1]) + 1 + len(piece) <= max_chars:
+            sentences[-1] += " " + piece
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def read_wav(audio: bytes):
+    """
+    Reads the format and the frames of a WAV file.
+
+    Returns:
+    - A tuple `(params, frames)`, with `params` a tuple `(channels, sample width, frame rate)`.
+
+    Raises:
+    - `ValueError`: If the audio is not a WAV file.
+    """
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as f:
+            return (f.getnchannels(), f.getsampwidth(), f.getframerate()), f.readframes(f.getnframes())
+    except (wave.Error, EOFError) as error:
+        raise ValueError(f"Invalid WAV audio: {error}")
+
+
+def wav_header(params, data_size: int = 0xFFFFFFFF - 36):
+    """
+    Returns the header of a PCM WAV file.
+
+    Parameters:
+    - `params`: A tuple `(channels, sample width, frame rate)`.
+    - `data_size` (optional): The size in bytes of the frames, by default the largest size, for audio streamed
+      before its length is known.
+    """
+    channels, sample_width, rate = params
+    return (b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVEfmt "
+            + struct.pack("<IHHIIHH", 16, 1, channels, rate, rate * channels * sample_width, channels * sample_width,
+                          8 * sample_width)
+            + b"data" + struct.pack("<I", data_size))
+
+
+# The container and the `ffmpeg` encoder options of every output format.
+AUDIO_FORMATS = {
+    "opus": ("ogg", ["-c:a", "libopus", "-application", "voip"]),
+    "flac": ("flac", ["-c:a", "flac", "-compression_level", "8"]),
+    "wav": ("wav", ["-c:a", "pcm_s16le"]),
+}
+
+
+class AudioPreprocessor:
+    """
+    A class that converts audio to a compact format before it is uploaded.
+
+    Speech models only use 16 kHz mono audio, so decoding, downmixing and resampling the audio client-side, and
+    compressing it, cuts the bytes uploaded and the decoding work of the server. The conversions are cached on
+    disk by the SHA-256 digest of the original audio and the conversion options, so the same recording is only
+    converted once. The least recently used conversions are removed when the cache grows over `max_cache_bytes`.
+    Requires FFmpeg.
+    """
+    def __init__(self, sample_rate: int = 16000,
+                 channels: int = 1,
+                 format: str = "opus",
+                 bitrate: str = "32k",
+                 cache_dir: str = None,
+                 max_workers: int = None,
+                 max_cache_bytes: int = 1024 ** 3):
+        """
+        Initializes the `AudioPreprocessor` class.
+
+        Parameters:
+        - `sample_rate` (optional): The sample rate of the converted audio.
+        - `channels` (optional): The number of channels of the converted audio.
+        - `format` (optional): The format of the converted audio: "opus" (lossy, the smallest), "flac" (lossless)
+          or "wav" (uncompressed, the cheapest to decode).
+        - `bitrate` (optional): The bitrate of the "opus" format.
+        - `cache_dir` (optional): The directory of the converted files, by default in the temporary directory.
+        - `max_workers` (optional): The maximum number of conversions running at the same time in `convert_many`,
+          by default the number of CPUs.
+        - `max_cache_bytes` (optional): The maximum total size of the converted files in the cache directory,
+          None for no limit.
+
+        Raises:
+        - `ValueError`: If the format is not supported.
+        """
+        if format not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio format {format!r}, use one of {', '.join(AUDIO_FORMATS)}")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.format = format
+        self.bitrate = bitrate
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "multia-audio")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_cache_bytes = max_cache_bytes
+        self._lock = threading.Lock()
+
+    def convert(self, file):
+        """
+        Converts an audio file, or returns its cached conversion.
+
+        Parameters:
+        - `file`: The path of the audio file, or any source accepted by `MultipartEncoder`.
+
+        Returns:
+        - The path of the converted file in the cache directory.
+        """
+        extension, options = AUDIO_FORMATS[self.format]
+        if self.format == "opus":
+            options = options + ["-b:a", self.bitrate]
+        with _local_path(file) as path:
+            digest = hashlib.sha256(f"{self.sample_rate}:{self.channels}:{options}\n".encode("utf-8"))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+            output = os.path.join(self.cache_dir, digest[:2], f"{digest}.{extension}")
+            if os.path.exists(output):
+                # The modification time records the last use, for the LRU eviction.
+                os.utime(output)
+                return output
+
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            # Converted next to its final name, so a concurrent or interrupted conversion never leaves a partial file.
+            partial = f"{output}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                _run(["ffmpeg", "-v", "error", "-y", "-i", path, "-vn", "-ac", str(self.channels),
+                      "-ar", str(self.sample_rate), *options, "-f", extension, partial], text=False)
+                os.replace(partial, output)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+        if self.max_cache_bytes is not None:
+            self._evict(output)
+        return output
+
+    def _evict(self, keep):
+        """
+        Removes the least recently used conversions until the cache fits in `max_cache_bytes`, except `keep`.
+        """
+        with self._lock:
+            entries = [(entry.path, entry.stat()) for directory in os.scandir(self.cache_dir) if directory.is_dir()
+                       for entry in os.scandir(directory.path) if not entry.name.endswith(".part")]
+            size = sum(stat.st_size for _, stat in entries)
+            for path, stat in sorted(entries, key=lambda entry: entry[1].st_mtime):
+                if size <= self.max_cache_bytes:
+                    return
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= stat.st_size
+
+    def convert_many(self, files):
+        """
+        Converts several audio files concurrently, each in its own `ffmpeg` process.
+
+        The conversions already run in parallel processes, so they are started from a pool of threads, which
+        only wait for `ffmpeg`. A pool of processes would not convert faster, and it could neither receive
+        file-like sources, which cannot be pickled, nor share the lock of the cache eviction.
+
+        Parameters:
+        - `files`: The audio files, as accepted by `convert`.
+
+        Returns:
+        - A generator of the paths of the converted files, in the order of `files`.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from executor.map(self.convert, files)
+
+
+@contextlib.contextmanager
+def _local_path(file):
+    """
+    Yields a path to the audio, copying it to a temporary file if it is not already on disk.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        yield os.fspath(file)
+        return
+    with tempfile.NamedTemporaryFile(delete=False) as copy:
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            copy.write(file)
+        elif hasattr(file, "read"):
+            shutil.copyfileobj(file, copy)
+        else:
+            for chunk in file:
+                copy.write(chunk)
+    try:
+        yield copy.name
+    finally:
+        os.remove(copy.name)
+
+
+def _normalize(word: str):
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def _run(command, text=True):
+    try:
+        result = subprocess.run(command, capture_output=True, check=True, text=text)
+    except FileNotFoundError:
+        raise RuntimeError(f"`{command[0]}` is required to process audio files, install FFmpeg and add it to the PATH")
+    except subprocess.CalledProcessError as error:
+        raise RuntimeError(f"`{command[0]}` failed: {error.stderr}")
+    return result.stdout
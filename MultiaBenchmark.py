@@ -0,0 +1,363 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from MultiaMockServer import silent_wav
+from openMultIA import OpenMultIA
+
+
+def scenarios(payload_size: int = 64 * 1024, max_tokens: int = 32):
+    """
+    Returns the benchmark scenarios, one per endpoint, as callables `scenario(client)` sending one request.
+
+    Parameters:
+    - `payload_size` (optional): The size in bytes of the uploaded audio and images.
+    - `max_tokens` (optional): The `max_tokens` of the chat completions.
+    """
+    messages = [{"role": "user", "content": "Tell me a number from 1 to 100"}]
+    audio = silent_wav(payload_size / 32000)
+    image = b"\xff\xd8" + b"\0" * max(0, payload_size - 4) + b"\xff\xd9"
+
+    def chat(client):
+        client.chat.completions.create("mock-chat", messages, max_tokens=max_tokens)
+
+    def chat_stream(client):
+        for _ in client.chat.completions.create("mock-chat", messages, max_tokens=max_tokens, stream=True):
+            pass
+
+    def transcription(client):
+        client.audio.transcriptions.create("mock-audio", file=audio)
+
+    def speech(client):
+        for _ in client.audio.speech.create("mock-audio", "Hello").iter_bytes():
+            pass
+
+    def images(client):
+        for _ in client.images.generate("mock-image", "a fox", n=4).iter_images():
+            pass
+
+    def vision(client):
+        client.vision.generate("mock-vision", [{"role": "user", "content": "describe the image"}], image=image)
+
+    def models(client):
+        client.models.list()
+
+    return {"chat": chat, "chat_stream": chat_stream, "transcription": transcription, "speech": speech,
+            "images": images, "vision": vision, "models": models}
+
+
+class BenchmarkResult:
+    """
+    A class representing the measurements of one benchmark scenario.
+    """
+    def __init__(self, name: str, latencies: list, errors: int, duration: float, cpu_seconds: float,
+                 peak_rss: int, rss_growth: int):
+        """
+        Initializes the `BenchmarkResult` class.
+
+        Parameters:
+        - `name`: The name of the scenario.
+        - `latencies`: The latency in seconds of every successful request.
+        - `errors`: The number of failed requests.
+        - `duration`: The wall time of the scenario in seconds.
+        - `cpu_seconds`: The CPU time used by the client process during the scenario.
+        - `peak_rss`: The peak resident memory of the client process in bytes, sampled during the scenario.
+        - `rss_growth`: How much the peak exceeds the resident memory at the start of the scenario, in bytes.
+        """
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.duration = duration
+        self.cpu_seconds = cpu_seconds
+        self.peak_rss = peak_rss
+        self.rss_growth = rss_growth
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self):
+        """
+        The successful requests per second.
+        """
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    def percentile(self, q: float):
+        """
+        Returns a latency percentile in seconds, or None if no request succeeded.
+
+        Parameters:
+        - `q`: The percentile, between 0 and 100.
+        """
+        if not self.latencies:
+            return None
+        return self.latencies[min(len(self.latencies) - 1, int(q / 100 * len(self.latencies)))]
+
+    def to_dict(self):
+        return {"name": self.name, "requests": self.requests, "errors": self.errors,
+                "throughput": self.throughput, "p50": self.percentile(50), "p99": self.percentile(99),
+                "cpu_seconds": self.cpu_seconds, "cpu_per_request_ms": 1000 * self.cpu_seconds / max(1, self.requests),
+                "peak_rss_mb": self.peak_rss / 2 ** 20, "rss_growth_mb": self.rss_growth / 2 ** 20}
+
+
+def run_load(client,
+             scenario,
+             name: str = "scenario",
+             requests: int = 100,
+             concurrency: int = 8,
+             rate: float = None):
+    """
+    Drives a scenario against a client and measures it.
+
+    With a fixed `concurrency`, every worker sends its next request as soon as the previous one completes
+    (closed loop). With a fixed arrival `rate`, requests are started on a schedule whether or not the previous
+    ones have completed (open loop), and latencies are measured from their scheduled start, so a slow client
+    shows up as queueing instead of hiding it. The CPU time is the one of the whole process, so the server must
+    run in another process for it to measure the client alone, as `benchmark` does.
+
+    Parameters:
+    - `client`: The `OpenMultIA` client to drive.
+    - `scenario`: A callable `scenario(client)` sending one request.
+    - `name` (optional): The name of the scenario in the result.
+    - `requests` (optional): The number of requests sent.
+    - `concurrency` (optional): The number of requests in flight at the same time, or the maximum with `rate`.
+    - `rate` (optional): The number of requests started per second, None for a closed loop.
+
+    Returns:
+    - A `BenchmarkResult`.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def send(scheduled):
+        try:
+            scenario(client)
+        except Exception as error:
+            with lock:
+                errors.append(error)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - scheduled)
+
+    memory = _MemorySampler()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if rate is None:
+        counter = iter(range(requests))
+
+        def worker():
+            while next(counter, None) is not None:
+                send(time.perf_counter())
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for index in range(requests):
+                scheduled = start + index / rate
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+                executor.submit(send, scheduled)
+    duration = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    memory.stop()
+    return BenchmarkResult(name, latencies, len(errors), duration, cpu_seconds, memory.peak, memory.peak - memory.start)
+
+
+def benchmark(names=None,
+              url: str = None,
+              requests: int = 100,
+              concurrency: int = 8,
+              rate: float = None,
+              latency: float = 0.0,
+              token_latency: float = 0.0,
+              payload_size: int = 64 * 1024,
+              max_tokens: int = 32,
+              record: str = None,
+              replay: str = None,
+              replay_time_scale: float = 1.0):
+    """
+    Runs the benchmark scenarios against a `MockServer` started in another process, so it does not count in the
+    CPU time and memory of the client, against a real server if `url` is given, or against the responses of a
+    replay archive.
+
+    Parameters:
+    - `names` (optional): The names of the scenarios to run, by default all of them.
+    - `url` (optional): The base URL of a MultAI server, None starts a local `MockServer`.
+    - `requests` (optional): The number of requests of every scenario.
+    - `concurrency` (optional): The number of requests in flight at the same time.
+    - `rate` (optional): The number of requests started per second, None for a closed loop.
+    - `latency` (optional): Seconds the mock server waits before every response.
+    - `token_latency` (optional): Seconds between the chunks of the streamed completions of the mock server.
+    - `payload_size` (optional): The size in bytes of the uploaded and generated audio and images.
+    - `max_tokens` (optional): The `max_tokens` of the chat completions.
+    - `record` (optional): The path of a replay archive where the responses of the server are recorded.
+    - `replay` (optional): The path of a replay archive, recorded with the same scenarios, answering the requests
+      instead of a server.
+    - `replay_time_scale` (optional): The factor applied to the recorded delays of `replay`.
+
+    Returns:
+    - A list of `BenchmarkResult`, one per scenario.
+    """
+    available = scenarios(payload_size, max_tokens)
+    names = names or list(available)
+    server = None
+    if replay is not None:
+        url = url or "http://replay.invalid"
+    elif url is None:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "MultiaMockServer.py"),
+                                   "--latency", str(latency), "--token-latency", str(token_latency),
+                                   "--completion-tokens", str(max_tokens), "--image-size", str(payload_size),
+                                   "--audio-seconds", str(payload_size / 32000)],
+                                  stdout=subprocess.PIPE, text=True)
+        url = server.stdout.readline().strip()
+    try:
+        if not url:
+            raise RuntimeError("The mock server did not start")
+        with OpenMultIA(url, pool_maxsize=concurrency, record=record, replay=replay,
+                        replay_time_scale=replay_time_scale) as client:
+            return [run_load(client, available[name], name, requests, concurrency, rate) for name in names]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            server.stdout.close()
+
+
+# Measures, in a fresh interpreter, the cold start of a client that sends one chat request.
+_IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from openMultIA import OpenMultIA
+client = OpenMultIA("http://127.0.0.1:1")
+imported = time.perf_counter()
+client.chat.completions
+chat = time.perf_counter()
+print(imported - start, chat - start, " ".join(sorted(set(name.split(".")[0] for name in sys.modules))))
+"""
+
+# Modules that a client only using the chat API should not import before sending its first request.
+HEAVY_MODULES = ("requests", "urllib3", "httpx", "asyncio", "MultiaAudio", "MultiaImages", "MultiaVision", "PIL",
+                 "numpy")
+
+
+def import_time(repeat: int = 5):
+    """
+    Measures the cold start of the client, each time in a new Python process.
+
+    Returns:
+    - A dictionary with the best `import_ms` (importing `openMultIA` and creating a client) and `chat_ms` (up to
+      accessing `client.chat.completions`) over `repeat` runs, and the `heavy_modules` imported by then.
+    """
+    runs = []
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT], cwd=directory, capture_output=True,
+                                text=True, check=True).stdout.split(maxsplit=2)
+        runs.append((float(output[0]), float(output[1]), output[2].split() if len(output) > 2 else []))
+    modules = runs[-1][2]
+    return {"import_ms": 1000 * min(run[0] for run in runs),
+            "chat_ms": 1000 * min(run[1] for run in runs),
+            "heavy_modules": [name for name in HEAVY_MODULES if name in modules]}
+
+
+class _MemorySampler:
+    """
+    Samples the resident memory of the process in a background thread, to find its peak during a scenario.
+    """
+    def __init__(self, interval: float = 0.01):
+        self.start = self.peak = _rss()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def _sample(self, interval):
+        while not self._stopped.wait(interval):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+
+def _rss():
+    """
+    Returns the current resident memory of the process in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Without /proc, only the peak of the whole life of the process is known. Linux reports it in kilobytes
+        # and macOS in bytes.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _format(value, scale=1.0, digits=1):
+    return "-" if value is None else f"{value * scale:.{digits}f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the OpenMultIA client against a local mock server.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run, by default all of them: "
+                                                     f"{', '.join(scenarios())}")
+    parser.add_argument("--url", help="Benchmark a real MultAI server instead of the mock server")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, help="Requests started per second (open loop)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Server latency of the mock server in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--payload-size", type=int, default=64 * 1024)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--record", help="Record the responses in this replay archive")
+    parser.add_argument("--replay", help="Answer the requests with the responses of this replay archive")
+    parser.add_argument("--replay-time-scale", type=float, default=1.0,
+                        help="Factor applied to the recorded delays, 0 replays without any delay")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--import-time", action="store_true", help="Measure the cold start of the client instead")
+    parser.add_argument("--max-import-ms", type=float,
+                        help="With --import-time, fail if the cold start is slower or imports heavy modules")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        result = import_time()
+        print(json.dumps(result, indent=2) if args.json else
+              f"import {result['import_ms']:.1f} ms, chat ready {result['chat_ms']:.1f} ms, "
+              f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}")
+        if args.max_import_ms is not None and (result["chat_ms"] > args.max_import_ms or result["heavy_modules"]):
+            sys.exit(1)
+        return
+
+    unknown = set(args.scenarios) - set(scenarios())
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    results = benchmark(args.scenarios, args.url, args.requests, args.concurrency, args.rate, args.latency,
+                        args.token_latency, args.payload_size, args.max_tokens, args.record, args.replay,
+                        args.replay_time_scale)
+
+    if args.json:
+        print(json.dumps([result.to_dict() for result in results], indent=2))
+        return
+    print(f"{'scenario':<14}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'cpu ms/req':>11}{'rss MB':>8}{'+rss MB':>9}")
+    for result in results:
+        row = result.to_dict()
+        print(f"{row['name']:<14}{row['requests']:>9}{row['errors']:>8}{row['throughput']:>10.1f}"
+              f"{_format(row['p50'], 1000):>9}{_format(row['p99'], 1000):>9}"
+              f"{row['cpu_per_request_ms']:>11.2f}{row['peak_rss_mb']:>8.1f}{row['rss_growth_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def request_key(path: str, request_json: dict, digest: str = None):
+    """
+    Returns the cache key of a request, a hash of its canonical JSON.
+
+    The `priority` and `stream` fields do not change the generated content, so they are not part of the key.
+
+    Parameters:
+    - `path`: The path of the endpoint.
+    - `request_json`: The JSON body of the request.
+    - `digest` (optional): The digest of a file uploaded with the request, such as the image of a vision request.
+    """
+    fields = {key: value for key, value in request_json.items() if key not in ("priority", "stream")}
+    canonical = json.dumps({"path": path, "request": fields, "digest": digest},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def source_digest(source, chunk_size: int = 1024 * 1024):
+    """
+    Returns the SHA-256 digest of a file uploaded with a request.
+
+    Parameters:
+    - `source`: The path of the file, its content as bytes or a seekable binary file-like object.
+    - `chunk_size` (optional): The size of the chunks read to compute the digest.
+
+    Returns:
+    - The hexadecimal digest, or None if the source can not be read twice (such as an iterator).
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    elif hasattr(source, "read") and hasattr(source, "seekable") and source.seekable():
+        position = source.tell()
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+        source.seek(position)
+    else:
+        return None
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    The base class of the response caches, which keeps the hit and miss counters.
+
+    Subclasses implement `_get`, `_set` and `clear`. Values are the JSON responses of the API.
+    """
+    def __init__(self, ttl: float = None):
+        """
+        Initializes the `ResponseCache` class.
+
+        Parameters:
+        - `ttl` (optional): Seconds after which an entry expires, None keeps entries until they are evicted.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Returns the cached value of a key, or None if it is missing or expired.
+
+        Parameters:
+        - `key`: The key returned by `request_key`.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value):
+        """
+        Stores a value in the cache, evicting the least recently used entries if it is full.
+
+        Parameters:
+        - `key`: The key returned by `request_key`.
+        - `value`: The JSON response to store.
+        """
+        with self._lock:
+            self._set(key, value)
+
+    def stats(self):
+        """
+        Returns a dictionary with the `hits`, `misses` and `evictions` counters.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _expired(self, created: float):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+
+class MemoryCache(ResponseCache):
+    """
+    An in-memory LRU response cache.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None, ttl: float = None):
+        """
+        Initializes the `MemoryCache` class.
+
+        Parameters:
+        - `max_entries` (optional): The maximum number of entries kept.
+        - `max_bytes` (optional): The maximum total size of the entries, measured on their JSON encoding.
+        - `ttl` (optional): Seconds after which an entry expires, None keeps entries until they are evicted.
+        """
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, created = entry
+        if self._expired(created):
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        if key in self._entries:
+            self._remove(key)
+        size = len(json.dumps(value)) if self.max_bytes is not None else 0
+        self._entries[key] = (value, size, time.time())
+        self.size += size
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self.max_bytes is not None and self.size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(ResponseCache):
+    """
+    An on-disk response cache, storing one JSON file per entry in a directory.
+
+    Entries survive the process, so repeated evaluation runs reuse the responses of the previous ones.
+    The least recently used entries are evicted when the directory grows over `max_bytes`.
+    """
+    def __init__(self, directory: str, max_bytes: int = None, ttl: float = None):
+        """
+        Initializes the `DiskCache` class, creating the directory if it does not exist.
+
+        Parameters:
+        - `directory`: The directory where the entries are stored.
+        - `max_bytes` (optional): The maximum total size of the entry files.
+        - `ttl` (optional): Seconds after which an entry expires, None keeps entries until they are evicted.
+        """
+        super().__init__(ttl)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".json"))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry["created"]):
+            self._remove(path)
+            return None
+        # The modification time records the last use, for the LRU eviction.
+        os.utime(path)
+        return entry["value"]
+
+    def _set(self, key, value):
+        path = self._path(key)
+        if os.path.exists(path):
+            self._remove(path)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory, suffix=".tmp",
+                                         delete=False) as f:
+            json.dump({"created": time.time(), "value": value}, f)
+        os.replace(f.name, path)
+        self.size += os.path.getsize(path)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_bytes:
+                return
+            self._remove(entry.path)
+            self.evictions += 1
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.size -= size
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    self._remove(entry.path)
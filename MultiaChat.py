@@ -1,8 +1,11 @@
-from typing import Union, Optional, List
-
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union, Optional, List, Iterable
 
 from ChatCompletionRequests import ChatCompletionRequestMessage
+from MultiaCache import request_key
+from MultiaInstrumentation import measure, parse_json, finish
+from MultiaSessions import Sessions
+from MultiaStreaming import Stream, AsyncStream
 
 
 class Chat:
@@ -11,6 +14,7 @@ class Chat:
 
     Submodules:
     - `completions`: For generating chat completions.
+    - `sessions`: For multi-turn conversations that keep their state.
     """
     def __init__(self, client):
         """
@@ -21,6 +25,7 @@ class Chat:
         """
         self.client = client
         self.completions = Completions(self.client)
+        self.sessions = Sessions(self.client)
 
 
 class Completions:
@@ -50,7 +55,10 @@ class Completions:
                frequency_penalty: float = 0.0,
                repeat_penalty: float = 1.1,
                stop: Optional[Union[str, List[str]]] = None,
-               priority: int = 1
+               priority: int = 1,
+               cache: Optional[bool] = None,
+               extra_body: Optional[dict] = None,
+               budget: Optional[str] = None
                ):
         """
         Creates a chat completion request.
@@ -73,64 +81,257 @@ class Completions:
         - `repeat_penalty` (optional): Penalizes repeating sequences.
         - `stop` (optional): Stop sequences to terminate the generation.
         - `priority` (optional): The priority of the request.
+        - `cache` (optional): Whether to use the response cache of the client. By default only requests with a
+          `temperature` of 0 are cached, True forces caching sampled responses too and False bypasses the cache.
+          Streamed responses are never cached.
+        - `extra_body` (optional): Extra fields added to the JSON body of the request.
+        - `budget` (optional): Whether to check the prompt and `max_tokens` against the context size of the model
+          before sending the request, and what to do when they do not fit: "error", "trim" or "summarize",
+          see `TokenBudget.fit`. The estimate is also given to the `scheduler` of the client.
 
         Returns:
-        - A `CompletionsResponse` object containing the generated response, or a streamed response if `stream` is True.
-        """
-        request_json = {'model': model,
-                        'n_gpu_layers': n_gpu_layers,
-                        'n_threads': n_threads,
-                        'main_gpu': main_gpu,
-                        'messages': messages,
-                        'temperature': temperature,
-                        'max_tokens': max_tokens,
-                        'top_p': top_p,
-                        'top_k': top_k,
-                        'stream': stream,
-                        'presence_penalty': presence_penalty,
-                        'frequency_penalty': frequency_penalty,
-                        'repeat_penalty': repeat_penalty,
-                        'stop': stop,
-                        'priority': priority
-                        }
-
-        response_data = requests.post(f"{self.client.base_url}/chat/completions", json=request_json)
-        completion = CompletionsResponse(**response_data.json())
-        if request_json['stream']:
-            return response_data
+        - A `CompletionsResponse` object containing the generated response, or, if `stream` is True, a `Stream`
+          that yields a `CompletionChunk` for every piece of the response as soon as the server sends it.
+          With `budget`, the `BudgetReport` of the request is available as their `budget` attribute.
+
+        Raises:
+        - `ValueError`: If the request does not fit in the context of the model with the "error" `budget`.
+        - `APIError`: If the API answers with an error status.
+        """
+        if self.client.validate_models:
+            self.client.registry.validate(model, "chat")
+        report = None
+        tokens = None
+        if budget is not None:
+            report = self.client.tokens.fit(model, messages, max_tokens, policy=budget)
+            messages = report.messages
+            tokens = report.total_tokens
+        request_json = _completion_request(model, messages, n_threads, n_gpu_layers, main_gpu, temperature,
+                                           max_tokens, top_p, top_k, stream, presence_penalty, frequency_penalty,
+                                           repeat_penalty, stop, priority)
+        if extra_body:
+            request_json.update(extra_body)
+
+        if stream:
+            response_data = self.client.transport.post("/chat/completions", model=model, priority=priority,
+                                                       tokens=tokens, json=request_json, stream=True)
+            stream = Stream(response_data, CompletionChunk.from_raw)
+            stream.budget = report
+            return stream
+
+        key = None
+        if self.client.cache is not None and (cache if cache is not None else temperature == 0):
+            key = request_key("/chat/completions", request_json)
+            cached = self.client.cache.get(key)
+            if cached is not None:
+                completion = CompletionsResponse.from_raw(cached)
+                completion.budget = report
+                return completion
+
+        response = self.client.transport.post("/chat/completions", model=model, priority=priority, tokens=tokens,
+                                              json=request_json)
+        response_data = parse_json(response, finished=False, check_status=True)
+        if key is not None:
+            self.client.cache.set(key, response_data)
+        with measure(response, "build"):
+            completion = CompletionsResponse.from_raw(response_data)
+        completion.budget = report
+        if report is not None and completion.usage:
+            self.client.tokens.estimator(model).calibrate(report.prompt_tokens, completion.usage.get("prompt_tokens"))
+        finish(response, completion.usage)
+        return completion
+
+    def create_batch(self, requests: Iterable[dict],
+                     max_concurrency: int = 8,
+                     ordered: bool = False):
+        """
+        Creates many chat completions concurrently over the shared connection pool.
+
+        The requests are dispatched by `priority` (lower values first, ties keep their input order), with at most
+        `max_concurrency` of them in flight at the same time. A failed request does not abort the batch, its error
+        is reported in its result. For best results the client `pool_maxsize` should be at least `max_concurrency`.
+        Closing the generator cancels the requests that were not sent yet.
+
+        Parameters:
+        - `requests`: The keyword arguments of `create` for every completion, `stream` is not supported.
+        - `max_concurrency` (optional): The maximum number of requests in flight at the same time.
+        - `ordered` (optional): Whether to yield the results in input order instead of as soon as they complete.
+
+        Returns:
+        - A generator of `BatchResult` objects, one per request.
+
+        Raises:
+        - `ValueError`: If a request asks for a streamed response.
+        """
+        requests = list(requests)
+        for request in requests:
+            if request.get("stream"):
+                raise ValueError("Streamed responses are not supported in a batch, remove stream=True from the requests")
+        dispatch_order = sorted(range(len(requests)), key=lambda index: requests[index].get("priority", 1))
+
+        # The requests are dispatched now, the results are collected as the generator is consumed.
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        futures = [None] * len(requests)
+        for index in dispatch_order:
+            futures[index] = executor.submit(self._batch_item, index, requests[index])
+        # The worker threads exit once the requests are done, even if the generator is never consumed.
+        executor.shutdown(wait=False)
+        return _batch_results(executor, futures if ordered else as_completed(futures))
+
+    def _batch_item(self, index: int, request: dict):
+        try:
+            return BatchResult(index, request, response=self.create(**request))
+        except Exception as error:
+            return BatchResult(index, request, error=error)
+
+
+class AsyncChat:
+    """
+    The asynchronous version of `Chat`, used by `AsyncOpenMultIA`.
+
+    Submodules:
+    - `completions`: For generating chat completions.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncChat` class with a specific client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+        self.completions = AsyncCompletions(self.client)
+
+
+class AsyncCompletions:
+    """
+    The asynchronous version of `Completions`.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncCompletions` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def create(self, model: str,
+                     messages: ChatCompletionRequestMessage,
+                     n_threads: Optional[int] = None,
+                     n_gpu_layers: int = 0,
+                     main_gpu: int = 0,
+                     temperature: int = 0.2,
+                     max_tokens: int = 512,
+                     top_p: float = 0.95,
+                     top_k: int = 40,
+                     stream: bool = False,
+                     presence_penalty: float = 0.0,
+                     frequency_penalty: float = 0.0,
+                     repeat_penalty: float = 1.1,
+                     stop: Optional[Union[str, List[str]]] = None,
+                     priority: int = 1,
+                     extra_body: Optional[dict] = None
+                     ):
+        """
+        Creates a chat completion request without blocking the event loop.
+
+        The parameters are the same as in `Completions.create`.
+
+        Returns:
+        - A `CompletionsResponse` object containing the generated response, or, if `stream` is True, an
+          `AsyncStream` to be consumed with `async for` that yields a `CompletionChunk` for every piece of the response.
+        """
+        request_json = _completion_request(model, messages, n_threads, n_gpu_layers, main_gpu, temperature,
+                                           max_tokens, top_p, top_k, stream, presence_penalty, frequency_penalty,
+                                           repeat_penalty, stop, priority)
+        if extra_body:
+            request_json.update(extra_body)
+
+        if stream:
+            response_data = await self.client.transport.post("/chat/completions", json=request_json, stream=True)
+            return AsyncStream(response_data, CompletionChunk.from_raw)
+
+        response = await self.client.transport.post("/chat/completions", json=request_json)
+        response_data = parse_json(response, finished=False)
+        with measure(response, "build"):
+            completion = CompletionsResponse.from_raw(response_data)
+        finish(response, completion.usage)
         return completion
 
 
 class Choice:
     """
     A class representing a choice within a completion response.
+
+    It is a view over the JSON of the choice, kept in `raw`: its fields are only read when they are accessed.
     """
-    def __init__(self, index: int, message: dict, finish_reason: str, logprobs, **kwargs):
+    __slots__ = ("raw",)
+
+    def __init__(self, index: int, message: dict, finish_reason: str, logprobs=None, **kwargs):
         """
         Initializes the `Choice` class with given attributes.
 
         Parameters:
         - `index`: The index of this choice in the list.
-        - `message`: The message content of this choice.
+        - `message`: The message of this choice, with its `role`, `content` and optional `tool_calls`.
         - `finish_reason`: The reason for finishing this choice.
+        - `logprobs` (optional): The log probabilities of the generated tokens.
         """
-        self.index = index
-        self.message = message["content"]
-        self.finish_reason = finish_reason
-        self.logprobs = logprobs
+        self.raw = dict(kwargs, index=index, message=message, finish_reason=finish_reason, logprobs=logprobs)
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        """
+        Returns a `Choice` over the decoded JSON of a choice, without copying it.
+        """
+        choice = cls.__new__(cls)
+        choice.raw = raw
+        return choice
+
+    @property
+    def index(self):
+        return self.raw.get("index")
+
+    @property
+    def message(self):
+        """
+        The content of the message of this choice.
+        """
+        return self.raw["message"].get("content")
+
+    @property
+    def role(self):
+        return self.raw["message"].get("role")
+
+    @property
+    def tool_calls(self):
+        return self.raw["message"].get("tool_calls")
+
+    @property
+    def finish_reason(self):
+        return self.raw.get("finish_reason")
+
+    @property
+    def logprobs(self):
+        return self.raw.get("logprobs")
 
 
 class CompletionsResponse:
     """
     A class representing the response from a chat completions API request.
+
+    It is a view over the JSON of the response, kept in `raw`. The `Choice` objects are only built when
+    `choices` is first accessed. `budget` is the `BudgetReport` of the request, when it was checked.
     """
-    def __init__(self, choices: List,
+    __slots__ = ("raw", "_choices", "budget")
 
-                 created: str,
-                 id: str,
-                 model: str,
-                 object: str,
-                 usage: dict,
+    def __init__(self, choices: List,
+                 created: str = None,
+                 id: str = None,
+                 model: str = None,
+                 object: str = None,
+                 usage: dict = None,
                  **kwargs
                  ):
         """
@@ -144,9 +345,225 @@ class CompletionsResponse:
         - `object`: The object type of the response.
         - `usage`: A dictionary with information about token usage.
         """
-        self.usage = usage
-        self.object = object
-        self.model = model
-        self.created = created
-        self.id = id
-        self.choices = [Choice(**choice) for choice in choices]
+        self.raw = dict(kwargs, choices=choices, created=created, id=id, model=model, object=object, usage=usage)
+        self._choices = None
+        self.budget = None
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        """
+        Returns a `CompletionsResponse` over the decoded JSON of a response, without copying it.
+        """
+        response = cls.__new__(cls)
+        response.raw = raw
+        response._choices = None
+        response.budget = None
+        return response
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            self._choices = [Choice.from_raw(choice) for choice in self.raw["choices"]]
+        return self._choices
+
+    @property
+    def usage(self):
+        return self.raw.get("usage")
+
+    @property
+    def object(self):
+        return self.raw.get("object")
+
+    @property
+    def model(self):
+        return self.raw.get("model")
+
+    @property
+    def created(self):
+        return self.raw.get("created")
+
+    @property
+    def id(self):
+        return self.raw.get("id")
+
+
+class BatchResult:
+    """
+    A class representing the outcome of one request of a batch.
+    """
+    def __init__(self, index: int, request: dict, response: CompletionsResponse = None, error: Exception = None):
+        """
+        Initializes the `BatchResult` class.
+
+        Parameters:
+        - `index`: The position of the request in the batch.
+        - `request`: The keyword arguments the request was created with.
+        - `response` (optional): The `CompletionsResponse` of the request, if it succeeded.
+        - `error` (optional): The exception raised by the request, if it failed.
+        """
+        self.index = index
+        self.request = request
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self):
+        """
+        Whether the request succeeded.
+        """
+        return self.error is None
+
+
+class ChunkChoice:
+    """
+    A class representing a choice within a streamed completion chunk.
+
+    Like `Choice`, it is a view over its JSON, kept in `raw`.
+    """
+    __slots__ = ("raw",)
+
+    def __init__(self, index: int, delta: dict, finish_reason: Optional[str] = None, logprobs=None, **kwargs):
+        """
+        Initializes the `ChunkChoice` class with given attributes.
+
+        Parameters:
+        - `index`: The index of this choice in the list.
+        - `delta`: The piece of the message generated since the previous chunk.
+        - `finish_reason` (optional): The reason for finishing this choice, only set on its last chunk.
+        """
+        self.raw = dict(kwargs, index=index, delta=delta, finish_reason=finish_reason, logprobs=logprobs)
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        """
+        Returns a `ChunkChoice` over the decoded JSON of a chunk choice, without copying it.
+        """
+        choice = cls.__new__(cls)
+        choice.raw = raw
+        return choice
+
+    @property
+    def index(self):
+        return self.raw.get("index")
+
+    @property
+    def role(self):
+        return self.raw["delta"].get("role")
+
+    @property
+    def delta(self):
+        """
+        The text generated since the previous chunk.
+        """
+        return self.raw["delta"].get("content") or ""
+
+    @property
+    def tool_calls(self):
+        return self.raw["delta"].get("tool_calls")
+
+    @property
+    def finish_reason(self):
+        return self.raw.get("finish_reason")
+
+    @property
+    def logprobs(self):
+        return self.raw.get("logprobs")
+
+
+class CompletionChunk:
+    """
+    A class representing one chunk of a streamed chat completions API response.
+
+    Like `CompletionsResponse`, it is a view over its JSON, kept in `raw`.
+    """
+    __slots__ = ("raw", "_choices")
+
+    def __init__(self, choices: List,
+                 created: str = None,
+                 id: str = None,
+                 model: str = None,
+                 object: str = None,
+                 usage: Optional[dict] = None,
+                 **kwargs
+                 ):
+        """
+        Initializes the `CompletionChunk` class.
+
+        Parameters:
+        - `choices`: A list of chunk choice objects.
+        - `created`: The timestamp of creation.
+        - `id`: The ID of the response, shared by all of its chunks.
+        - `model`: The model used to generate the response.
+        - `object`: The object type of the chunk.
+        - `usage` (optional): A dictionary with information about token usage, only sent with the last chunk.
+        """
+        self.raw = dict(kwargs, choices=choices, created=created, id=id, model=model, object=object, usage=usage)
+        self._choices = None
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        """
+        Returns a `CompletionChunk` over the decoded JSON of a chunk, without copying it.
+        """
+        chunk = cls.__new__(cls)
+        chunk.raw = raw
+        chunk._choices = None
+        return chunk
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            self._choices = [ChunkChoice.from_raw(choice) for choice in self.raw["choices"]]
+        return self._choices
+
+    @property
+    def usage(self):
+        return self.raw.get("usage")
+
+    @property
+    def object(self):
+        return self.raw.get("object")
+
+    @property
+    def model(self):
+        return self.raw.get("model")
+
+    @property
+    def created(self):
+        return self.raw.get("created")
+
+    @property
+    def id(self):
+        return self.raw.get("id")
+
+
+def _completion_request(model, messages, n_threads, n_gpu_layers, main_gpu, temperature, max_tokens, top_p, top_k,
+                        stream, presence_penalty, frequency_penalty, repeat_penalty, stop, priority):
+    """
+    Builds the JSON body of a chat completion request, shared by the sync and async clients.
+    """
+    return {'model': model,
+            'n_gpu_layers': n_gpu_layers,
+            'n_threads': n_threads,
+            'main_gpu': main_gpu,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'top_p': top_p,
+            'top_k': top_k,
+            'stream': stream,
+            'presence_penalty': presence_penalty,
+            'frequency_penalty': frequency_penalty,
+            'repeat_penalty': repeat_penalty,
+            'stop': stop,
+            'priority': priority
+            }
+
+
+def _batch_results(executor, futures):
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        # If the caller stops iterating early, the requests that were not sent yet are dropped.
+        executor.shutdown(wait=True, cancel_futures=True)
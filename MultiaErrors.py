@@ -0,0 +1,61 @@
+from MultiaJSON import loads
+
+
+class APIError(RuntimeError):
+    """
+    An error raised when the API answers with an error status.
+
+    Attributes:
+    - `status_code`: The HTTP status of the response.
+    - `body`: The body of the response.
+    """
+    def __init__(self, status_code: int, body: bytes, message: str = None):
+        self.status_code = status_code
+        self.body = body
+        try:
+            detail = loads(body)["detail"]
+        except Exception:
+            detail = body[:500].decode("utf-8", "replace")
+        super().__init__(f"{message or f'The MultAI API answered with status {status_code}'}: {detail}")
+
+
+def raise_for_status(response):
+    """
+    Raises an `APIError` if the status of a response is not successful.
+
+    The body of an httpx streamed response must have been read with `aread` first. Closing a streamed response
+    is left to the caller.
+    """
+    if not 200 <= response.status_code < 300:
+        raise APIError(response.status_code, response.content)
+
+
+def check_streamed(response):
+    """
+    Returns a streamed response, or closes it and raises an `APIError` if its status is not successful.
+
+    Parameters:
+    - `response`: The streamed `requests.Response` returned by the transport.
+
+    Returns:
+    - The response, whose body has not been read yet.
+    """
+    try:
+        raise_for_status(response)
+    except APIError:
+        response.close()
+        raise
+    return response
+
+
+async def acheck_streamed(response):
+    """
+    The asynchronous version of `check_streamed`, for a streamed `httpx.Response`.
+    """
+    if not 200 <= response.status_code < 300:
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        raise_for_status(response)
+    return response
@@ -1,4 +1,11 @@
-import requests
+import io
+import tempfile
+import zipfile
+
+from MultiaCache import request_key
+from MultiaErrors import acheck_streamed, check_streamed, raise_for_status
+from MultiaInstrumentation import finish
+from MultiaStreaming import iter_body
 
 
 class Images:
@@ -21,7 +28,8 @@ class Images:
                  prompt: str,
                  n: int = 1,
                  number_steps: int = 4,
-                 priority: int = 1):
+                 priority: int = 1,
+                 coalesce: bool = None):
         """
         Generates images based on the given prompt.
 
@@ -33,9 +41,69 @@ class Images:
         - `n`: The number of images to generate (default is 1).
         - `number_steps`: The number of steps in the image generation process (default is 4).
         - `priority`: The priority of the image generation request (default is 1).
+        - `coalesce`: Whether identical requests in flight at the same time share one request to the server, its
+          streamed response being read by all of them (optional). By default they do when the client was created
+          with `coalesce_requests=True`.
 
         Returns:
         - A `ResponseImage` object containing the generated images.
+
+        Raises:
+        - `APIError`: If the API answers with an error status.
+        """
+        if self.client.validate_models:
+            self.client.registry.validate(model, "image")
+        request_json = {
+            'prompt': prompt,
+            'model': model,
+            'n': n,
+            'number_steps': number_steps,
+            'priority': priority
+        }
+
+        def send():
+            return check_streamed(self.client.transport.post("/images/generations", model=model, priority=priority,
+                                                             json=request_json, stream=True))
+
+        if self.client.single_flight is not None and coalesce is not False:
+            return ResponseImage(self.client.single_flight.stream(request_key("/images/generations", request_json),
+                                                                  send), n)
+        return ResponseImage(send(), n)
+
+
+class AsyncImages:
+    """
+    The asynchronous version of `Images`, used by `AsyncOpenMultIA`.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `AsyncImages` class with a specific client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def generate(self,
+                       model: str,
+                       prompt: str,
+                       n: int = 1,
+                       number_steps: int = 4,
+                       priority: int = 1,
+                       stream: bool = False):
+        """
+        Generates images based on the given prompt without blocking the event loop.
+
+        The parameters are the same as in `Images.generate`, and:
+        - `stream` (optional): Whether to return as soon as the server starts sending the images, so they are
+          downloaded while they are written instead of being read in memory first.
+
+        Returns:
+        - A `ResponseImage` object containing the generated images, or, if `stream` is True, an
+          `AsyncResponseImage` whose methods are coroutines.
+
+        Raises:
+        - `APIError`: If the API answers with an error status.
         """
         request_json = {
             'prompt': prompt,
@@ -45,13 +113,21 @@ class Images:
             'priority': priority
         }
 
-        images = requests.post(f"{self.client.base_url}/images/generations", json=request_json)
+        if stream:
+            images = await self.client.transport.post("/images/generations", json=request_json, stream=True)
+            return AsyncResponseImage(await acheck_streamed(images), n)
+        images = await self.client.transport.post("/images/generations", json=request_json)
+        finish(images)
+        raise_for_status(images)
         return ResponseImage(images, n)
 
 
 class ResponseImage:
     """
     A class to manage the response of image generation requests.
+
+    The images are downloaded while they are being written or unpacked, so the whole response is never held
+    in memory. The body of the response can only be read once.
     """
     def __init__(self, images, n):
         """
@@ -64,24 +140,187 @@ class ResponseImage:
         self.images = images
         self.n = n
 
+    def iter_bytes(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates over the raw response, a jpg image or a zip archive of jpg images, as it is downloaded.
+
+        Parameters:
+        - `chunk_size` (optional): The size of the chunks.
+
+        Returns:
+        - A generator of bytes.
+        """
+        return iter_body(self.images, chunk_size)
+
     def stream_to_file(self,
-                       path: str):
+                       path: str,
+                       chunk_size: int = 64 * 1024):
         """
         Saves the generated images to a file.
 
         Parameters:
         - `path`: The path of the file where the images will be saved.
+        - `chunk_size` (optional): The size of the chunks written to the file.
 
         Raises:
         - `ValueError`: If the file extension does not match the expected format based on the number of images.
         """
-        if self.n > 1:
-            if not path.endswith("zip"):
-                raise ValueError('There are multiple images, so they must be stores in .zip file, change filename extension for .zip')
+        try:
+            _check_output(path, self.n)
             with open(path, 'wb') as f:
-                f.write(self.images.content)
-        else:
-            if not path.endswith('jpg'):
-                raise ValueError('Output files are jpg, please change file extension for .jpg for proper output')
+                for chunk in iter_body(self.images, chunk_size):
+                    f.write(chunk)
+        finally:
+            self.close()
+
+    def iter_images(self,
+                    decode: bool = False,
+                    max_memory: int = 8 * 1024 * 1024):
+        """
+        Iterates over the generated images one at a time.
+
+        When there are multiple images, the zip archive is spooled to a temporary file (kept in memory only
+        while it is smaller than `max_memory`) and its entries are unpacked lazily, one per iteration.
+
+        Parameters:
+        - `decode` (optional): Whether to yield decoded `PIL.Image.Image` objects instead of the bytes of each jpg.
+          Requires Pillow.
+        - `max_memory` (optional): The size in bytes above which the archive is spooled to disk.
+
+        Returns:
+        - A generator of the images, as bytes or as decoded images.
+        """
+        try:
+            if self.n <= 1:
+                yield _image(b"".join(iter_body(self.images)), decode)
+                return
+            with tempfile.SpooledTemporaryFile(max_size=max_memory) as archive:
+                for chunk in iter_body(self.images):
+                    archive.write(chunk)
+                self.close()
+                with zipfile.ZipFile(archive) as images:
+                    for info in images.infolist():
+                        if not info.is_dir():
+                            yield _image(images.read(info), decode)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Closes the response, releasing its connection back to the pool.
+        """
+        # Responses of the async client are already closed once their body has been read.
+        if not getattr(self.images, "is_closed", False):
+            self.images.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncResponseImage:
+    """
+    The asynchronous version of `ResponseImage`, returned by `AsyncImages.generate` with `stream=True`.
+
+    The images are downloaded while they are being written or unpacked, so the whole response is never held
+    in memory. The body of the response can only be read once.
+    """
+    def __init__(self, images, n):
+        """
+        Initializes the `AsyncResponseImage` class.
+
+        Parameters:
+        - `images`: The streamed `httpx.Response` returned by the API.
+        - `n`: The number of images generated.
+        """
+        self.images = images
+        self.n = n
+
+    async def iter_bytes(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates with `async for` over the raw response, a jpg image or a zip archive of jpg images, as it is
+        downloaded.
+
+        Parameters:
+        - `chunk_size` (optional): The size of the chunks.
+        """
+        async for chunk in self.images.aiter_bytes(chunk_size):
+            yield chunk
+
+    async def stream_to_file(self,
+                             path: str,
+                             chunk_size: int = 64 * 1024):
+        """
+        Saves the generated images to a file.
+
+        Parameters:
+        - `path`: The path of the file where the images will be saved.
+        - `chunk_size` (optional): The size of the chunks written to the file.
+
+        Raises:
+        - `ValueError`: If the file extension does not match the expected format based on the number of images.
+        """
+        try:
+            _check_output(path, self.n)
             with open(path, 'wb') as f:
-                f.write(self.images.content)
+                async for chunk in self.iter_bytes(chunk_size):
+                    f.write(chunk)
+        finally:
+            await self.close()
+
+    async def iter_images(self,
+                          decode: bool = False,
+                          max_memory: int = 8 * 1024 * 1024):
+        """
+        Iterates with `async for` over the generated images one at a time, see `ResponseImage.iter_images`.
+        """
+        try:
+            if self.n <= 1:
+                yield _image(b"".join([chunk async for chunk in self.iter_bytes()]), decode)
+                return
+            with tempfile.SpooledTemporaryFile(max_size=max_memory) as archive:
+                async for chunk in self.iter_bytes():
+                    archive.write(chunk)
+                await self.close()
+                with zipfile.ZipFile(archive) as images:
+                    for info in images.infolist():
+                        if not info.is_dir():
+                            yield _image(images.read(info), decode)
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Closes the response, releasing its connection back to the pool.
+        """
+        await self.images.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def _check_output(path: str, n: int):
+    if n > 1:
+        if not path.endswith("zip"):
+            raise ValueError('There are multiple images, so they must be stores in .zip file, change filename extension for .zip')
+    else:
+        if not path.endswith('jpg'):
+            raise ValueError('Output files are jpg, please change file extension for .jpg for proper output')
+
+
+def _image(data: bytes, decode: bool):
+    """
+    Returns the image as bytes or, if `decode` is True, as a decoded `PIL.Image.Image`.
+    """
+    if not decode:
+        return data
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
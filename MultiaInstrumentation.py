@@ -0,0 +1,510 @@
+import re
+import threading
+import time
+from collections import deque
+
+from MultiaErrors import APIError, raise_for_status
+from MultiaJSON import loads
+
+
+# The phases of a request, in the order they happen.
+PHASES = ("queue", "connect", "upload", "ttfb", "server", "first_token", "download", "parse", "build")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class RequestTiming:
+    """
+    A class that records where the time of one request goes.
+
+    The phases are:
+    - `queue`: Waiting in the client `Scheduler`.
+    - `connect`: Opening the TCP (and TLS) connection, 0 when a pooled connection is reused.
+    - `upload`: Sending the request headers and body.
+    - `ttfb`: Waiting for the response headers once the request has been sent.
+    - `server`: The processing time reported by the server in a `Server-Timing` or `X-Process-Time` header.
+    - `first_token`: From the start of the request to the first chunk of a streamed completion.
+    - `download`: Reading the response body.
+    - `parse`: Decoding the JSON of the response.
+    - `build`: Building the response objects.
+    """
+    def __init__(self, method: str, path: str, model: str = None):
+        """
+        Initializes the `RequestTiming` class.
+
+        Parameters:
+        - `method`: The HTTP method of the request.
+        - `path`: The path of the API endpoint.
+        - `model` (optional): The model of the request.
+        """
+        self.method = method
+        self.path = path
+        self.model = model
+        self.url = None
+        self.status = None
+        self.error = None
+        self.usage = None
+        self.phases = {}
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.finished = None
+        self.instrumentation = None
+        self._headers_at = None
+
+    def add(self, phase: str, seconds: float):
+        """
+        Adds time to a phase.
+
+        Parameters:
+        - `phase`: The name of the phase.
+        - `seconds`: The time to add.
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @property
+    def duration(self):
+        """
+        The seconds from the start of the request until it finished, or until now if it is still running.
+        """
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def tokens_per_second(self):
+        """
+        The generated tokens per second of the whole request, if the response reported its `usage`.
+        """
+        tokens = (self.usage or {}).get("completion_tokens")
+        if not tokens or not self.duration:
+            return None
+        return tokens / self.duration
+
+    def to_span(self):
+        """
+        Returns the request as a dictionary following the OpenTelemetry span data model.
+
+        Every phase is an event of the span, with its duration as an attribute.
+        """
+        attributes = {"http.request.method": self.method, "multia.endpoint": self.path}
+        if self.model is not None:
+            attributes["multia.model"] = self.model
+        if self.url is not None:
+            attributes["url.full"] = self.url
+        if self.status is not None:
+            attributes["http.response.status_code"] = self.status
+        if self.usage:
+            attributes.update({f"multia.usage.{key}": value for key, value in self.usage.items()
+                               if isinstance(value, (int, float))})
+        start = int(self.start_time * 1e9)
+        return {
+            "name": f"{self.method} {self.path}",
+            "kind": "CLIENT",
+            "start_time_unix_nano": start,
+            "end_time_unix_nano": start + int(self.duration * 1e9),
+            "attributes": attributes,
+            "events": [{"name": phase, "attributes": {"duration_s": seconds}}
+                       for phase, seconds in sorted(self.phases.items(), key=lambda item: PHASES.index(item[0]))],
+            "status": {"code": "ERROR", "description": repr(self.error)} if self.error is not None else {"code": "OK"},
+        }
+
+
+class Instrumentation:
+    """
+    A class that exposes hooks called around every request of the client, and a built-in `collector`.
+
+    Request hooks are called with the `RequestTiming` before the request is sent, and response hooks once the
+    request is over: when its response has been parsed, when its streamed body is closed, or when it failed.
+    """
+    def __init__(self, collector: bool = True):
+        """
+        Initializes the `Instrumentation` class.
+
+        Parameters:
+        - `collector` (optional): Whether to aggregate the requests in a `MetricsCollector`.
+        """
+        self.request_hooks = []
+        self.response_hooks = []
+        self.collector = MetricsCollector() if collector else None
+        if self.collector is not None:
+            self.response_hooks.append(self.collector.observe)
+
+    def on_request(self, hook):
+        """
+        Registers a hook called with the `RequestTiming` of every request before it is sent.
+
+        Parameters:
+        - `hook`: The callable to register, it is returned so this can be used as a decorator.
+        """
+        self.request_hooks.append(hook)
+        return hook
+
+    def on_response(self, hook):
+        """
+        Registers a hook called with the `RequestTiming` of every request once it is over.
+
+        Parameters:
+        - `hook`: The callable to register, it is returned so this can be used as a decorator.
+        """
+        self.response_hooks.append(hook)
+        return hook
+
+    def request_started(self, timing: RequestTiming):
+        timing.instrumentation = self
+        for hook in self.request_hooks:
+            hook(timing)
+
+    def request_finished(self, timing: RequestTiming):
+        if timing.finished is not None:
+            return
+        timing.finished = time.perf_counter()
+        for hook in self.response_hooks:
+            hook(timing)
+
+
+class MetricsCollector:
+    """
+    A class that aggregates the timings of the requests in latency histograms by endpoint, model and phase.
+
+    It also keeps a histogram of the generated tokens per second, and the most recent requests as spans.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_spans: int = 1000):
+        """
+        Initializes the `MetricsCollector` class.
+
+        Parameters:
+        - `buckets` (optional): The upper bounds in seconds of the latency histogram buckets.
+        - `max_spans` (optional): The number of recent requests kept by `spans`.
+        """
+        self.buckets = tuple(buckets)
+        self.latency = {}
+        self.tokens_per_second = {}
+        self.errors = {}
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def observe(self, timing: RequestTiming):
+        """
+        Adds a finished request to the metrics.
+
+        Parameters:
+        - `timing`: The `RequestTiming` of the request.
+        """
+        with self._lock:
+            key = (timing.path, timing.model or "")
+            for phase, seconds in list(timing.phases.items()) + [("total", timing.duration)]:
+                self._histogram(self.latency, key + (phase,), self.buckets).observe(seconds)
+            if timing.tokens_per_second is not None:
+                self._histogram(self.tokens_per_second, key, (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+                                ).observe(timing.tokens_per_second)
+            if timing.error is not None or (timing.status or 0) >= 400:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self._spans.append(timing)
+
+    @staticmethod
+    def _histogram(histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def spans(self):
+        """
+        Returns the most recent requests as OpenTelemetry-compatible span dictionaries.
+        """
+        with self._lock:
+            return [timing.to_span() for timing in self._spans]
+
+    def summary(self):
+        """
+        Returns, for every endpoint, model and phase, the `count`, `mean`, `p50` and `p99` latency in seconds.
+        """
+        with self._lock:
+            return {key: histogram.summary() for key, histogram in self.latency.items()}
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = ["# HELP multia_request_phase_seconds Time spent in each phase of the requests.",
+                 "# TYPE multia_request_phase_seconds histogram"]
+        with self._lock:
+            for (path, model, phase), histogram in sorted(self.latency.items()):
+                lines += histogram.prometheus("multia_request_phase_seconds",
+                                              f'endpoint="{_escape(path)}",model="{_escape(model)}",phase="{phase}"')
+            lines += ["# HELP multia_tokens_per_second Generated tokens per second of the requests.",
+                      "# TYPE multia_tokens_per_second histogram"]
+            for (path, model), histogram in sorted(self.tokens_per_second.items()):
+                lines += histogram.prometheus("multia_tokens_per_second",
+                                              f'endpoint="{_escape(path)}",model="{_escape(model)}"')
+            lines += ["# HELP multia_request_errors_total Requests that failed or got an error status.",
+                      "# TYPE multia_request_errors_total counter"]
+            for (path, model), count in sorted(self.errors.items()):
+                lines.append(f'multia_request_errors_total{{endpoint="{_escape(path)}",model="{_escape(model)}"}} '
+                             f'{count}')
+        return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """
+    A class with cumulative bucket counts, as Prometheus histograms.
+    """
+    def __init__(self, buckets):
+        """
+        Initializes the `Histogram` class.
+
+        Parameters:
+        - `buckets`: The upper bounds of the buckets, in increasing order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """
+        Adds a value to the histogram.
+        """
+        index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """
+        Estimates a quantile, interpolating inside its bucket.
+
+        Parameters:
+        - `q`: The quantile, between 0 and 1.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self):
+        return {"count": self.count, "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def measure(response, phase: str):
+    """
+    Returns a context manager that adds the time spent inside it to a phase of the request of a response.
+
+    It does nothing if the client has no instrumentation.
+
+    Parameters:
+    - `response`: The response returned by the transport.
+    - `phase`: The name of the phase, usually "parse" or "build".
+    """
+    return _Measure(getattr(response, "timing", None), phase)
+
+
+def parse_json(response, finished: bool = True, check_status: bool = False):
+    """
+    Decodes the JSON body of a response, timing it as the "parse" phase of its request.
+
+    Parameters:
+    - `response`: The response returned by the transport.
+    - `finished` (optional): Whether the request is over once its body is decoded, False when the caller still
+      builds response objects from it and reports the end with `finish`.
+    - `check_status` (optional): Whether to raise an `APIError` for an error status instead of decoding the body,
+      for the callers that must not cache an error.
+
+    Returns:
+    - The decoded JSON body.
+
+    Raises:
+    - `APIError`: If `check_status` is True and the status of the response is not successful. The request is
+      over then.
+    """
+    if check_status:
+        try:
+            raise_for_status(response)
+        except APIError as error:
+            timing = getattr(response, "timing", None)
+            if timing is not None:
+                timing.error = error
+            finish(response)
+            raise
+    with measure(response, "parse"):
+        data = loads(response.content)
+    if finished:
+        finish(response)
+    return data
+
+
+def finish(response, usage: dict = None):
+    """
+    Reports that the request of a response is over, once its body has been parsed.
+
+    It does nothing if the client has no instrumentation.
+
+    Parameters:
+    - `response`: The response returned by the transport.
+    - `usage` (optional): The token usage reported by the response.
+    """
+    timing = getattr(response, "timing", None)
+    if timing is not None:
+        if usage is not None:
+            timing.usage = usage
+        timing.instrumentation.request_finished(timing)
+
+
+class _Measure:
+    def __init__(self, timing, phase):
+        self.timing = timing
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timing is not None:
+            self.timing.add(self.phase, time.perf_counter() - self.started)
+
+
+def opentelemetry_hook(tracer=None):
+    """
+    Returns a response hook that records every request as a span with OpenTelemetry.
+
+    Requires the `opentelemetry-api` package.
+
+    Parameters:
+    - `tracer` (optional): The tracer the spans are created with, by default the tracer of the global provider.
+    """
+    from opentelemetry import trace
+
+    tracer = tracer or trace.get_tracer("openMultIA")
+
+    def hook(timing):
+        data = timing.to_span()
+        span = tracer.start_span(data["name"], kind=trace.SpanKind.CLIENT,
+                                 start_time=data["start_time_unix_nano"], attributes=data["attributes"])
+        for event in data["events"]:
+            span.add_event(event["name"], attributes=event["attributes"])
+        if timing.error is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, data["status"]["description"]))
+        span.end(end_time=data["end_time_unix_nano"])
+    return hook
+
+
+def httpx_trace(timing: RequestTiming):
+    """
+    Returns the `trace` extension of an `httpx` request, which records the connection setup, the upload and
+    the time to first byte of the request in its timing.
+    """
+    started = {}
+
+    async def trace(name, info):
+        step, _, event = name.rpartition(".")
+        if event == "started":
+            started[step] = time.perf_counter()
+        elif step in started:
+            phase = _TRACE_PHASES.get(step.partition(".")[2])
+            if phase is not None:
+                timing.add(phase, time.perf_counter() - started.pop(step))
+            if phase == "ttfb":
+                timing._headers_at = time.perf_counter()
+    return trace
+
+
+_TRACE_PHASES = {"connect_tcp": "connect", "connect_unix_socket": "connect", "start_tls": "connect",
+                 "send_request_headers": "upload", "send_request_body": "upload",
+                 "receive_response_headers": "ttfb"}
+
+
+# The timing of the request being sent by the current thread, filled by the connection classes below.
+current = threading.local()
+
+
+def server_time(headers):
+    """
+    Returns the processing time reported by the server in the response headers, in seconds, or None.
+    """
+    process_time = headers.get("X-Process-Time")
+    if process_time is not None:
+        try:
+            return float(process_time)
+        except ValueError:
+            return None
+    match = re.search(r"dur=([0-9.]+)", headers.get("Server-Timing", ""))
+    return float(match.group(1)) / 1000 if match else None
+
+
+def timed_pool_classes():
+    """
+    Returns the urllib3 connection pool classes whose connections time the connection setup, the upload and the
+    time to first byte of the request being sent by the current thread.
+
+    Returns:
+    - A dictionary mapping the "http" and "https" schemes to their pool class.
+    """
+    global _timed_pools
+    if _timed_pools is None:
+        # Imported here so that importing this module alone does not load urllib3, the transports import it anyway.
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        class TimedHTTPConnection(_TimedConnection, HTTPConnection):
+            pass
+
+        class TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+            pass
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+
+        _timed_pools = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+    return _timed_pools
+
+
+_timed_pools = None
+
+
+class _TimedConnection:
+    """
+    A mixin for the urllib3 connections that times the connection setup, the upload and the time to first byte.
+    """
+    def connect(self):
+        with _Measure(getattr(current, "timing", None), "connect"):
+            return super().connect()
+
+    def request(self, *args, **kwargs):
+        with _Measure(getattr(current, "timing", None), "upload"):
+            return super().request(*args, **kwargs)
+
+    def request_chunked(self, *args, **kwargs):
+        with _Measure(getattr(current, "timing", None), "upload"):
+            return super().request_chunked(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        timing = getattr(current, "timing", None)
+        with _Measure(timing, "ttfb"):
+            response = super().getresponse(*args, **kwargs)
+        if timing is not None:
+            timing._headers_at = time.perf_counter()
+        return response
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
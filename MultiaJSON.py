@@ -0,0 +1,27 @@
+import json
+
+
+def loads(data):
+    """
+    Decodes a JSON document, with `orjson` if it is installed and the standard `json` module otherwise.
+
+    Parameters:
+    - `data`: The JSON document, as bytes or str.
+
+    Returns:
+    - The decoded object.
+    """
+    global _loads
+    if _loads is None:
+        # orjson decodes several times faster than the standard library, it is imported on first use
+        # as it is slow to import.
+        try:
+            import orjson
+
+            _loads = orjson.loads
+        except ImportError:
+            _loads = json.loads
+    return _loads(data)
+
+
+_loads = None
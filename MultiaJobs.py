@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Union
+
+import requests
+
+from MultiaCache import request_key
+from MultiaErrors import APIError
+
+
+# The network errors that can go away when a job is tried again.
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+
+class ImageJobRunner:
+    """
+    A class that runs bulk image generation jobs that can be resumed after a failure.
+
+    Every job is recorded in an append-only JSONL log in the output directory, so after a crash or a network
+    failure the same run can be started again and only the jobs that did not complete are sent. The outputs
+    are written to a content-addressed directory, named after the SHA-256 digest of their content.
+    """
+    def __init__(self, client,
+                 directory: str,
+                 max_concurrency: int = 4,
+                 retries: int = 3,
+                 backoff_factor: float = 1.0):
+        """
+        Initializes the `ImageJobRunner` class, replaying the log of the directory if it exists.
+
+        Parameters:
+        - `client`: The `OpenMultIA` client the images are generated with.
+        - `directory`: The directory of the outputs and of the `jobs.jsonl` log, created if it does not exist.
+        - `max_concurrency` (optional): The maximum number of jobs in flight at the same time.
+        - `retries` (optional): How many times a job that failed with a network error, a rate limit (429) or a
+          server error (5xx) is retried during a run. Other errors fail the job at once.
+        - `backoff_factor` (optional): The base delay in seconds of the exponential backoff between retries.
+        """
+        self.client = client
+        self.directory = directory
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.log_path = os.path.join(directory, "jobs.jsonl")
+        self.jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._replay()
+
+    def run(self, jobs: Iterable[Union[str, dict]],
+            model: str,
+            n: int = 1,
+            number_steps: int = 4,
+            priority: int = 1):
+        """
+        Runs the jobs that have not completed yet, with at most `max_concurrency` of them in flight.
+
+        A job is identified by its request, so it is skipped if a previous run with the same model, prompt and
+        parameters has completed it and its output is still in the directory.
+
+        Parameters:
+        - `jobs`: The prompts to generate, or dictionaries with a `prompt` and optionally `model`, `n`,
+          `number_steps` and `priority` overriding the defaults of the run.
+        - `model`: The image generation model.
+        - `n` (optional): The number of images of every prompt.
+        - `number_steps` (optional): The number of steps of the image generation.
+        - `priority` (optional): The priority of the requests.
+
+        Returns:
+        - A generator of `JobResult` objects, one per job, yielded as they complete. Completed jobs are
+          yielded first, with `skipped` set.
+        """
+        pending = []
+        for job in jobs:
+            request = {"model": model, "n": n, "number_steps": number_steps, "priority": priority}
+            request.update({"prompt": job} if isinstance(job, str) else job)
+            job_id = request_key("/images/generations", request)
+            record = self.jobs.get(job_id)
+            if record is not None and record["status"] == "done" and os.path.exists(self._path(record["output"])):
+                yield JobResult(job_id, request, self._path(record["output"]), skipped=True)
+            else:
+                pending.append((job_id, request))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [executor.submit(self._run_job, job_id, request) for job_id, request in pending]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _run_job(self, job_id, request):
+        for attempt in range(self.retries + 1):
+            self._log({"job": job_id, "status": "started", "request": request, "attempt": attempt})
+            try:
+                output = self._generate(request)
+            except Exception as error:
+                self._log({"job": job_id, "status": "failed", "error": repr(error), "attempt": attempt})
+                if attempt == self.retries or not _transient(error):
+                    return JobResult(job_id, request, error=error)
+                time.sleep(self.backoff_factor * 2 ** attempt)
+                continue
+            self._log({"job": job_id, "status": "done", "output": output})
+            return JobResult(job_id, request, self._path(output))
+
+    def _generate(self, request):
+        """
+        Generates the images of a request and writes them to the content-addressed directory.
+
+        Returns:
+        - The path of the output, relative to the directory.
+        """
+        response = self.client.images.generate(request["model"], request["prompt"], n=request["n"],
+                                               number_steps=request["number_steps"], priority=request["priority"],
+                                               coalesce=False)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            try:
+                with response:
+                    for chunk in response.iter_bytes():
+                        digest.update(chunk)
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        digest = digest.hexdigest()
+        output = os.path.join(digest[:2], f"{digest}.{'zip' if request['n'] > 1 else 'jpg'}")
+        os.makedirs(os.path.dirname(self._path(output)), exist_ok=True)
+        os.replace(f.name, self._path(output))
+        return output
+
+    def _path(self, output):
+        return os.path.join(self.directory, output)
+
+    def _log(self, record):
+        record["time"] = time.time()
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as log:
+                log.write(json.dumps(record) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+            self._apply(record)
+
+    def _replay(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the process died while writing it.
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        job = self.jobs.setdefault(record["job"], {"status": None, "output": None, "attempts": 0})
+        job["status"] = record["status"]
+        if record["status"] == "started":
+            job["request"] = record["request"]
+            job["attempts"] += 1
+        elif record["status"] == "done":
+            job["output"] = record["output"]
+        elif record["status"] == "failed":
+            job["error"] = record["error"]
+
+    def status(self):
+        """
+        Returns the number of jobs of the log by status: "done", "failed" and "started" (interrupted or in flight).
+        """
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+
+class JobResult:
+    """
+    A class representing the outcome of one image generation job.
+    """
+    def __init__(self, job_id: str, request: dict, output: str = None, error: Exception = None,
+                 skipped: bool = False):
+        """
+        Initializes the `JobResult` class.
+
+        Parameters:
+        - `job_id`: The ID of the job, the hash of its request.
+        - `request`: The parameters of the request.
+        - `output` (optional): The path of the generated jpg image or zip archive, if the job succeeded.
+        - `error` (optional): The exception raised by the last attempt, if the job failed.
+        - `skipped` (optional): Whether the job had already been completed by a previous run.
+        """
+        self.job_id = job_id
+        self.request = request
+        self.output = output
+        self.error = error
+        self.skipped = skipped
+
+    @property
+    def ok(self):
+        """
+        Whether the job succeeded.
+        """
+        return self.error is None
+
+
+def _transient(error):
+    """
+    Returns whether a failed job can succeed when it is tried again: after a network error, a rate limit (429) or
+    a server error (5xx). Client errors such as an invalid request fail on the first attempt.
+    """
+    if isinstance(error, APIError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
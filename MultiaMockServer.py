@@ -0,0 +1,272 @@
+import argparse
+import io
+import json
+import threading
+import time
+import wave
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockServer:
+    """
+    A local stand-in for a MultAI server, to benchmark and test the client without GPUs.
+
+    It answers every endpoint of the API with generated content of a configurable size, after a configurable
+    latency, over keep-alive HTTP/1.1 connections. The server runs in a background thread, or in its own process
+    with `python MultiaMockServer.py`, which prints its URL and serves until it is stopped.
+    """
+    def __init__(self, host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: float = 0.0,
+                 token_latency: float = 0.0,
+                 completion_tokens: int = 32,
+                 image_size: int = 64 * 1024,
+                 audio_seconds: float = 1.0,
+                 models: dict = None,
+                 sessions: bool = False):
+        """
+        Initializes the `MockServer` class.
+
+        Parameters:
+        - `host` (optional): The address the server listens on.
+        - `port` (optional): The port the server listens on, 0 picks a free port.
+        - `latency` (optional): Seconds every request waits before its response is sent, imitating the inference.
+        - `token_latency` (optional): Seconds between the chunks of a streamed chat completion.
+        - `completion_tokens` (optional): The number of tokens of every chat completion.
+        - `image_size` (optional): The size in bytes of every generated image.
+        - `audio_seconds` (optional): The duration of the synthesized speech, as a 16 kHz mono WAV file.
+        - `models` (optional): The catalog returned by `/list/models`.
+        - `sessions` (optional): Whether to keep the messages of chat sessions, so requests with a `session_id`
+          and a `prefix_length` only carry the new messages.
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.image_size = image_size
+        self.audio_seconds = audio_seconds
+        self.models = models or {"chat": ["mock-chat"], "vision": ["mock-vision"], "audio": ["mock-audio"],
+                                 "image": ["mock-image"]}
+        self.sessions = {} if sessions else None
+        self._server = _HTTPServer((host, port), _handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The base URL of the server.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+
+        Returns:
+        - The server itself.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def completion(self, request: dict):
+        tokens = min(self.completion_tokens, request.get("max_tokens") or self.completion_tokens)
+        return {"id": "mock", "object": "chat.completion", "created": int(time.time()), "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(["token"] * tokens)},
+                             "finish_reason": "length" if tokens == request.get("max_tokens") else "stop",
+                             "logprobs": None}],
+                "usage": _usage(request, tokens), **self._session_echo(request)}
+
+    def completion_chunks(self, request: dict):
+        tokens = min(self.completion_tokens, request.get("max_tokens") or self.completion_tokens)
+        chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model"), **self._session_echo(request)}
+        yield dict(chunk, choices=[{"index": 0, "delta": {"role": "assistant"}}])
+        for _ in range(tokens):
+            yield dict(chunk, choices=[{"index": 0, "delta": {"content": "token "}}])
+        yield dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}], usage=_usage(request, tokens))
+
+    def _session_echo(self, request):
+        if self.sessions is None or request.get("session_id") is None:
+            return {}
+        return {"session_id": request["session_id"]}
+
+    def speech(self):
+        return silent_wav(self.audio_seconds)
+
+    def images(self, n: int):
+        image = _jpeg(self.image_size)
+        if n <= 1:
+            return image
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as images:
+            for index in range(n):
+                images.writestr(f"image_{index}.jpg", image)
+        return archive.getvalue()
+
+
+def silent_wav(seconds: float, rate: int = 16000):
+    """
+    Returns a 16-bit mono WAV file of silence.
+
+    Parameters:
+    - `seconds`: The duration of the audio.
+    - `rate` (optional): The sample rate.
+    """
+    audio = io.BytesIO()
+    with wave.open(audio, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * int(seconds * rate))
+    return audio.getvalue()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections opened by a burst of concurrent clients.
+    request_queue_size = 1024
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, Nagle's algorithm would delay the body until the next ACK.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/list/models":
+                return self._send(404, b'{"detail": "Not Found"}')
+            self._send(200, json.dumps(server.models).encode("utf-8"))
+
+        def do_POST(self):
+            body = self._read_body()
+            time.sleep(server.latency)
+            path = self.path.rstrip("/")
+            if path == "/chat/completions":
+                request = json.loads(body)
+                if self._session(request) is None:
+                    return self._send(404, b'{"detail": "Unknown session"}')
+                if request.get("stream"):
+                    return self._send_events(server.completion_chunks(request))
+                return self._send(200, json.dumps(server.completion(request)).encode("utf-8"))
+            if path in ("/audio/transcriptions", "/audio/translations"):
+                return self._send(200, json.dumps({"text": f"{len(body)} bytes of audio"}).encode("utf-8"))
+            if path == "/audio/speech":
+                return self._send(200, server.speech(), "audio/wav")
+            if path == "/images/generations":
+                n = int(json.loads(body).get("n") or 1)
+                return self._send(200, server.images(n), "application/zip" if n > 1 else "image/jpeg")
+            if path == "/vision":
+                request = json.loads(body)
+                content = f"An image of {len(request.get('image') or '')} base64 characters"
+                return self._send(200, json.dumps({"content": content}).encode("utf-8"))
+            self._send(404, b'{"detail": "Not Found"}')
+
+        def _session(self, request):
+            """
+            Prepends the messages held for the session of the request, or returns None if the session is unknown.
+            """
+            session_id = request.get("session_id")
+            if server.sessions is None or session_id is None:
+                return request
+            prefix = server.sessions.get(session_id, []) if request.get("prefix_length") else []
+            if len(prefix) != (request.get("prefix_length") or 0):
+                return None
+            request["messages"] = prefix + request["messages"]
+            # The reply is part of the prefix of the next turn.
+            server.sessions[session_id] = request["messages"] + [{"role": "assistant", "content": "token"}]
+            return request
+
+        def _read_body(self):
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if not size:
+                        self.rfile.readline()
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def _send(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-Process-Time", f"{server.latency:.6f}")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_events(self, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                if server.token_latency:
+                    time.sleep(server.token_latency)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+    return Handler
+
+
+def _usage(request, tokens):
+    prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in request.get("messages") or []
+                        if isinstance(message, dict))
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+
+
+def _jpeg(size):
+    # Only the markers are valid, enough for clients that store the bytes without decoding them.
+    return b"\xff\xd8" + b"\0" * max(0, size - 4) + b"\xff\xd9"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a mock MultAI server until it is stopped.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="The port to listen on, 0 picks a free port")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--image-size", type=int, default=64 * 1024)
+    parser.add_argument("--audio-seconds", type=float, default=1.0)
+    parser.add_argument("--sessions", action="store_true", help="Keep the messages of chat sessions")
+    args = parser.parse_args(argv)
+
+    server = MockServer(args.host, args.port, args.latency, args.token_latency, args.completion_tokens,
+                        args.image_size, args.audio_seconds, sessions=args.sessions)
+    # The first line of the output is the URL, for the processes that start the server.
+    print(server.url, flush=True)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import datetime
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from MultiaCache import request_key
+
+MAGIC = b"MULTIAR1"
+# Every record starts with the sizes of its metadata and of its body.
+_RECORD = struct.Struct("<II")
+# The archive ends with the offset of its index and the magic number, once it has been closed.
+_FOOTER = struct.Struct("<Q8s")
+# The bodies of these content types are compressed, images and audio are already compressed.
+_TEXT_TYPES = ("application/json", "text/", "application/x-ndjson")
+# These headers describe the body as it was sent by the server, not as it is stored.
+_BODY_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+class ReplayArchive:
+    """
+    A class that stores recorded responses in one file, indexed by their request.
+
+    The file starts with a magic number followed by one record per response: its metadata as JSON (the status,
+    the headers, the wait for the headers and the size and delay of every chunk of the body) and its body,
+    compressed if it is text. A body identical to one already in the archive is not stored again, its record
+    points to the record holding it. The index from the keys of the requests to the offsets of their records is
+    written at the end of the file when the archive is closed. If it is missing, because the recording process
+    died, it is rebuilt by scanning the records.
+    """
+    def __init__(self, path: str, mode: str = "r"):
+        """
+        Initializes the `ReplayArchive` class, opening or creating the file.
+
+        Parameters:
+        - `path`: The path of the archive.
+        - `mode` (optional): "r" to read the archive, or "a" to add records to it, creating it if it does not exist.
+
+        Raises:
+        - `ValueError`: If the file is not a replay archive.
+        """
+        self.path = path
+        self.mode = mode
+        self.index = {}
+        # The offsets of the records holding each body, by the SHA-256 digest of the body.
+        self.bodies = {}
+        self._lock = threading.Lock()
+        if mode == "a" and not (os.path.exists(path) and os.path.getsize(path)):
+            self._file = open(path, "w+b")
+            self._file.write(MAGIC)
+            self._end = len(MAGIC)
+            return
+
+        self._file = open(path, "r+b" if mode == "a" else "rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not a replay archive")
+        self._end = self._load_index()
+        if mode == "a":
+            # The records are added in place of the index, which is written again on `close`.
+            self._file.truncate(self._end)
+
+    def _load_index(self):
+        """
+        Loads the index of the archive.
+
+        Returns:
+        - The offset of the end of the last complete record.
+        """
+        size = self._file.seek(0, 2)
+        if size >= len(MAGIC) + _FOOTER.size:
+            self._file.seek(size - _FOOTER.size)
+            offset, magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+            if magic == MAGIC and len(MAGIC) <= offset < size:
+                self._file.seek(offset)
+                try:
+                    index = json.loads(zlib.decompress(self._file.read(size - _FOOTER.size - offset)))
+                    self.index, self.bodies = index["records"], index["bodies"]
+                    return offset
+                except (zlib.error, ValueError, KeyError):
+                    self.index, self.bodies = {}, {}
+
+        offset = len(MAGIC)
+        while True:
+            self._file.seek(offset)
+            header = self._file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return offset
+            meta_size, body_size = _RECORD.unpack(header)
+            if offset + _RECORD.size + meta_size + body_size > size:
+                # The last record was not completely written.
+                return offset
+            try:
+                meta = json.loads(self._file.read(meta_size))
+                self.index.setdefault(meta["key"], []).append(offset)
+            except (ValueError, KeyError):
+                return offset
+            if "digest" in meta:
+                self.bodies[meta["digest"]] = offset
+            offset += _RECORD.size + meta_size + body_size
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self.index.values())
+
+    def write(self, key: str, meta: dict, chunks):
+        """
+        Adds a response to the archive.
+
+        Parameters:
+        - `key`: The key of the request.
+        - `meta`: The metadata of the response.
+        - `chunks`: The body of the response, as a list of `(bytes, delay)` tuples.
+        """
+        body = b"".join(chunk for chunk, _ in chunks)
+        digest = hashlib.sha256(body).hexdigest()
+        meta = dict(meta, key=key, chunks=[[len(chunk), round(delay, 6)] for chunk, delay in chunks])
+        with self._lock:
+            if digest in self.bodies:
+                meta["body_at"] = self.bodies[digest]
+                body = b""
+            else:
+                meta["digest"] = digest
+                content_type = CaseInsensitiveDict(meta.get("headers") or {}).get("Content-Type", "")
+                if content_type.startswith(_TEXT_TYPES):
+                    compressed = zlib.compress(body)
+                    if len(compressed) < len(body):
+                        body = compressed
+                        meta["zlib"] = True
+                self.bodies[digest] = self._end
+            meta = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+            self._file.seek(self._end)
+            self._file.write(_RECORD.pack(len(meta), len(body)) + meta + body)
+            self._file.flush()
+            self.index.setdefault(key, []).append(self._end)
+            self._end += _RECORD.size + len(meta) + len(body)
+
+    def read(self, key: str, number: int = 0):
+        """
+        Reads a response of the archive.
+
+        Parameters:
+        - `key`: The key of the request.
+        - `number` (optional): Which of the responses recorded for the request is read, wrapping around once they
+          have all been read.
+
+        Returns:
+        - A tuple `(meta, chunks)`, with `chunks` a list of `(bytes, delay)` tuples.
+
+        Raises:
+        - `KeyError`: If no response was recorded for the request.
+        """
+        offsets = self.index.get(key)
+        if not offsets:
+            raise KeyError(key)
+        with self._lock:
+            meta, body = self._read_record(offsets[number % len(offsets)])
+            if "body_at" in meta:
+                holder, body = self._read_record(meta["body_at"])
+                meta["zlib"] = holder.get("zlib", False)
+        if meta.get("zlib"):
+            body = zlib.decompress(body)
+        chunks = []
+        offset = 0
+        for size, delay in meta["chunks"]:
+            chunks.append((body[offset:offset + size], delay))
+            offset += size
+        return meta, chunks
+
+    def _read_record(self, offset):
+        self._file.seek(offset)
+        meta_size, body_size = _RECORD.unpack(self._file.read(_RECORD.size))
+        return json.loads(self._file.read(meta_size)), self._file.read(body_size)
+
+    def close(self):
+        """
+        Writes the index at the end of the archive if records were added, and closes the file.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            if self.mode == "a":
+                self._file.seek(self._end)
+                index = {"records": self.index, "bodies": self.bodies}
+                self._file.write(zlib.compress(json.dumps(index, separators=(",", ":")).encode("utf-8")))
+                self._file.write(_FOOTER.pack(self._end, MAGIC))
+                self._file.truncate()
+            self._file.close()
+
+
+class Recorder:
+    """
+    A class that records the responses of the API in a `ReplayArchive` while they are received.
+
+    Streamed bodies are recorded chunk by chunk, with the delay between the chunks, once they have been fully
+    read. Responses whose body is not read to the end are not recorded.
+    """
+    def __init__(self, path: str):
+        """
+        Initializes the `Recorder` class.
+
+        Parameters:
+        - `path`: The path of the archive, the responses are added to it if it exists.
+        """
+        self.archive = ReplayArchive(path, "a")
+
+    def send(self, method: str, path: str, kwargs: dict, send):
+        """
+        Sends a request with `send()` and records its response.
+
+        Parameters:
+        - `method`: The HTTP method of the request.
+        - `path`: The path of the endpoint.
+        - `kwargs`: The arguments of the request, as given to `Transport.request`.
+        - `send`: A callable that sends the request to the server and returns the `requests.Response`.
+
+        Returns:
+        - The `requests.Response` of the server.
+        """
+        data = kwargs.get("data")
+        if hasattr(data, "digest"):
+            data.digest = hashlib.sha256()
+        started = time.perf_counter()
+        response = send()
+        wait = time.perf_counter() - started
+
+        key = _request_key(method, path, kwargs)
+        meta = {"method": method, "path": path, "status": response.status_code, "reason": response.reason,
+                "url": response.url, "wait": round(wait, 6),
+                "headers": {name: value for name, value in response.headers.items()
+                            if name.lower() not in _BODY_HEADERS}}
+        if not kwargs.get("stream"):
+            # The wait already includes the download of the body.
+            self.archive.write(key, meta, [(response.content, 0.0)])
+        else:
+            response.raw = _RecordingStream(response.raw, lambda chunks: self.archive.write(key, meta, chunks))
+        return response
+
+    def close(self):
+        """
+        Closes the archive, writing its index.
+        """
+        self.archive.close()
+
+
+class Replayer:
+    """
+    A class that answers the requests with the responses of a `ReplayArchive`, without any server.
+
+    Requests are matched by their method, path and body, except their `priority`. When the same request was
+    recorded several times, its responses are replayed in order and then again from the first one. The responses
+    are delayed like the original ones, scaled by `time_scale`.
+    """
+    def __init__(self, path: str, time_scale: float = 1.0):
+        """
+        Initializes the `Replayer` class.
+
+        Parameters:
+        - `path`: The path of the archive.
+        - `time_scale` (optional): The factor applied to the recorded delays, 1.0 replays the original timing,
+          0.5 replays twice as fast and 0 replays without any delay.
+        """
+        self.archive = ReplayArchive(path, "r")
+        self.time_scale = time_scale
+        self._replayed = {}
+        self._lock = threading.Lock()
+
+    def send(self, method: str, path: str, kwargs: dict, send=None):
+        """
+        Returns the recorded response of a request.
+
+        Parameters:
+        - `method`: The HTTP method of the request.
+        - `path`: The path of the endpoint.
+        - `kwargs`: The arguments of the request, as given to `Transport.request`.
+        - `send` (optional): Unused, the request is never sent.
+
+        Returns:
+        - A `requests.Response` with the recorded status, headers and body.
+
+        Raises:
+        - `KeyError`: If no response was recorded for the request.
+        """
+        data = kwargs.get("data")
+        if hasattr(data, "digest"):
+            # The body is read as if it was uploaded, to identify the request.
+            data.digest = hashlib.sha256()
+            for _ in data:
+                pass
+        key = _request_key(method, path, kwargs)
+        with self._lock:
+            number = self._replayed.get(key, 0)
+            self._replayed[key] = number + 1
+        try:
+            meta, chunks = self.archive.read(key, number)
+        except KeyError:
+            raise KeyError(f"No response was recorded for this {method} {path} request") from None
+
+        self._sleep(meta["wait"])
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.reason = meta.get("reason")
+        response.url = meta.get("url") or path
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = datetime.timedelta(seconds=meta["wait"])
+        if kwargs.get("stream"):
+            response.raw = _ReplayStream(chunks, self._sleep)
+        else:
+            response._content = b"".join(chunk for chunk, _ in chunks)
+        return response
+
+    def _sleep(self, delay):
+        if delay and self.time_scale:
+            time.sleep(delay * self.time_scale)
+
+    def close(self):
+        """
+        Closes the archive.
+        """
+        self.archive.close()
+
+
+class _RecordingStream:
+    """
+    A wrapper of the `urllib3` response of a streamed body, that records its chunks while they are read.
+    """
+    def __init__(self, raw, on_complete):
+        self._raw = raw
+        self._on_complete = on_complete
+        self._chunks = []
+        self._last = time.perf_counter()
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._add(chunk)
+            yield chunk
+        self._complete()
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        chunk = self._raw.read(amt, decode_content=decode_content, **kwargs)
+        if chunk:
+            self._add(chunk)
+        if not chunk or amt is None:
+            self._complete()
+        return chunk
+
+    def _add(self, chunk):
+        now = time.perf_counter()
+        self._chunks.append((chunk, now - self._last))
+        self._last = now
+
+    def close(self):
+        # Readers such as the event streams stop before the end of the body, its rest is read so the recording
+        # replays the whole body.
+        if self._on_complete is not None:
+            try:
+                for chunk in self._raw.stream(2 ** 16, decode_content=True):
+                    self._add(chunk)
+            except Exception:
+                self._on_complete = None
+            self._complete()
+        self._raw.close()
+
+    def _complete(self):
+        if self._on_complete is not None:
+            on_complete, self._on_complete = self._on_complete, None
+            on_complete(self._chunks)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _ReplayStream:
+    """
+    A stand-in for the `urllib3` response of a streamed body, that returns the recorded chunks with their delays.
+    """
+    def __init__(self, chunks, sleep):
+        self._chunks = iter(chunks)
+        self._sleep = sleep
+        self._buffer = b""
+        self.closed = False
+
+    def _next(self):
+        for chunk, delay in self._chunks:
+            self._sleep(delay)
+            return chunk
+        return b""
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        while not self.closed:
+            chunk = self._buffer or self._next()
+            self._buffer = b""
+            if not chunk:
+                return
+            if amt and len(chunk) > amt:
+                chunk, self._buffer = chunk[:amt], chunk[amt:]
+            yield chunk
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        if amt is None:
+            data = self._buffer + b"".join(iter(self._next, b""))
+            self._buffer = b""
+            return data
+        while not self._buffer:
+            self._buffer = self._next()
+            if not self._buffer:
+                return b""
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _request_key(method, path, kwargs):
+    """
+    Returns the key of a request in a `ReplayArchive`, from its method, path, JSON or form fields and body.
+    """
+    data = kwargs.get("data")
+    fields = kwargs.get("json") or (data if isinstance(data, dict) else {})
+    digest = None
+    if isinstance(data, (bytes, bytearray)):
+        digest = hashlib.sha256(data).hexdigest()
+    elif getattr(data, "digest", None) is not None:
+        digest = data.digest.hexdigest()
+    # A streamed and a complete response of the same request are different recordings.
+    return request_key(f"{method} {path}{' stream' if kwargs.get('stream') else ''}", fields, digest)
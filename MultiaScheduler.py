@@ -0,0 +1,152 @@
+import itertools
+import threading
+import time
+from typing import Dict, Union
+
+
+class Scheduler:
+    """
+    A class that dispatches the requests of the client by priority, within concurrency and rate limits.
+
+    A request waits in a priority queue until a slot is free: lower `priority` values go out first and ties keep
+    their arrival order. A waiting request whose model is at its limit does not block the requests of other
+    models behind it. With `max_tokens`, requests are also limited by the tokens they can use, so a few long
+    prompts take as much room as many short ones. The time every request spends in the queue is recorded by
+    priority.
+    """
+    def __init__(self, max_concurrency: int = None,
+                 model_concurrency: Union[int, Dict[str, int]] = None,
+                 rate: float = None,
+                 burst: int = None,
+                 max_tokens: int = None):
+        """
+        Initializes the `Scheduler` class.
+
+        Parameters:
+        - `max_concurrency` (optional): The maximum number of requests in flight at the same time, None for no limit.
+        - `model_concurrency` (optional): The maximum number of requests in flight for each model, either one
+          limit for every model or a dictionary mapping model names to their limit.
+        - `rate` (optional): The maximum number of requests sent per second, None for no limit.
+        - `burst` (optional): The number of requests that can be sent at once before `rate` applies,
+          by default one second worth of requests.
+        - `max_tokens` (optional): The maximum number of tokens (prompt plus `max_tokens`) of the requests in
+          flight at the same time, None for no limit. Requests without an estimate count as 0 tokens, and a
+          request bigger than the limit is sent alone.
+        """
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate or 1))
+        self.max_tokens = max_tokens
+        self.active = 0
+        self.active_tokens = 0
+        self._active_models = {}
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._queue_times = {}
+
+    def acquire(self, priority: int = 1, model: str = None, tokens: int = None):
+        """
+        Waits until the request can be sent.
+
+        Parameters:
+        - `priority` (optional): The priority of the request, lower values go out first.
+        - `model` (optional): The model of the request, for the per-model limits.
+        - `tokens` (optional): The estimated tokens of the request, for the `max_tokens` limit.
+        """
+        queued_at = time.monotonic()
+        waiter = [priority, next(self._sequence), model, False, tokens or 0]
+        with self._condition:
+            self._queue.append(waiter)
+            self._queue.sort()
+            while True:
+                delay = self._dispatch()
+                if waiter[3]:
+                    break
+                self._condition.wait(delay)
+            stats = self._queue_times.setdefault(priority, {"count": 0, "total": 0.0, "max": 0.0})
+            waited = time.monotonic() - queued_at
+            stats["count"] += 1
+            stats["total"] += waited
+            stats["max"] = max(stats["max"], waited)
+
+    def release(self, model: str = None, tokens: int = None):
+        """
+        Frees the slot of a request once it has finished.
+
+        Parameters:
+        - `model` (optional): The model of the request, as given to `acquire`.
+        - `tokens` (optional): The estimated tokens of the request, as given to `acquire`.
+        """
+        with self._condition:
+            self.active -= 1
+            self.active_tokens -= tokens or 0
+            self._active_models[model] -= 1
+            self._condition.notify_all()
+
+    def _model_limit(self, model):
+        if isinstance(self.model_concurrency, dict):
+            return self.model_concurrency.get(model)
+        return self.model_concurrency
+
+    def _dispatch(self):
+        """
+        Grants slots to the waiting requests in priority order.
+
+        Returns:
+        - The seconds until the rate limit allows another request, or None to wait for a release.
+        """
+        if self.rate is not None:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+
+        granted = False
+        delay = None
+        for waiter in list(self._queue):
+            if self.max_concurrency is not None and self.active >= self.max_concurrency:
+                break
+            tokens = waiter[4]
+            if self.max_tokens is not None and self.active and self.active_tokens + tokens > self.max_tokens:
+                break
+            model = waiter[2]
+            limit = self._model_limit(model)
+            if limit is not None and self._active_models.get(model, 0) >= limit:
+                continue
+            if self.rate is not None:
+                if self._tokens < 1:
+                    delay = (1 - self._tokens) / self.rate
+                    break
+                self._tokens -= 1
+            waiter[3] = True
+            self._queue.remove(waiter)
+            self.active += 1
+            self.active_tokens += tokens
+            self._active_models[model] = self._active_models.get(model, 0) + 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+        return delay
+
+    def stats(self):
+        """
+        Returns the state of the scheduler and the time spent in the queue.
+
+        Returns:
+        - A dictionary with the number of `active` and `queued` requests, the estimated `active_tokens` of the
+          requests in flight, and `queue_time`, which maps every priority to the `count`, `mean` and `max`
+          seconds its requests waited.
+        """
+        with self._condition:
+            return {
+                "active": self.active,
+                "active_tokens": self.active_tokens,
+                "queued": len(self._queue),
+                "queue_time": {priority: {"count": stats["count"],
+                                          "mean": stats["total"] / stats["count"],
+                                          "max": stats["max"]}
+                               for priority, stats in sorted(self._queue_times.items())},
+            }
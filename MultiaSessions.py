@@ -0,0 +1,185 @@
+import itertools
+import uuid
+from typing import List, Optional
+
+from ChatCompletionRequests import ChatCompletionRequestMessage
+from MultiaErrors import APIError
+
+
+class Sessions:
+    """
+    A class to create chat sessions, multi-turn conversations whose history is kept by the client.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `Sessions` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    def create(self, model: str,
+               messages: Optional[ChatCompletionRequestMessage] = None,
+               max_context_tokens: Optional[int] = None,
+               prefix_caching: Optional[bool] = None,
+               truncate_to: float = 0.75,
+               **defaults):
+        """
+        Starts a chat session.
+
+        Parameters:
+        - `model`: The model of the conversation.
+        - `messages` (optional): The first messages of the conversation, such as the system prompt.
+        - `max_context_tokens` (optional): The context size of the model. When the history and the `max_tokens`
+          of the reply would not fit, the oldest turns are dropped. None never truncates the history.
+        - `prefix_caching` (optional): Whether to send only the new messages of every turn with the id of the
+          session, so the server reuses the prompt it has already processed. By default it is used once the
+          server has acknowledged the session, True always uses it and False always sends the full history.
+        - `truncate_to` (optional): The fraction of the budget the history is truncated to when it overflows.
+          Truncating below the budget keeps the history stable for the next turns, so the prefix cached by
+          the server stays valid instead of changing on every turn.
+        - `defaults`: Default keyword arguments of `Completions.create` for every turn, such as `max_tokens`.
+
+        Returns:
+        - A `ChatSession`.
+        """
+        return ChatSession(self.client, model, messages, max_context_tokens, prefix_caching, truncate_to, defaults)
+
+
+class ChatSession:
+    """
+    A class representing a multi-turn conversation with a chat model.
+
+    When the server supports prefix caching, the first turn sends the full history along with a `session_id`
+    and the server echoes the `session_id` in its response. The next turns only send the messages added since
+    the previous turn and the `prefix_length`, the number of messages the server already holds. If the server
+    does not echo the `session_id`, every turn sends the full history.
+    """
+    def __init__(self, client, model: str, messages, max_context_tokens, prefix_caching, truncate_to, defaults):
+        """
+        Initializes the `ChatSession` class, see `Sessions.create` for the parameters.
+        """
+        self.client = client
+        self.model = model
+        self.messages: List[dict] = list(messages or [])
+        self.max_context_tokens = max_context_tokens
+        self.prefix_caching = prefix_caching
+        self.truncate_to = truncate_to
+        self.defaults = defaults
+        self.session_id = None
+        # The number of messages of `messages` held by the server, None when the server holds no prefix.
+        self._server_length = None
+        self._acknowledged = False
+
+    def send(self, content: str = None, role: str = "user", **kwargs):
+        """
+        Sends the next turn of the conversation and adds the reply to the history.
+
+        Parameters:
+        - `content` (optional): The content of the message added to the conversation, None sends the history as is.
+        - `role` (optional): The role of the message.
+        - `kwargs`: Keyword arguments of `Completions.create` for this turn, overriding the session defaults.
+
+        Returns:
+        - A `CompletionsResponse`, or, if `stream` is True, a generator of `CompletionChunk` objects. The reply
+          is added to the history once the stream has been fully consumed.
+        """
+        if content is not None:
+            self.messages.append({"role": role, "content": content})
+        options = dict(self.defaults, **kwargs)
+        self._truncate(options.get("max_tokens", 512))
+
+        if options.get("stream"):
+            return self._stream(options)
+        try:
+            response = self._create(options)
+        except APIError as error:
+            if not self._forgotten(error):
+                raise
+            # The server no longer holds the session, the full history is sent again in a new one.
+            self._restart()
+            response = self._create(options)
+        choice = response.choices[0]
+        self._add_reply(response.raw, {"role": choice.role or "assistant", "content": choice.message})
+        return response
+
+    def _stream(self, options):
+        chunks = iter(self._create(options))
+        try:
+            first = next(chunks, None)
+        except APIError as error:
+            if not self._forgotten(error):
+                raise
+            # The server no longer holds the session, the full history is sent again in a new one.
+            self._restart()
+            chunks = iter(self._create(options))
+            first = next(chunks, None)
+        if first is None:
+            # Without a reply the history and the prefix held by the server stay as they are.
+            return
+
+        parts = []
+        role = "assistant"
+        acknowledged = None
+        for chunk in itertools.chain([first], chunks):
+            acknowledged = acknowledged or chunk.raw
+            for choice in chunk.choices[:1]:
+                role = choice.role or role
+                parts.append(choice.delta)
+            yield chunk
+        self._add_reply(acknowledged or {}, {"role": role, "content": "".join(parts)})
+
+    def _create(self, options):
+        if self.prefix_caching is False:
+            return self.client.chat.completions.create(self.model, self.messages, **options)
+        if self.session_id is None:
+            self.session_id = uuid.uuid4().hex
+        body = {"session_id": self.session_id}
+        messages = self.messages
+        if self._server_length is not None:
+            body["prefix_length"] = self._server_length
+            messages = self.messages[self._server_length:]
+            # A delta only makes sense within the session, so it must not be answered from the cache.
+            options.setdefault("cache", False)
+        return self.client.chat.completions.create(self.model, messages, extra_body=body, **options)
+
+    def _add_reply(self, response_json, message):
+        self.messages.append(message)
+        if response_json.get("session_id") == self.session_id:
+            self._acknowledged = True
+        if self.prefix_caching is not False and (self._acknowledged or self.prefix_caching):
+            self._server_length = len(self.messages)
+
+    def _forgotten(self, error):
+        # Only a 404 means that the server forgot the session, other errors such as 429 or 413 are raised.
+        return self._server_length is not None and error.status_code == 404
+
+    def _restart(self):
+        self.session_id = None
+        self._server_length = None
+        self._acknowledged = False
+
+    def _truncate(self, max_tokens):
+        if self.max_context_tokens is None:
+            return
+        from MultiaTokens import trim_messages
+
+        # The estimator of the model is shared with the chat requests, its counts are cached and calibrated.
+        count = self.client.tokens.estimator(self.model).count_messages
+        budget = self.max_context_tokens - max_tokens
+        if count(self.messages) <= budget:
+            return
+        self.messages, _ = trim_messages(self.messages, count, budget * self.truncate_to)
+        # The server prefix no longer matches the history.
+        self._restart()
+
+    def reset(self, messages: Optional[ChatCompletionRequestMessage] = None):
+        """
+        Clears the history and starts a new session on the server.
+
+        Parameters:
+        - `messages` (optional): The first messages of the new conversation.
+        """
+        self.messages = list(messages or [])
+        self._restart()
@@ -0,0 +1,277 @@
+import tempfile
+import threading
+
+
+class SingleFlight:
+    """
+    A class that de-duplicates identical requests in flight at the same time.
+
+    The first caller of a key sends the request and the concurrent callers of the same key wait for it and share
+    its result. Once the request is over, the key is forgotten, so no result outlives its request.
+    """
+    def __init__(self, max_memory: int = 8 * 1024 * 1024):
+        """
+        Initializes the `SingleFlight` class.
+
+        Parameters:
+        - `max_memory` (optional): The size in bytes above which a shared streamed body is spooled to disk.
+        """
+        self.max_memory = max_memory
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key: str, send):
+        """
+        Returns the result of `send()`, sharing it with the concurrent calls of the same key.
+
+        Parameters:
+        - `key`: The key of the request, such as the one returned by `request_key`.
+        - `send`: A callable that sends the request and returns its result.
+
+        Returns:
+        - The result of `send()`, the same object for every caller.
+
+        Raises:
+        - Any exception raised by `send()`, in every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = send()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key: str, send):
+        """
+        Returns a view of the streamed response of `send()`, sharing the response with the concurrent calls
+        of the same key.
+
+        The body is read from the network once, by whichever view is ahead, and kept in a spooled temporary
+        file, so every view reads the whole body at its own pace. The key is forgotten once the body has been
+        fully downloaded or every view has been closed.
+
+        Parameters:
+        - `key`: The key of the request, such as the one returned by `request_key`.
+        - `send`: A callable that sends the request with `stream=True` and returns the `requests.Response`.
+
+        Returns:
+        - A `SharedResponseView` with the `iter_content` and `close` methods of a response.
+
+        Raises:
+        - Any exception raised by `send()`, in every caller.
+        """
+        with self._lock:
+            shared = self._calls.get(key)
+            view = shared.view() if shared is not None else None
+            leader = view is None
+            if leader:
+                shared = self._calls[key] = _SharedResponse(self.max_memory, lambda: self._forget(key, shared))
+                view = shared.view()
+            else:
+                self.coalesced += 1
+        if not leader:
+            shared.wait_started()
+            return view
+
+        try:
+            response = send()
+        except BaseException as error:
+            shared.fail(error)
+            raise
+        shared.start(response)
+        return view
+
+    def _forget(self, key, shared):
+        with self._lock:
+            if self._calls.get(key) is shared:
+                del self._calls[key]
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SharedResponse:
+    """
+    A streamed response read by several `SharedResponseView` objects.
+    """
+    def __init__(self, max_memory, on_done):
+        self.response = None
+        self.error = None
+        self.size = 0
+        self.eof = False
+        self.closed = False
+        self._spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._source = None
+        self._pumping = False
+        self._views = 0
+        self._on_done = on_done
+        self._condition = threading.Condition()
+
+    def view(self):
+        """
+        Returns a new view of the body, or None once the body is complete or abandoned and can not be shared.
+        """
+        with self._condition:
+            if self.eof or self.closed or self.error is not None:
+                return None
+            self._views += 1
+            return SharedResponseView(self)
+
+    def start(self, response):
+        with self._condition:
+            self.response = response
+            self._source = response.iter_content(chunk_size=64 * 1024)
+            self._condition.notify_all()
+            finished = not self._views and self._finish()
+        if finished:
+            self._on_done()
+
+    def fail(self, error):
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+            finished = self._finish()
+        if finished:
+            self._on_done()
+
+    def wait_started(self):
+        with self._condition:
+            while self.response is None and self.error is None:
+                self._condition.wait()
+            if self.error is not None:
+                raise self.error
+
+    def read(self, offset, size):
+        """
+        Returns the bytes of the body from `offset`, reading them from the network if no view has yet.
+        """
+        with self._condition:
+            while True:
+                if self.error is not None:
+                    raise self.error
+                if offset < self.size:
+                    self._spool.seek(offset)
+                    return self._spool.read(min(size, self.size - offset))
+                if self.eof:
+                    return b""
+                if self.response is not None and not self._pumping:
+                    self._pumping = True
+                    break
+                self._condition.wait()
+
+        try:
+            chunk = next(self._source, b"")
+        except BaseException as error:
+            with self._condition:
+                self._pumping = False
+            self.fail(error)
+            raise
+        finished = False
+        with self._condition:
+            self._pumping = False
+            self._spool.seek(0, 2)
+            self._spool.write(chunk)
+            self.size += len(chunk)
+            if not chunk:
+                self.eof = True
+                finished = self._finish()
+            self._condition.notify_all()
+        if finished:
+            self._on_done()
+        return self.read(offset, size)
+
+    def release(self):
+        finished = False
+        with self._condition:
+            self._views -= 1
+            if not self._views:
+                finished = self._finish()
+                self._spool.close()
+        if finished:
+            self._on_done()
+
+    def _finish(self):
+        """
+        Closes the response once the body is complete or nobody reads it.
+
+        Returns:
+        - Whether the response has just been closed, in which case the caller calls `_on_done` to forget the key
+          once it has released the condition.
+        """
+        if self.closed:
+            return False
+        self.closed = True
+        if self.response is not None:
+            self.response.close()
+        return True
+
+
+class SharedResponseView:
+    """
+    A class representing one reader of a response shared by `SingleFlight.stream`.
+    """
+    def __init__(self, shared):
+        """
+        Initializes the `SharedResponseView` class.
+
+        Parameters:
+        - `shared`: The shared response.
+        """
+        self.shared = shared
+        self.is_closed = False
+
+    @property
+    def status_code(self):
+        return self.shared.response.status_code
+
+    @property
+    def headers(self):
+        return self.shared.response.headers
+
+    def iter_content(self, chunk_size: int = 64 * 1024):
+        """
+        Iterates over the body of the shared response, from its start.
+
+        Parameters:
+        - `chunk_size` (optional): The maximum size of the chunks.
+
+        Returns:
+        - A generator of bytes.
+        """
+        offset = 0
+        while True:
+            chunk = self.shared.read(offset, chunk_size or 64 * 1024)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+    def close(self):
+        """
+        Closes this view, the shared response is closed with its last view.
+        """
+        if not self.is_closed:
+            self.is_closed = True
+            self.shared.release()
@@ -0,0 +1,241 @@
+import time
+
+from MultiaErrors import APIError, raise_for_status
+from MultiaInstrumentation import measure
+from MultiaJSON import loads
+
+
+class ServerSentEvent:
+    """
+    A class representing a single server-sent event received from the API.
+    """
+    def __init__(self, data: str, event: str = None, id: str = None):
+        """
+        Initializes the `ServerSentEvent` class.
+
+        Parameters:
+        - `data`: The data of the event, multiple `data:` lines are joined with a newline.
+        - `event` (optional): The event type.
+        - `id` (optional): The event ID.
+        """
+        self.data = data
+        self.event = event
+        self.id = id
+
+
+class SSEDecoder:
+    """
+    An incremental decoder for `text/event-stream` bodies.
+
+    Bytes are fed as they arrive from the network. Only the bytes received since the last call are scanned
+    for line endings, so decoding a stream is linear in its size no matter how it is split in chunks.
+    """
+    def __init__(self):
+        """
+        Initializes the `SSEDecoder` class with an empty buffer.
+        """
+        self._buffer = bytearray()
+        self._scan_from = 0
+        self._data = []
+        self._event = None
+        self._id = None
+
+    def feed(self, chunk: bytes):
+        """
+        Feeds a chunk of the body to the decoder.
+
+        Parameters:
+        - `chunk`: The bytes received from the network.
+
+        Returns:
+        - A list with the `ServerSentEvent` objects completed by this chunk.
+        """
+        events = []
+        buffer = self._buffer
+        buffer += chunk
+        line_start = 0
+        newline = buffer.find(b"\n", self._scan_from)
+        while newline != -1:
+            end = newline - 1 if newline > line_start and buffer[newline - 1] == 13 else newline
+            event = self._process_line(bytes(buffer[line_start:end]))
+            if event is not None:
+                events.append(event)
+            line_start = newline + 1
+            newline = buffer.find(b"\n", line_start)
+        if line_start:
+            del buffer[:line_start]
+        self._scan_from = len(buffer)
+        return events
+
+    def flush(self):
+        """
+        Decodes whatever is left in the buffer once the body has ended.
+
+        Returns:
+        - A list with the last `ServerSentEvent`, or an empty list if there is none.
+        """
+        events = self.feed(b"\n\n") if self._buffer or self._data else []
+        self._buffer.clear()
+        self._scan_from = 0
+        return events
+
+    def _process_line(self, line: bytes):
+        if not line:
+            if not self._data:
+                return None
+            event = ServerSentEvent("\n".join(self._data), event=self._event, id=self._id)
+            self._data = []
+            self._event = None
+            return event
+        if line.startswith(b":"):
+            return None
+
+        field, _, value = line.partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+        value = value.decode("utf-8")
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value
+        elif field == b"id":
+            self._id = value
+        return None
+
+
+class Stream:
+    """
+    A class to iterate over the objects streamed by the API as server-sent events.
+
+    The HTTP response is read incrementally, so every object is yielded as soon as its event arrives.
+    An `APIError` is raised instead if the API answers with an error status or with another content type.
+    """
+    def __init__(self, response, cast):
+        """
+        Initializes the `Stream` class.
+
+        Parameters:
+        - `response`: The streamed `requests.Response` returned by the API.
+        - `cast`: A callable that builds the yielded object from the JSON data of each event.
+        """
+        self.response = response
+        self.cast = cast
+
+    def __iter__(self):
+        decoder = SSEDecoder()
+        try:
+            _check_events(self.response)
+            for chunk in self.response.iter_content(chunk_size=None):
+                for event in decoder.feed(chunk):
+                    if event.data == "[DONE]":
+                        return
+                    yield _decode(self.response, event, self.cast)
+            for event in decoder.flush():
+                if event.data == "[DONE]":
+                    return
+                yield _decode(self.response, event, self.cast)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Closes the underlying HTTP response, releasing its connection back to the pool.
+        """
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncStream:
+    """
+    The asynchronous version of `Stream`, to be consumed with `async for`.
+    """
+    def __init__(self, response, cast):
+        """
+        Initializes the `AsyncStream` class.
+
+        Parameters:
+        - `response`: The streamed `httpx.Response` returned by the API.
+        - `cast`: A callable that builds the yielded object from the JSON data of each event.
+        """
+        self.response = response
+        self.cast = cast
+
+    async def __aiter__(self):
+        decoder = SSEDecoder()
+        try:
+            if not _is_events(self.response):
+                await self.response.aread()
+                _check_events(self.response)
+            async for chunk in self.response.aiter_bytes():
+                for event in decoder.feed(chunk):
+                    if event.data == "[DONE]":
+                        return
+                    yield _decode(self.response, event, self.cast)
+            for event in decoder.flush():
+                if event.data == "[DONE]":
+                    return
+                yield _decode(self.response, event, self.cast)
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Closes the underlying HTTP response, releasing its connection back to the pool.
+        """
+        await self.response.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def _is_events(response):
+    return 200 <= response.status_code < 300 and response.headers.get("content-type", "").startswith("text/event-stream")
+
+
+def _check_events(response):
+    """
+    Raises an `APIError` with the body of the response if it is not a successful stream of server-sent events.
+    """
+    if _is_events(response):
+        return
+    raise_for_status(response)
+    raise APIError(response.status_code, response.content, "The MultAI API did not answer with server-sent events")
+
+
+def _decode(response, event, cast):
+    """
+    Builds the object of an event, recording the first token and the usage in the timing of the request.
+    """
+    timing = getattr(response, "timing", None)
+    if timing is not None and "first_token" not in timing.phases:
+        timing.add("first_token", time.perf_counter() - timing.started)
+    with measure(response, "parse"):
+        data = loads(event.data)
+    if timing is not None and isinstance(data, dict) and data.get("usage"):
+        timing.usage = data["usage"]
+    with measure(response, "build"):
+        return cast(data)
+
+
+def iter_body(response, chunk_size: int = 64 * 1024):
+    """
+    Iterates over the body of a response in chunks, reading it from the network if it was streamed.
+
+    Parameters:
+    - `response`: A `requests.Response`, or an `httpx.Response` whose body has already been read.
+    - `chunk_size` (optional): The size of the chunks.
+
+    Returns:
+    - A generator of bytes.
+    """
+    if hasattr(response, "iter_content"):
+        return response.iter_content(chunk_size=chunk_size)
+    return response.iter_bytes(chunk_size=chunk_size)
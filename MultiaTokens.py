@@ -0,0 +1,306 @@
+import math
+import threading
+from functools import lru_cache
+from typing import List, Optional
+
+# The keys of the catalog metadata that give the context size of a model, in order of preference.
+CONTEXT_LENGTH_KEYS = ("context_length", "context_window", "max_context_tokens", "n_ctx", "max_model_len",
+                       "max_position_embeddings")
+# The policies of `TokenBudget.fit` when the prompt and the reply do not fit in the context of the model.
+POLICIES = ("error", "trim", "summarize")
+
+SUMMARY_PROMPT = ("Summarize the following conversation in a few sentences, keeping the names, facts, decisions "
+                  "and open questions needed to continue it.")
+
+
+class TokenEstimator:
+    """
+    A class that counts the tokens of chat messages, with a tokenizer or by estimating them from their length.
+
+    The count of every text is cached, so the history of a conversation is only tokenized once. Without a
+    tokenizer, the estimate is calibrated with the `prompt_tokens` reported by the server, see `calibrate`.
+    """
+    def __init__(self, tokenizer=None,
+                 chars_per_token: float = 4.0,
+                 message_overhead: int = 4,
+                 cache_size: int = 4096):
+        """
+        Initializes the `TokenEstimator` class.
+
+        Parameters:
+        - `tokenizer` (optional): An object with an `encode(text)` method returning the tokens, such as a
+          `transformers` or `tiktoken` tokenizer, a callable `tokenizer(text)` returning the tokens or their
+          number, or the name of a Hugging Face tokenizer, loaded with `transformers`. None estimates the
+          tokens from the number of characters.
+        - `chars_per_token` (optional): The average characters per token of the estimate without a tokenizer.
+        - `message_overhead` (optional): The tokens added by the chat template to every message.
+        - `cache_size` (optional): The number of texts whose count is cached.
+        """
+        if isinstance(tokenizer, str):
+            tokenizer = _load_tokenizer(tokenizer)
+        self.tokenizer = tokenizer
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+        # The ratio between the tokens counted by the server and the estimate, see `calibrate`.
+        self.scale = 1.0
+        self._count = lru_cache(maxsize=cache_size)(self._count_text)
+        self._lock = threading.Lock()
+
+    def _count_text(self, text):
+        if self.tokenizer is None:
+            return len(text) / self.chars_per_token
+        tokens = self.tokenizer.encode(text) if hasattr(self.tokenizer, "encode") else self.tokenizer(text)
+        return tokens if isinstance(tokens, int) else len(tokens)
+
+    def count(self, text: str):
+        """
+        Returns the number of tokens of a text.
+        """
+        return math.ceil(self._count(text) * self.scale)
+
+    def count_messages(self, messages):
+        """
+        Returns the number of tokens of a list of messages, including the overhead of every message.
+
+        Only the text parts of multimodal contents are counted.
+        """
+        tokens = 0.0
+        for message in messages:
+            tokens += self.message_overhead + self._count(_text(message.get("content")))
+        return math.ceil(tokens * self.scale)
+
+    def calibrate(self, estimated: int, prompt_tokens: int):
+        """
+        Adjusts the estimate without a tokenizer to the number of prompt tokens counted by the server.
+
+        Parameters:
+        - `estimated`: The tokens estimated for the messages of a request.
+        - `prompt_tokens`: The `prompt_tokens` of the usage of its response.
+        """
+        if self.tokenizer is not None or not estimated or not prompt_tokens:
+            return
+        with self._lock:
+            # Exponentially weighted moving average, so a single unusual prompt does not skew the estimate.
+            self.scale = 0.8 * self.scale + 0.2 * self.scale * prompt_tokens / estimated
+
+
+class TokenBudget:
+    """
+    A class that checks chat requests against the context size of their model before they are sent.
+
+    Every model has its own cached `TokenEstimator`, with the tokenizer configured for it, and its context size,
+    configured or read from the metadata of the model catalog. A request whose prompt and `max_tokens` exceed
+    the context is rejected, or its oldest turns are trimmed or summarized, according to a policy.
+    """
+    def __init__(self, client):
+        """
+        Initializes the `TokenBudget` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+        self._tokenizers = {}
+        self._context_lengths = {}
+        self._estimators = {}
+        self._lock = threading.Lock()
+
+    def configure(self, model: str, tokenizer=None, context_length: int = None):
+        """
+        Sets the tokenizer or the context size of a model.
+
+        Parameters:
+        - `model`: The name of the model.
+        - `tokenizer` (optional): The tokenizer of the model, as accepted by `TokenEstimator`.
+        - `context_length` (optional): The context size of the model in tokens, instead of the one of the catalog.
+        """
+        with self._lock:
+            if tokenizer is not None:
+                self._tokenizers[model] = tokenizer
+                self._estimators.pop(model, None)
+            if context_length is not None:
+                self._context_lengths[model] = context_length
+
+    def estimator(self, model: str):
+        """
+        Returns the `TokenEstimator` of a model, created on first use.
+        """
+        with self._lock:
+            estimator = self._estimators.get(model)
+            if estimator is None:
+                estimator = self._estimators[model] = TokenEstimator(self._tokenizers.get(model))
+            return estimator
+
+    def context_length(self, model: str):
+        """
+        Returns the context size of a model in tokens, or None if it is neither configured nor in the catalog.
+        """
+        if model in self._context_lengths:
+            return self._context_lengths[model]
+        try:
+            entry = self.client.registry.get(model) or {}
+        except Exception:
+            # Without a catalog the context size is unknown, and the requests are sent as they are.
+            return None
+        for key in CONTEXT_LENGTH_KEYS:
+            try:
+                return int(entry[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+        return None
+
+    def count(self, model: str, messages):
+        """
+        Returns the estimated number of prompt tokens of a list of messages for a model.
+        """
+        return self.estimator(model).count_messages(messages)
+
+    def fit(self, model: str,
+            messages,
+            max_tokens: int = 512,
+            policy: str = "trim",
+            target: float = 1.0,
+            summarize=None):
+        """
+        Fits the messages of a request and its `max_tokens` in the context of the model.
+
+        The system messages keep their position and the last message is always kept, and the kept history starts
+        with a user message.
+
+        Parameters:
+        - `model`: The model of the request.
+        - `messages`: The messages of the request.
+        - `max_tokens` (optional): The maximum number of tokens of the reply.
+        - `policy` (optional): What to do when the request does not fit: "error" raises a `ValueError`, "trim"
+          drops the oldest turns and "summarize" replaces them with a summary.
+        - `target` (optional): The fraction of the room left by `max_tokens` that the prompt is trimmed to when
+          it does not fit.
+        - `summarize` (optional): With "summarize", a callable `summarize(messages)` returning the summary of the
+          dropped messages. By default the model itself summarizes them.
+
+        Returns:
+        - A `BudgetReport` with the messages to send and the estimated tokens.
+
+        Raises:
+        - `ValueError`: If the policy is unknown, or if the request does not fit with the "error" policy or
+          even with only its last message.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown token budget policy {policy!r}, use one of {', '.join(POLICIES)}")
+        estimator = self.estimator(model)
+        messages = list(messages)
+        prompt_tokens = estimator.count_messages(messages)
+        context_length = self.context_length(model)
+        report = BudgetReport(messages, prompt_tokens, max_tokens, context_length)
+        if context_length is None or prompt_tokens + max_tokens <= context_length:
+            return report
+        if policy == "error":
+            raise ValueError(f"The prompt of about {prompt_tokens} tokens and max_tokens={max_tokens} exceed the "
+                             f"context of {context_length} tokens of {model}")
+
+        room = (context_length - max_tokens) * target
+        kept, dropped = trim_messages(messages, estimator.count_messages, room)
+        if policy == "summarize" and dropped:
+            summary = (summarize or (lambda turns: self._summarize(model, turns, context_length)))(dropped)
+            summary = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+            # The summary takes the place of the oldest turn, the messages before it are all system messages.
+            start = next(index for index, message in enumerate(messages) if message.get("role") != "system")
+            kept, _ = trim_messages(kept[:start] + [summary] + kept[start:], estimator.count_messages, room)
+            report.summarized = True
+        report.messages = kept
+        report.dropped = len(dropped)
+        report.prompt_tokens = estimator.count_messages(kept)
+        if report.prompt_tokens + max_tokens > context_length:
+            raise ValueError(f"The last message of about {report.prompt_tokens} tokens and max_tokens={max_tokens} "
+                             f"exceed the context of {context_length} tokens of {model}")
+        return report
+
+    def _summarize(self, model, messages, context_length):
+        summary_tokens = min(256, context_length // 8)
+        transcript = "\n".join(f"{message.get('role')}: {_text(message.get('content'))}" for message in messages)
+        # The transcript itself must fit, its oldest part is cut if it does not.
+        room = context_length - summary_tokens - self.count(model, [{"content": SUMMARY_PROMPT}]) - 16
+        estimator = self.estimator(model)
+        while len(transcript) > 1 and estimator.count(transcript) > room:
+            transcript = transcript[len(transcript) // 4:]
+        response = self.client.chat.completions.create(
+            model, [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            temperature=0, max_tokens=summary_tokens)
+        return response.choices[0].message
+
+
+class BudgetReport:
+    """
+    A class representing the token budget of a chat request, as estimated before it is sent.
+    """
+    def __init__(self, messages: List[dict], prompt_tokens: int, max_tokens: int, context_length: Optional[int]):
+        """
+        Initializes the `BudgetReport` class.
+
+        Parameters:
+        - `messages`: The messages sent, after trimming or summarizing.
+        - `prompt_tokens`: The estimated tokens of `messages`.
+        - `max_tokens`: The maximum number of tokens of the reply.
+        - `context_length`: The context size of the model, None if it is unknown.
+        """
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.context_length = context_length
+        # The number of messages left out, and whether they were replaced by a summary.
+        self.dropped = 0
+        self.summarized = False
+
+    @property
+    def total_tokens(self):
+        """
+        The estimated tokens of the prompt plus `max_tokens`, the most the request can use.
+        """
+        return self.prompt_tokens + self.max_tokens
+
+    def __repr__(self):
+        return (f"BudgetReport(prompt_tokens={self.prompt_tokens}, max_tokens={self.max_tokens}, "
+                f"context_length={self.context_length}, dropped={self.dropped}, summarized={self.summarized})")
+
+
+def trim_messages(messages, count, budget: float):
+    """
+    Drops the oldest turns of a conversation until it fits in a budget.
+
+    The system messages keep their position and the last message is always kept, and the kept turns start with a
+    user message.
+
+    Parameters:
+    - `messages`: The messages of the conversation.
+    - `count`: A callable returning the number of tokens of a list of messages.
+    - `budget`: The maximum number of tokens of the kept messages.
+
+    Returns:
+    - A tuple `(kept, dropped)` of lists of messages.
+    """
+    kept = list(messages)
+    dropped = []
+    while True:
+        turns = [index for index, message in enumerate(kept) if message.get("role") != "system"]
+        if len(turns) <= 1 or (count(kept) <= budget and kept[turns[0]].get("role") == "user"):
+            return kept, dropped
+        dropped.append(kept.pop(turns[0]))
+
+
+def _text(content):
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join((part.get("text") or "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content)
+
+
+def _load_tokenizer(name):
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise ImportError(f"Loading the tokenizer {name!r} requires `transformers`, install it with "
+                          f"`pip install transformers` or pass a tokenizer object")
+    return AutoTokenizer.from_pretrained(name)
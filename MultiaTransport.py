@@ -0,0 +1,475 @@
+import threading
+import time
+from typing import List, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Models import index_catalog
+from MultiaInstrumentation import Instrumentation, RequestTiming, current, httpx_trace, server_time, timed_pool_classes
+from MultiaScheduler import Scheduler
+
+
+class Endpoint:
+    """
+    A class that keeps the routing state of one MultAI server.
+    """
+    def __init__(self, url: str):
+        """
+        Initializes the `Endpoint` class.
+
+        Parameters:
+        - `url`: The base URL of the server.
+        """
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.models = None
+
+    def available(self, now: float):
+        """
+        Whether requests can be sent to the server, that is, its circuit breaker is not open.
+
+        Parameters:
+        - `now`: The current `time.monotonic()`.
+        """
+        return self.open_until <= now
+
+
+class Transport:
+    """
+    A class that owns the pooled HTTP connections shared by every submodule of the client.
+
+    All the requests sent to the MultAI API go through a single `requests.Session`, so TCP (and TLS)
+    connections are kept alive and reused between calls instead of being opened for every request.
+
+    When several servers are given, every request is routed to one of them, by the fewest outstanding
+    requests or by the lowest latency weighted by the outstanding requests. Servers that fail to connect
+    `failure_threshold` times in a row are skipped for `recovery_timeout` seconds (circuit breaking) and the
+    request fails over to another server. A background thread checks the health of the servers and fetches
+    their `/list/models`, so requests are only routed to servers that serve their model.
+    """
+    def __init__(self, base_url: Union[str, List[str]],
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = None,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 balancing: str = "least_outstanding",
+                 health_check_interval: float = 30.0,
+                 failure_threshold: int = 3,
+                 recovery_timeout: float = 30.0,
+                 scheduler: Scheduler = None,
+                 instrumentation: Instrumentation = None,
+                 recorder=None):
+        """
+        Initializes the `Transport` class and its connection pool.
+
+        Parameters:
+        - `base_url`: The base URL of the MultAI API, or a list with the base URLs of several servers.
+        - `pool_connections` (optional): The number of per-host connection pools to keep cached.
+        - `pool_maxsize` (optional): The maximum number of connections kept alive for each host.
+        - `pool_block` (optional): Whether to wait for a free connection instead of opening extra
+          ones when `pool_maxsize` connections to a host are already in use.
+        - `connect_timeout` (optional): Seconds to wait for a connection to be established.
+        - `read_timeout` (optional): Seconds to wait for the server to send data, None waits forever.
+        - `max_retries` (optional): How many times a request is retried on the same server when the connection
+          fails, before failing over to another server.
+        - `backoff_factor` (optional): The base delay in seconds of the exponential backoff between retries.
+        - `balancing` (optional): How requests are routed between several servers, "least_outstanding" or "latency".
+        - `health_check_interval` (optional): Seconds between the health checks of several servers.
+        - `failure_threshold` (optional): Consecutive connection failures after which a server is skipped.
+        - `recovery_timeout` (optional): Seconds a failing server is skipped before it is tried again.
+        - `scheduler` (optional): A `Scheduler` that holds back requests by priority within its limits.
+        - `instrumentation` (optional): An `Instrumentation` that records the timing of every request.
+        - `recorder` (optional): A `Recorder` that records the responses of the servers, or a `Replayer` that
+          answers the requests with recorded responses instead of sending them, see `MultiaReplay`.
+
+        Raises:
+        - `ValueError`: If `balancing` is not a known strategy.
+        """
+        if balancing not in ("least_outstanding", "latency"):
+            raise ValueError('balancing must be "least_outstanding" or "latency"')
+        urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.base_url = self.endpoints[0].url
+        self.timeout = (connect_timeout, read_timeout)
+        self.balancing = balancing
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.scheduler = scheduler
+        self.instrumentation = instrumentation
+        self.recorder = recorder
+        self._lock = threading.Lock()
+
+        # Only connection errors are retried: the request never reached the server, so retrying
+        # is safe even for POST requests that start an inference task.
+        retry = Retry(total=max_retries,
+                      connect=max_retries,
+                      read=0,
+                      status=0,
+                      redirect=0,
+                      backoff_factor=backoff_factor,
+                      allowed_methods=None,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max(pool_connections, len(self.endpoints)),
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block,
+                              max_retries=retry)
+        if instrumentation is not None:
+            # The connections of these pools time their setup, the upload and the wait for the response headers.
+            adapter.poolmanager.pool_classes_by_scheme = timed_pool_classes()
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._closed = threading.Event()
+        if len(self.endpoints) > 1:
+            threading.Thread(target=self._health_checks, args=(health_check_interval,), daemon=True).start()
+
+    def request(self, method: str, path: str, model: str = None, priority: int = None, tokens: int = None,
+                **kwargs):
+        """
+        Sends a request to the API through the shared connection pool.
+
+        Parameters:
+        - `method`: The HTTP method of the request.
+        - `path`: The path of the endpoint, relative to the base URL.
+        - `model` (optional): The model of the request, used to route it to a server that serves it.
+        - `priority` (optional): The priority of the request, used by the `scheduler` to order the requests.
+        - `tokens` (optional): The estimated tokens of the request, used by the `scheduler` for its token limit.
+        - `kwargs`: Extra arguments forwarded to `requests.Session.request`.
+
+        Returns:
+        - The `requests.Response` returned by the API.
+
+        Raises:
+        - `ValueError`: If none of the servers serves the model.
+        - `requests.exceptions.ConnectionError`: If no server could be reached.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if self.instrumentation is None:
+            return self._schedule(method, path, model, priority, tokens, kwargs)
+
+        timing = RequestTiming(method, path, model)
+        self.instrumentation.request_started(timing)
+        current.timing = timing
+        try:
+            response = self._schedule(method, path, model, priority, tokens, kwargs, timing)
+        except BaseException as error:
+            timing.error = error
+            self.instrumentation.request_finished(timing)
+            raise
+        finally:
+            current.timing = None
+        _timed(response, timing, kwargs.get("stream"))
+        return response
+
+    def _schedule(self, method, path, model, priority, tokens, kwargs, timing=None):
+        if self.scheduler is None:
+            return self._send(method, path, model, kwargs)
+
+        queued_at = time.perf_counter()
+        self.scheduler.acquire(1 if priority is None else priority, model, tokens)
+        if timing is not None:
+            timing.add("queue", time.perf_counter() - queued_at)
+        try:
+            response = self._send(method, path, model, kwargs)
+        except BaseException:
+            self.scheduler.release(model, tokens)
+            raise
+        _on_close(response, kwargs.get("stream"), lambda: self.scheduler.release(model, tokens))
+        return response
+
+    def _send(self, method, path, model, kwargs):
+        if self.recorder is not None:
+            return self.recorder.send(method, path, kwargs, lambda: self._send_to_server(method, path, model, kwargs))
+        return self._send_to_server(method, path, model, kwargs)
+
+    def _send_to_server(self, method, path, model, kwargs):
+        if len(self.endpoints) == 1:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+        tried = []
+        error = None
+        while True:
+            endpoint = self._acquire(model, tried)
+            if endpoint is None:
+                raise error or requests.exceptions.ConnectionError("No MultAI server is available")
+            try:
+                response = self.session.request(method, f"{endpoint.url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as connection_error:
+                self._release(endpoint, failed=True)
+                # A streamed body that has started being sent can not be sent again to another server.
+                if getattr(kwargs.get("data"), "started", False):
+                    raise
+                error = connection_error
+                tried.append(endpoint)
+                continue
+            except BaseException:
+                self._release(endpoint)
+                raise
+
+            latency = response.elapsed.total_seconds()
+            _on_close(response, kwargs.get("stream"), lambda: self._release(endpoint, latency=latency))
+            return response
+
+    def _acquire(self, model, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+            if model is not None:
+                serving = [endpoint for endpoint in candidates if endpoint.models is None or model in endpoint.models]
+                # Servers whose catalog is not known yet may serve the model, unless they are unreachable.
+                if not tried and not any(model in endpoint.models if endpoint.models is not None
+                                         else endpoint.available(now) for endpoint in self.endpoints):
+                    raise ValueError(f'None of the MultAI servers serves the model "{model}"')
+                candidates = serving
+            candidates = [endpoint for endpoint in candidates if endpoint.available(now)]
+            if not candidates:
+                return None
+            if self.balancing == "latency":
+                endpoint = min(candidates, key=lambda e: (e.latency or 0.0) * (e.outstanding + 1))
+            else:
+                endpoint = min(candidates, key=lambda e: (e.outstanding, e.latency or 0.0))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint, latency=None, failed=False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            self._record(endpoint, latency, failed)
+
+    def _record(self, endpoint, latency=None, failed=False):
+        if failed:
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.recovery_timeout
+        elif latency is not None:
+            endpoint.failures = 0
+            endpoint.open_until = 0.0
+            # Exponentially weighted moving average, so the latency follows the recent load of the server.
+            endpoint.latency = latency if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * latency
+
+    def _health_checks(self, interval):
+        while not self._closed.is_set():
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+            self._closed.wait(interval)
+
+    def check(self, endpoint: Endpoint):
+        """
+        Checks the health of a server and refreshes the list of the models it serves.
+
+        Parameters:
+        - `endpoint`: The server to check.
+
+        Returns:
+        - Whether the server answered.
+        """
+        try:
+            response = self.session.get(f"{endpoint.url}/list/models", timeout=(self.timeout[0], 30))
+            response.raise_for_status()
+            models = set(index_catalog(response.json()))
+        except (requests.exceptions.RequestException, ValueError):
+            with self._lock:
+                endpoint.failures = max(endpoint.failures + 1, self.failure_threshold)
+                endpoint.open_until = time.monotonic() + self.recovery_timeout
+            return False
+        with self._lock:
+            # An empty catalog could not be indexed, so the server is assumed to serve every model.
+            endpoint.models = models or None
+            endpoint.failures = 0
+            endpoint.open_until = 0.0
+        return True
+
+    def get(self, path: str, **kwargs):
+        """
+        Sends a GET request to the API. See `request` for the parameters.
+        """
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        """
+        Sends a POST request to the API. See `request` for the parameters.
+        """
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        """
+        Stops the health checks and closes every pooled connection.
+        """
+        self._closed.set()
+        self.session.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+class AsyncTransport:
+    """
+    The asynchronous version of `Transport`, used by `AsyncOpenMultIA`.
+
+    All the requests go through a single `httpx.AsyncClient`, so its connection pool is shared by every
+    submodule and many requests can be in flight at the same time from one event loop.
+    """
+    def __init__(self, base_url: str,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = None,
+                 max_retries: int = 3,
+                 instrumentation: Instrumentation = None):
+        """
+        Initializes the `AsyncTransport` class and its connection pool.
+
+        Parameters:
+        - `base_url`: The base URL of the MultAI API.
+        - `max_connections` (optional): The maximum number of connections open at the same time.
+        - `max_keepalive_connections` (optional): The maximum number of idle connections kept alive.
+        - `connect_timeout` (optional): Seconds to wait for a connection to be established.
+        - `read_timeout` (optional): Seconds to wait for the server to send data, None waits forever.
+        - `max_retries` (optional): How many times a request is retried when the connection fails.
+        - `instrumentation` (optional): An `Instrumentation` that records the timing of every request.
+        """
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self.instrumentation = instrumentation
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive_connections)
+        # The pool timeout is disabled so requests wait for a free connection instead of failing.
+        timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=None, pool=None)
+        self.session = httpx.AsyncClient(base_url=self.base_url,
+                                         timeout=timeout,
+                                         transport=httpx.AsyncHTTPTransport(limits=limits, retries=max_retries))
+
+    async def request(self, method: str, path: str, stream: bool = False, data: dict = None, **kwargs):
+        """
+        Sends a request to the API through the shared connection pool.
+
+        Parameters:
+        - `method`: The HTTP method of the request.
+        - `path`: The path of the endpoint, relative to the base URL.
+        - `stream` (optional): Whether to return before the body is read, so it can be consumed incrementally.
+        - `data` (optional): Form fields of the request, fields set to None are not sent.
+        - `kwargs`: Extra arguments forwarded to `httpx.AsyncClient.build_request`.
+
+        Returns:
+        - The `httpx.Response` returned by the API.
+        """
+        if data is not None:
+            data = {key: value for key, value in data.items() if value is not None}
+        if hasattr(kwargs.get("content"), "__aiter__"):
+            # httpx would send a body that is both iterable and async iterable with the sync API.
+            kwargs["content"] = kwargs["content"].__aiter__()
+        if self.instrumentation is None:
+            request = self.session.build_request(method, path, data=data, **kwargs)
+            return await self.session.send(request, stream=stream)
+
+        timing = RequestTiming(method, path, (kwargs.get("json") or {}).get("model"))
+        self.instrumentation.request_started(timing)
+        request = self.session.build_request(method, path, data=data,
+                                             extensions={"trace": httpx_trace(timing)}, **kwargs)
+        try:
+            response = await self.session.send(request, stream=stream)
+        except BaseException as error:
+            timing.error = error
+            self.instrumentation.request_finished(timing)
+            raise
+        _timed(response, timing, stream)
+        return response
+
+    async def get(self, path: str, **kwargs):
+        """
+        Sends a GET request to the API. See `request` for the parameters.
+        """
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs):
+        """
+        Sends a POST request to the API. See `request` for the parameters.
+        """
+        return await self.request("POST", path, **kwargs)
+
+    async def close(self):
+        """
+        Closes every pooled connection.
+        """
+        await self.session.aclose()
+
+
+def _timed(response, timing, stream):
+    """
+    Records the response in the timing of its request and attaches the timing to it as `response.timing`.
+
+    The download of a streamed body lasts until the response is closed, which also ends the request. Any other
+    request ends once the submodule has parsed its body, see `MultiaInstrumentation.finish`.
+    """
+    timing.url = str(response.url)
+    timing.status = response.status_code
+    seconds = server_time(response.headers)
+    if seconds is not None:
+        timing.add("server", seconds)
+    headers_at = timing._headers_at or time.perf_counter()
+    response.timing = timing
+    if not stream:
+        timing.add("download", time.perf_counter() - headers_at)
+        return
+
+    def downloaded():
+        timing.add("download", time.perf_counter() - headers_at)
+        timing.instrumentation.request_finished(timing)
+    _on_close(response, stream, downloaded)
+
+
+def _on_close(response, stream, callback):
+    """
+    Calls `callback` once the request is over: at once, or, if its body is streamed, when the body has been read
+    to the end or the response is closed, whichever comes first.
+    """
+    if not stream:
+        callback()
+        return
+    called = []
+
+    def done():
+        if not called:
+            called.append(True)
+            callback()
+
+    if hasattr(response, "aclose"):
+        aclose = response.aclose
+        aiter_raw = response.aiter_raw
+
+        async def aclose_and_callback():
+            await aclose()
+            done()
+
+        async def aiter_raw_and_callback(*args, **kwargs):
+            # `aread`, `aiter_bytes` and the other async readers of httpx all read the body through `aiter_raw`.
+            async for chunk in aiter_raw(*args, **kwargs):
+                yield chunk
+            done()
+        response.aclose = aclose_and_callback
+        response.aiter_raw = aiter_raw_and_callback
+        return
+
+    close = response.close
+    iter_content = response.iter_content
+
+    def close_and_callback():
+        close()
+        done()
+
+    def iter_content_and_callback(*args, **kwargs):
+        # `content`, `json` and `iter_lines` of requests all read the body through `iter_content`.
+        yield from iter_content(*args, **kwargs)
+        done()
+    response.close = close_and_callback
+    response.iter_content = iter_content_and_callback
@@ -0,0 +1,242 @@
+import base64
+import json
+import mmap
+import os
+import uuid
+
+
+class _StreamingBody:
+    """
+    The base class of the request bodies encoded while they are being sent.
+
+    Subclasses set `len`, `chunk_size`, the `_readers` producing the body in order, and the `_owned` resources
+    that `close` must release.
+    """
+    # Whether the body has started being read, after which it can not be sent again.
+    started = False
+    # A `hashlib` object updated with the body as it is read, set by the callers that identify requests by
+    # their body, such as the `Recorder` of `MultiaReplay`.
+    digest = None
+
+    def read(self, size: int = -1):
+        """
+        Reads the next bytes of the body.
+
+        Parameters:
+        - `size` (optional): The maximum number of bytes to read, a negative value reads the whole body.
+
+        Returns:
+        - The bytes read, an empty bytes object once the body has been fully read.
+        """
+        self.started = True
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self.chunk_size), b""))
+        while self._readers:
+            chunk = self._readers[0](size)
+            if chunk:
+                if self.digest is not None:
+                    self._update_digest(chunk)
+                return chunk
+            self._readers.pop(0)
+        return b""
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b"")
+
+    async def __aiter__(self):
+        import asyncio
+
+        while True:
+            chunk = await asyncio.to_thread(self.read, self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _update_digest(self, chunk):
+        self.digest.update(chunk)
+
+    def close(self):
+        """
+        Closes the files opened by the encoder.
+        """
+        while self._owned:
+            self._owned.pop().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MultipartEncoder(_StreamingBody):
+    """
+    A class that encodes a `multipart/form-data` body with one file part while it is being sent.
+
+    The file is read in chunks as the request body is consumed, so it is never loaded in memory as a whole.
+    The file can be given as a path, bytes, a binary file-like object or an iterable of bytes. Files opened
+    from a path are closed by `close`, any other object stays owned by the caller.
+    """
+    def __init__(self, fields: dict,
+                 file_field: str,
+                 file,
+                 filename: str = None,
+                 chunk_size: int = 64 * 1024):
+        """
+        Initializes the `MultipartEncoder` class.
+
+        Parameters:
+        - `fields`: The form fields of the body, fields set to None are not sent.
+        - `file_field`: The name of the form field of the file.
+        - `file`: The path of the file, its content as bytes, a binary file-like object or an iterable of bytes.
+        - `filename` (optional): The filename sent to the API, by default the name of the file if it has one.
+        - `chunk_size` (optional): The size of the chunks yielded when the body is iterated.
+        """
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._owned = []
+
+        if isinstance(file, (str, os.PathLike)):
+            file = open(file, "rb")
+            self._owned.append(file)
+        if filename is None:
+            filename = os.path.basename(getattr(file, "name", None) or "") or file_field
+        reader, size = _reader(file)
+
+        head = b"".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+            for name, value in fields.items() if value is not None
+        )
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+        tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+        # `len` is the attribute `requests` looks for to send a Content-Length, 0 means chunked encoding.
+        self.len = len(head) + size + len(tail) if size is not None else 0
+        self._readers = [_reader(head)[0], reader, _reader(tail)[0]]
+
+    @property
+    def headers(self):
+        """
+        The headers describing the body, to be sent along with it.
+        """
+        headers = {"Content-Type": f"multipart/form-data; boundary={self.boundary}"}
+        if self.len:
+            headers["Content-Length"] = str(self.len)
+        return headers
+
+    def _update_digest(self, chunk):
+        # The boundary is random, so it is left out for the same form to have the same digest.
+        self.digest.update(chunk.replace(self.boundary.encode("ascii"), b""))
+
+
+class Base64JSONEncoder(_StreamingBody):
+    """
+    A class that encodes a JSON body with one base64 field while it is being sent.
+
+    The source is base64-encoded in chunks as the request body is consumed, so neither the raw bytes nor their
+    encoding are ever held in memory as a whole. Files bigger than `mmap_threshold` are memory-mapped instead
+    of read. Like `MultipartEncoder`, only the files it opened from a path are closed by `close`.
+    """
+    def __init__(self, fields: dict,
+                 field: str,
+                 source,
+                 chunk_size: int = 64 * 1024,
+                 mmap_threshold: int = 1024 * 1024):
+        """
+        Initializes the `Base64JSONEncoder` class.
+
+        Parameters:
+        - `fields`: The other fields of the JSON body.
+        - `field`: The name of the field holding the base64 encoded source.
+        - `source`: The path of the file, its content as bytes, a binary file-like object or an iterable of bytes.
+        - `chunk_size` (optional): The size of the chunks yielded when the body is iterated.
+        - `mmap_threshold` (optional): The size in bytes above which files opened from a path are memory-mapped.
+        """
+        self.chunk_size = chunk_size
+        self._owned = []
+
+        if isinstance(source, (str, os.PathLike)):
+            source = open(source, "rb")
+            self._owned.append(source)
+            if os.fstat(source.fileno()).st_size > mmap_threshold:
+                source = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+                self._owned.append(source)
+        self._read_raw, size = _reader(source)
+        self._pending = b""
+
+        head = json.dumps(fields)[:-1] + (", " if fields else "") + json.dumps(field) + ': "'
+        head = head.encode("utf-8")
+        tail = b'"}'
+
+        # `len` is the attribute `requests` looks for to send a Content-Length, 0 means chunked encoding.
+        self.len = len(head) + 4 * ((size + 2) // 3) + len(tail) if size is not None else 0
+        self._readers = [_reader(head)[0], self._read_base64, _reader(tail)[0]]
+
+    @property
+    def headers(self):
+        """
+        The headers describing the body, to be sent along with it.
+        """
+        headers = {"Content-Type": "application/json"}
+        if self.len:
+            headers["Content-Length"] = str(self.len)
+        return headers
+
+    def _read_base64(self, size):
+        # Only whole groups of 3 bytes are encoded, the remainder waits for the next read or the end of the source.
+        raw_size = max(3, size // 4 * 3)
+        data = self._pending
+        while len(data) < raw_size:
+            chunk = self._read_raw(raw_size - len(data))
+            if not chunk:
+                self._pending = b""
+                return base64.b64encode(data)
+            data += chunk
+        cut = len(data) - len(data) % 3
+        self._pending = data[cut:]
+        return base64.b64encode(data[:cut])
+
+
+def _reader(source):
+    """
+    Returns a `read(size)` function over the source and its size in bytes, or None if it is not known.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source).cast("B")
+        position = 0
+
+        def read(size):
+            nonlocal position
+            chunk = view[position:position + size]
+            position += len(chunk)
+            return bytes(chunk)
+        return read, len(view)
+
+    if hasattr(source, "read"):
+        size = None
+        try:
+            size = os.fstat(source.fileno()).st_size - source.tell()
+        except (AttributeError, OSError, ValueError):
+            if isinstance(source, mmap.mmap):
+                size = len(source) - source.tell()
+            elif hasattr(source, "seekable") and source.seekable():
+                position = source.tell()
+                size = source.seek(0, os.SEEK_END) - position
+                source.seek(position)
+        return source.read, size
+
+    iterator = iter(source)
+    pending = memoryview(b"")
+
+    def read(size):
+        nonlocal pending
+        while not pending:
+            chunk = next(iterator, None)
+            if chunk is None:
+                return b""
+            pending = memoryview(chunk).cast("B")
+        chunk, pending = pending[:size], pending[size:]
+        return bytes(chunk)
+    return read, None
+
@@ -1,6 +1,11 @@
-import base64
+import io
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import requests
+from MultiaCache import request_key, source_digest
+from MultiaInstrumentation import parse_json
+from MultiaUpload import Base64JSONEncoder
 
 
 class Vision:
@@ -26,7 +31,11 @@ class Vision:
                  messages: str,
                  image_path: str = None,
                  max_tokens: int = 400,
-                 priority: int = 1):
+                 priority: int = 1,
+                 image=None,
+                 max_resolution: int = None,
+                 cache: bool = None,
+                 coalesce: bool = None):
         """
         Generates a response based on the provided image.
 
@@ -38,43 +47,323 @@ class Vision:
         - `image_path`: The path of the image file (must be a .jpg file).
         - `max_tokens`: The maximum number of tokens in the generated response (optional, default is 400).
         - `priority`: The priority of the request (optional, default is 1).
+        - `image`: The image as bytes, a binary file-like object, a numpy array or a `PIL.Image.Image`, used
+          instead of `image_path` (optional). Arrays and Pillow images are encoded as jpg and require Pillow.
+        - `max_resolution`: If set, images whose width or height is bigger are downsized to fit in a square of
+          this many pixels before the upload (optional, requires Pillow).
+        - `cache`: Whether to use the response cache of the client (optional). The server samples its answers,
+          so vision requests are only cached when this is True and the client has a cache.
+        - `coalesce`: Whether identical requests in flight at the same time share one request to the server
+          (optional). By default they do when the client was created with `coalesce_requests=True`.
+
+        The image is base64-encoded in chunks while the request is being sent, so it is never copied in memory
+        as a whole.
 
         Returns:
         - A dictionary containing the API response.
 
         Exceptions:
         - `ValueError`: If the file is not a .jpg image.
+        - `APIError`: If the API answers with an error status.
+        """
+
+        if self.client.validate_models:
+            self.client.registry.validate(model, "vision")
+        data, source = _vision_request(model, messages, image_path, max_tokens, priority, image, max_resolution)
+        return self._send(model, priority, data, source, cache, coalesce)
+
+    def _send(self, model, priority, data, source, cache, coalesce):
+        """
+        Sends a vision request through the response cache and the single-flight coalescing of the client.
         """
+        key = None
+        caching = self.client.cache is not None and cache is True
+        coalescing = self.client.single_flight is not None and coalesce is not False
+        if caching or coalescing:
+            digest = source_digest(source) if source is not None else None
+            if source is None or digest is not None:
+                key = request_key("/vision", data, digest)
+        if key is not None and caching:
+            cached = self.client.cache.get(key)
+            if cached is not None:
+                return cached["content"]
 
-        data = {
-            'model': model,
-            'messages': messages,
-            'max_tokens': max_tokens,
-            'priority': priority,
-        }
-        mime_type = image_path.split(".")[-1]
-        if image_path is not None:
-            if image_path.startswith("http:/") or image_path.startswith("https:/"):
-                data = {
-                    'model': model,
-                    'messages': messages,
-                    'max_tokens': max_tokens,
-                    'priority': priority,
-                    "image": image_path,
-                    "mime_type": mime_type,
-                }
+        def send():
+            if source is None:
+                response = self.client.transport.post("/vision", model=model, priority=priority, json=data)
             else:
-                with open(image_path, "rb") as image_file:
-                    encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                data = {
-                    'model': model,
-                    'messages': messages,
-                    'max_tokens': max_tokens,
-                    'priority': priority,
-                    "image": encoded_image,
-                    "mime_type": mime_type,
-                }
-
-        response = requests.post(f"{self.client.base_url}/vision", json=data)
-
-        return response.json()["content"]
+                with Base64JSONEncoder(data, "image", source) as body:
+                    response = self.client.transport.post("/vision", model=model, priority=priority,
+                                                          data=body, headers=body.headers)
+            response_data = parse_json(response, check_status=True)
+            if key is not None and caching:
+                self.client.cache.set(key, response_data)
+            return response_data
+
+        if key is not None and coalescing:
+            return self.client.single_flight.call(key, send)["content"]
+        return send()["content"]
+
+    def generate_many(self,
+                      model: str,
+                      images,
+                      messages: str,
+                      max_tokens: int = 400,
+                      priority: int = 1,
+                      max_resolution: int = None,
+                      max_concurrency: int = 8,
+                      encode_workers: int = None,
+                      ordered: bool = True,
+                      cache: bool = None,
+                      coalesce: bool = None):
+        """
+        Generates a response for every image of a collection, pipelining the encoding and the uploads.
+
+        The images are downsized and, for arrays and Pillow images, encoded as jpg on a pool of worker threads
+        while the requests of the previous images are in flight, and up to `max_concurrency` requests are sent at
+        the same time. Every image is base64-encoded in chunks while it is uploaded, and the requests go through
+        the cache and the coalescing of the client like the ones of `generate`. At most twice `max_concurrency`
+        images are read ahead, so an iterator of images is consumed lazily. A failed image does not abort the
+        run, its error is reported in its result. For best results the client `pool_maxsize` should be at least
+        `max_concurrency`.
+
+        Parameters:
+        - `model`: The vision model to use.
+        - `images`: A directory, whose image files are used in name order, an iterable of images, each one a
+          path, an URL, bytes, a binary file-like object, a numpy array or a `PIL.Image.Image`, or a single path,
+          URL or bytes image.
+        - `messages`: The messages sent with every image.
+        - `max_tokens` (optional): The maximum number of tokens of every response.
+        - `priority` (optional): The priority of the requests.
+        - `max_resolution` (optional): If set, bigger images are downsized to fit in a square of this many pixels.
+        - `max_concurrency` (optional): The maximum number of requests in flight at the same time.
+        - `encode_workers` (optional): The number of threads encoding the images, by default the number of CPUs.
+        - `ordered` (optional): Whether to yield the results in input order instead of as soon as they complete.
+        - `cache` (optional): Whether to use the response cache of the client, see `generate`.
+        - `coalesce` (optional): Whether identical requests in flight share one request, see `generate`.
+
+        Returns:
+        - A generator of `VisionResult` objects, one per image.
+        """
+        if self.client.validate_models:
+            self.client.registry.validate(model, "vision")
+        if isinstance(images, (str, os.PathLike)) and os.path.isdir(images):
+            images = [os.path.join(images, name) for name in sorted(os.listdir(images))
+                      if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+        elif isinstance(images, (str, os.PathLike, bytes, bytearray)):
+            # A single path, URL or encoded image, not a collection of them.
+            images = [images]
+
+        def send(prepared):
+            data, source = prepared.result()
+            return self._send(model, priority, data, source, cache, coalesce)
+
+        encoder = ThreadPoolExecutor(max_workers=encode_workers or os.cpu_count() or 1)
+        sender = ThreadPoolExecutor(max_workers=max_concurrency)
+        pending = deque()
+        items = enumerate(images)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < 2 * max_concurrency:
+                    item = next(items, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    index, image = item
+                    prepared = encoder.submit(_prepared_request, model, messages, image, max_tokens, priority,
+                                              max_resolution)
+                    pending.append((index, image, sender.submit(send, prepared)))
+                if not pending:
+                    return
+                if ordered:
+                    index, image, future = pending.popleft()
+                else:
+                    done, _ = wait([future for _, _, future in pending], return_when=FIRST_COMPLETED)
+                    position = next(position for position, item in enumerate(pending) if item[2] in done)
+                    index, image, future = pending[position]
+                    del pending[position]
+                try:
+                    yield VisionResult(index, image, content=future.result())
+                except Exception as error:
+                    yield VisionResult(index, image, error=error)
+        finally:
+            # If the caller stops iterating early, the images that were not sent yet are dropped.
+            sender.shutdown(wait=True, cancel_futures=True)
+            encoder.shutdown(wait=True, cancel_futures=True)
+
+class AsyncVision:
+    """
+    The asynchronous version of `Vision`, used by `AsyncOpenMultIA`.
+    """
+
+    def __init__(self,
+                 client):
+        """
+        Initializes the `AsyncVision` class with a client.
+
+        Parameters:
+        - `client`: An instance that contains the base configuration to connect to the API.
+        """
+        self.client = client
+
+    async def generate(self,
+                       model: str,
+                       messages: str,
+                       image_path: str = None,
+                       max_tokens: int = 400,
+                       priority: int = 1,
+                       image=None,
+                       max_resolution: int = None):
+        """
+        Generates a response based on the provided image without blocking the event loop.
+
+        The parameters are the same as in `Vision.generate`. Downsizing and encoding
+        arrays or Pillow images run in a worker thread.
+
+        Returns:
+        - A dictionary containing the API response.
+        """
+        import asyncio
+
+        data, source = await asyncio.to_thread(_vision_request, model, messages, image_path, max_tokens, priority,
+                                               image, max_resolution)
+
+        if source is None:
+            response = await self.client.transport.post("/vision", json=data)
+        else:
+            with Base64JSONEncoder(data, "image", source) as body:
+                response = await self.client.transport.post("/vision", content=body, headers=body.headers)
+
+        return parse_json(response)["content"]
+
+
+class VisionResult:
+    """
+    A class representing the outcome of one image of `Vision.generate_many`.
+    """
+    def __init__(self, index: int, image, content: str = None, error: Exception = None):
+        """
+        Initializes the `VisionResult` class.
+
+        Parameters:
+        - `index`: The position of the image in the input.
+        - `image`: The image as given in the input.
+        - `content` (optional): The generated response, if the request succeeded.
+        - `error` (optional): The exception raised by the request, if it failed.
+        """
+        self.index = index
+        self.image = image
+        self.content = content
+        self.error = error
+
+    @property
+    def ok(self):
+        """
+        Whether the request succeeded.
+        """
+        return self.error is None
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+def _prepared_request(model, messages, image, max_tokens, priority, max_resolution):
+    """
+    Builds the fields of a vision request and its image source, see `_vision_request`, for a path or an
+    in-memory image of `Vision.generate_many`.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        return _vision_request(model, messages, os.fspath(image), max_tokens, priority,
+                               max_resolution=max_resolution)
+    return _vision_request(model, messages, None, max_tokens, priority, image, max_resolution)
+
+
+def _vision_request(model, messages, image_path, max_tokens, priority, image=None, max_resolution=None):
+    """
+    Builds the fields of a vision request and the image source to upload with them.
+
+    Returns:
+    - A tuple `(data, source)`, where `source` is None if there is no image to upload (no image or an URL).
+    """
+    data = {
+        'model': model,
+        'messages': messages,
+        'max_tokens': max_tokens,
+        'priority': priority,
+    }
+    if image is not None:
+        source, mime_type = _image_source(image, max_resolution)
+        data["mime_type"] = mime_type
+        return data, source
+    if image_path is None:
+        return data, None
+
+    data["mime_type"] = image_path.split(".")[-1]
+    if image_path.startswith("http:/") or image_path.startswith("https:/"):
+        data["image"] = image_path
+        return data, None
+    if max_resolution is not None:
+        downsized = _downsize(image_path, max_resolution)
+        if downsized is not None:
+            data["mime_type"] = "jpg"
+            return data, downsized
+    return data, image_path
+
+
+def _image_source(image, max_resolution):
+    """
+    Returns the bytes, file or encoded buffer to upload for an in-memory image, and its mime type.
+    """
+    if hasattr(image, "__array_interface__") and not isinstance(image, (bytes, bytearray, memoryview)):
+        from PIL import Image
+
+        return _encode_jpeg(Image.fromarray(image), max_resolution), "jpg"
+    if hasattr(image, "save") and hasattr(image, "size") and not hasattr(image, "read"):
+        return _encode_jpeg(image, max_resolution), "jpg"
+
+    if max_resolution is not None:
+        downsized = _downsize(image, max_resolution)
+        if downsized is not None:
+            return downsized, "jpg"
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return image, "png" if bytes(image[:4]) == b"\x89PNG" else "jpg"
+    name = getattr(image, "name", None)
+    return image, os.path.splitext(name)[1][1:] if isinstance(name, str) and "." in name else "jpg"
+
+
+def _downsize(source, max_resolution):
+    """
+    Returns the image downsized and encoded as jpg, or None if it already fits in `max_resolution`.
+
+    Only the header of the image is decoded when it does not need to be downsized.
+    """
+    from PIL import Image
+
+    position = source.tell() if hasattr(source, "read") else None
+    opened = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    try:
+        if max(opened.size) <= max_resolution:
+            return None
+        return _encode_jpeg(opened, max_resolution)
+    finally:
+        opened.close()
+        if position is not None:
+            source.seek(position)
+
+
+def _encode_jpeg(picture, max_resolution):
+    """
+    Encodes a Pillow image as jpg, downsizing it first if it does not fit in `max_resolution`.
+
+    Returns:
+    - A memoryview over the encoded bytes.
+    """
+    if max_resolution is not None and max(picture.size) > max_resolution:
+        picture = picture.copy()
+        picture.thumbnail((max_resolution, max_resolution))
+    if picture.mode not in ("RGB", "L"):
+        picture = picture.convert("RGB")
+    buffer = io.BytesIO()
+    picture.save(buffer, format="JPEG", quality=90)
+    return buffer.getbuffer()
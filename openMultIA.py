@@ -1,8 +1,14 @@
-from MultiaAudio import Audio
-from MultiaChat import Chat
-from MultiaImages import Images
-from MultiaVision import Vision
-from Models import Models
+import threading
+from functools import cached_property
+from typing import TYPE_CHECKING
+
+# The submodules and their dependencies are only imported when they are first used, so a process that only
+# needs the chat API does not pay for importing the others.
+if TYPE_CHECKING:
+    from MultiaCache import ResponseCache
+    from MultiaInstrumentation import Instrumentation
+    from MultiaScheduler import Scheduler
+
 
 class OpenMultIA:
     """
@@ -11,22 +17,260 @@ class OpenMultIA:
     This class consolidates all the different services provided by the MultIA API, enabling access through
     a single interface.
     """
-    def __init__(self, base_url):
+    def __init__(self, base_url,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = None,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 cache: "ResponseCache" = None,
+                 validate_models: bool = False,
+                 models_ttl: float = 300,
+                 balancing: str = "least_outstanding",
+                 health_check_interval: float = 30.0,
+                 failure_threshold: int = 3,
+                 recovery_timeout: float = 30.0,
+                 scheduler: "Scheduler" = None,
+                 instrumentation: "Instrumentation" = None,
+                 coalesce_requests: bool = False,
+                 record: str = None,
+                 replay: str = None,
+                 replay_time_scale: float = 1.0):
         """
         Initializes the `OpenMultIA` client with the provided base URL.
 
         The instance variables represent the submodules, making them available through this client.
+        Every submodule shares the same pooled, keep-alive `transport`. The submodules and the transport are
+        created, and their modules imported, the first time they are accessed.
+
+        Parameters:
+        - `base_url`: The base URL of the MultIA API, or a list with the base URLs of several MultIA servers
+          to balance the requests between them.
+        - `pool_connections` (optional): The number of per-host connection pools to keep cached.
+        - `pool_maxsize` (optional): The maximum number of connections kept alive for each host.
+        - `pool_block` (optional): Whether to wait for a free connection when the pool of a host is exhausted.
+        - `connect_timeout` (optional): Seconds to wait for a connection to be established.
+        - `read_timeout` (optional): Seconds to wait for the server to send data, None waits forever.
+        - `max_retries` (optional): How many times a request is retried when the connection fails.
+        - `backoff_factor` (optional): The base delay in seconds of the exponential backoff between retries.
+        - `cache` (optional): A `MemoryCache` or `DiskCache` used to reuse the responses of deterministic chat
+          and vision requests, None disables caching.
+        - `validate_models` (optional): Whether to check the `model` of every request against the cached catalog
+          of the `registry` before sending it.
+        - `models_ttl` (optional): Seconds the model catalog of the `registry` is cached.
+        - `balancing` (optional): How requests are routed between several servers, "least_outstanding" or "latency".
+        - `health_check_interval` (optional): Seconds between the health checks of several servers.
+        - `failure_threshold` (optional): Consecutive connection failures after which a server is skipped.
+        - `recovery_timeout` (optional): Seconds a failing server is skipped before it is tried again.
+        - `scheduler` (optional): A `Scheduler` that sends the requests of this process by `priority`, within
+          global and per-model concurrency limits and a rate limit.
+        - `instrumentation` (optional): An `Instrumentation` whose hooks and collector record the timing of every
+          request, phase by phase.
+        - `coalesce_requests` (optional): Whether identical image and vision requests in flight at the same time
+          share one request to the server instead of generating the same content several times.
+        - `record` (optional): The path of a replay archive where the responses of the server are recorded.
+        - `replay` (optional): The path of a replay archive whose responses answer the requests, instead of a server.
+        - `replay_time_scale` (optional): The factor applied to the recorded delays of `replay`, 1.0 replays the
+          original timing and 0 replays without any delay.
+
+        Raises:
+        - `ValueError`: If both `record` and `replay` are given.
+        """
+        if record is not None and replay is not None:
+            raise ValueError("A client can either record or replay, not both")
+        self.base_url = base_url
+        self.cache = cache
+        self.coalesce_requests = coalesce_requests
+        self.validate_models = validate_models
+        self.models_ttl = models_ttl
+        self.instrumentation = instrumentation
+        self.record = record
+        self.replay = replay
+        self.replay_time_scale = replay_time_scale
+        self._transport_options = dict(pool_connections=pool_connections,
+                                       pool_maxsize=pool_maxsize,
+                                       pool_block=pool_block,
+                                       connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout,
+                                       max_retries=max_retries,
+                                       backoff_factor=backoff_factor,
+                                       balancing=balancing,
+                                       health_check_interval=health_check_interval,
+                                       failure_threshold=failure_threshold,
+                                       recovery_timeout=recovery_timeout,
+                                       scheduler=scheduler,
+                                       instrumentation=instrumentation)
+        self._lock = threading.Lock()
+
+    @cached_property
+    def transport(self):
+        # Submodules can be first accessed from several threads, only one transport must be created.
+        with self._lock:
+            if "transport" not in self.__dict__:
+                from MultiaTransport import Transport
+
+                recorder = None
+                if self.record is not None or self.replay is not None:
+                    from MultiaReplay import Recorder, Replayer
+
+                    recorder = (Recorder(self.record) if self.record is not None
+                                else Replayer(self.replay, self.replay_time_scale))
+                self.__dict__["transport"] = Transport(self.base_url, recorder=recorder, **self._transport_options)
+            return self.__dict__["transport"]
+
+    @cached_property
+    def chat(self):
+        from MultiaChat import Chat
+
+        return Chat(self)
+
+    @cached_property
+    def audio(self):
+        from MultiaAudio import Audio
+
+        return Audio(self)
+
+    @cached_property
+    def images(self):
+        from MultiaImages import Images
+
+        return Images(self)
+
+    @cached_property
+    def vision(self):
+        from MultiaVision import Vision
+
+        return Vision(self)
+
+    @cached_property
+    def models(self):
+        from Models import Models
+
+        return Models(self)
+
+    @cached_property
+    def registry(self):
+        with self._lock:
+            if "registry" not in self.__dict__:
+                from Models import ModelRegistry
+
+                self.__dict__["registry"] = ModelRegistry(self, ttl=self.models_ttl)
+            return self.__dict__["registry"]
+
+    @cached_property
+    def single_flight(self):
+        with self._lock:
+            if "single_flight" not in self.__dict__:
+                from MultiaSingleFlight import SingleFlight
+
+                self.__dict__["single_flight"] = SingleFlight() if self.coalesce_requests else None
+            return self.__dict__["single_flight"]
+
+    @cached_property
+    def tokens(self):
+        with self._lock:
+            if "tokens" not in self.__dict__:
+                from MultiaTokens import TokenBudget
+
+                self.__dict__["tokens"] = TokenBudget(self)
+            return self.__dict__["tokens"]
+
+    def close(self):
+        """
+        Closes the connections kept alive by the client.
+        """
+        if "transport" in self.__dict__:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncOpenMultIA:
+    """
+    The asynchronous version of `OpenMultIA`, to be used from an asyncio event loop.
+
+    Every method of the submodules is a coroutine, and all of them share one async connection pool,
+    so a single process can keep many inference requests in flight at the same time.
+    """
+    def __init__(self, base_url,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = None,
+                 max_retries: int = 3,
+                 instrumentation: "Instrumentation" = None):
+        """
+        Initializes the `AsyncOpenMultIA` client with the provided base URL.
 
         Parameters:
         - `base_url`: The base URL of the MultIA API.
+        - `max_connections` (optional): The maximum number of connections open at the same time.
+        - `max_keepalive_connections` (optional): The maximum number of idle connections kept alive.
+        - `connect_timeout` (optional): Seconds to wait for a connection to be established.
+        - `read_timeout` (optional): Seconds to wait for the server to send data, None waits forever.
+        - `max_retries` (optional): How many times a request is retried when the connection fails.
+        - `instrumentation` (optional): An `Instrumentation` that records the timing of every request.
         """
         self.base_url = base_url
-        self.chat = Chat(self)
-        self.audio = Audio(self)
-        self.images = Images(self)
-        self.vision = Vision(self)
-        self.models = Models(self)
+        self.instrumentation = instrumentation
+        self._transport_options = dict(max_connections=max_connections,
+                                       max_keepalive_connections=max_keepalive_connections,
+                                       connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout,
+                                       max_retries=max_retries,
+                                       instrumentation=instrumentation)
+
+    @cached_property
+    def transport(self):
+        from MultiaTransport import AsyncTransport
 
+        return AsyncTransport(self.base_url, **self._transport_options)
 
+    @cached_property
+    def chat(self):
+        from MultiaChat import AsyncChat
+
+        return AsyncChat(self)
+
+    @cached_property
+    def audio(self):
+        from MultiaAudio import AsyncAudio
+
+        return AsyncAudio(self)
+
+    @cached_property
+    def images(self):
+        from MultiaImages import AsyncImages
+
+        return AsyncImages(self)
+
+    @cached_property
+    def vision(self):
+        from MultiaVision import AsyncVision
+
+        return AsyncVision(self)
+
+    @cached_property
+    def models(self):
+        from Models import AsyncModels
+
+        return AsyncModels(self)
+
+    async def close(self):
+        """
+        Closes the connections kept alive by the client.
+        """
+        if "transport" in self.__dict__:
+            await self.transport.close()
 
+    async def __aenter__(self):
+        return self
 
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
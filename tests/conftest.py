@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the client live at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MultiaMockServer import MockServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    with MockServer() as server:
+        yield server
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from MultiaErrors import APIError
+from MultiaInstrumentation import Instrumentation
+from openMultIA import AsyncOpenMultIA
+
+
+def test_async_streamed_speech_and_images(server, tmp_path):
+    instrumentation = Instrumentation()
+
+    async def generate():
+        async with AsyncOpenMultIA(server.url, instrumentation=instrumentation) as client:
+            speech = await client.audio.speech.create("mock-audio", "Hello", stream=True)
+            await speech.stream_to_file(str(tmp_path / "speech.wav"))
+            response = await client.images.generate("mock-image", "A cat", n=3, stream=True)
+            return [image async for image in response.iter_images()]
+
+    images = asyncio.run(generate())
+    assert (tmp_path / "speech.wav").read_bytes()[:4] == b"RIFF"
+    assert len(images) == 3
+    # The requests are over once their body has been read.
+    finished = {path for path, _, phase in instrumentation.collector.summary() if phase == "total"}
+    assert finished == {"/audio/speech", "/images/generations"}
+
+
+def test_async_streamed_error_status_raises(server):
+    async def generate():
+        async with AsyncOpenMultIA(f"{server.url}/missing") as client:
+            with pytest.raises(APIError, match="Not Found"):
+                await client.audio.speech.create("mock-audio", "Hello", stream=True)
+            with pytest.raises(APIError, match="Not Found"):
+                await client.images.generate("mock-image", "A cat", stream=True)
+
+    asyncio.run(generate())
@@ -0,0 +1,32 @@
+import pytest
+
+from MultiaErrors import APIError
+from MultiaScheduler import Scheduler
+from openMultIA import OpenMultIA
+
+PROMPT = "The first sentence is short. The second one is a bit longer than the first one. And this is the third."
+
+
+def test_split_sentences_requires_a_voice_preset(server):
+    with OpenMultIA(server.url) as client:
+        with pytest.raises(ValueError, match="voice_preset"):
+            client.audio.speech.create("mock-audio", PROMPT, split_sentences=True)
+
+
+def test_split_sentences_joins_the_segments(server, tmp_path):
+    path = tmp_path / "speech.wav"
+    with OpenMultIA(server.url) as client:
+        speech = client.audio.speech.create("mock-audio", PROMPT, voice_preset="v2/en_speaker_1",
+                                            split_sentences=True)
+        speech.stream_to_file(str(path))
+    assert path.read_bytes()[:4] == b"RIFF"
+
+
+def test_split_sentences_raises_on_an_error_status(server):
+    scheduler = Scheduler(max_concurrency=2)
+    with OpenMultIA(f"{server.url}/missing", scheduler=scheduler) as client:
+        speech = client.audio.speech.create("mock-audio", PROMPT, voice_preset="v2/en_speaker_1",
+                                            split_sentences=True, max_concurrency=2)
+        with pytest.raises(APIError, match="Not Found"):
+            b"".join(speech.iter_bytes())
+        assert scheduler.stats()["active"] == 0
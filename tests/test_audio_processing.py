@@ -0,0 +1,17 @@
+import os
+
+from MultiaAudioProcessing import AudioPreprocessor
+
+
+def test_cache_evicts_the_least_recently_used_conversions(tmp_path):
+    preprocessor = AudioPreprocessor(cache_dir=str(tmp_path), max_cache_bytes=250)
+    paths = []
+    for index in range(4):
+        path = tmp_path / f"{index:02x}" / f"{index}.opus"
+        path.parent.mkdir()
+        path.write_bytes(b"\0" * 100)
+        os.utime(path, (index, index))
+        paths.append(path)
+
+    preprocessor._evict(str(paths[0]))
+    assert [path.exists() for path in paths] == [True, False, False, True]
@@ -0,0 +1,47 @@
+import pytest
+
+from MultiaCache import MemoryCache
+from MultiaErrors import APIError
+from openMultIA import OpenMultIA
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_chat_responses_are_cached(server):
+    cache = MemoryCache()
+    with OpenMultIA(server.url, cache=cache) as client:
+        first = client.chat.completions.create("mock-chat", MESSAGES, temperature=0)
+        second = client.chat.completions.create("mock-chat", MESSAGES, temperature=0)
+    assert second.raw == first.raw
+    assert cache.stats()["hits"] == 1
+
+
+def test_chat_error_responses_are_not_cached(server):
+    cache = MemoryCache()
+    with OpenMultIA(f"{server.url}/missing", cache=cache) as client:
+        for _ in range(2):
+            with pytest.raises(APIError) as error:
+                client.chat.completions.create("mock-chat", MESSAGES, temperature=0)
+            assert error.value.status_code == 404
+    assert cache.stats()["hits"] == 0
+
+
+def test_vision_error_responses_are_not_cached(server):
+    cache = MemoryCache()
+    with OpenMultIA(f"{server.url}/missing", cache=cache) as client:
+        for _ in range(2):
+            with pytest.raises(APIError, match="Not Found"):
+                client.vision.generate("mock-vision", "Describe it", image=b"\xff\xd8 not really a jpg",
+                                      cache=True)
+    assert cache.stats()["hits"] == 0
+
+
+def test_vision_responses_are_only_cached_on_request(server):
+    cache = MemoryCache()
+    with OpenMultIA(server.url, cache=cache) as client:
+        for _ in range(2):
+            client.vision.generate("mock-vision", "Describe it", image=b"\xff\xd8 not really a jpg")
+        assert cache.stats()["hits"] == 0
+        for _ in range(2):
+            client.vision.generate("mock-vision", "Describe it", image=b"\xff\xd8 not really a jpg", cache=True)
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,36 @@
+import threading
+import time
+
+import pytest
+
+from openMultIA import OpenMultIA
+
+
+def test_create_batch_rejects_streams_before_iterating(server):
+    with OpenMultIA(server.url) as client:
+        with pytest.raises(ValueError, match="stream"):
+            client.chat.completions.create_batch([{"model": "mock-chat", "messages": [], "stream": True}])
+
+
+def test_create_batch_yields_one_result_per_request(server):
+    requests = [{"model": "mock-chat", "messages": [{"role": "user", "content": str(index)}], "priority": index % 2}
+                for index in range(6)]
+    with OpenMultIA(server.url) as client:
+        results = list(client.chat.completions.create_batch(requests, max_concurrency=3, ordered=True))
+    assert [result.index for result in results] == list(range(6))
+    assert all(result.ok for result in results)
+
+
+def test_create_batch_threads_exit_when_the_generator_is_not_consumed(server):
+    requests = [{"model": "mock-chat", "messages": [{"role": "user", "content": "Hello"}]} for _ in range(4)]
+
+    def workers():
+        return [thread for thread in threading.enumerate() if thread.name.startswith("ThreadPoolExecutor")]
+    before = workers()
+    with OpenMultIA(server.url) as client:
+        results = client.chat.completions.create_batch(requests, max_concurrency=2)
+        deadline = time.monotonic() + 10
+        while workers() != before and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert workers() == before
+        results.close()
@@ -0,0 +1,30 @@
+import json
+
+from MultiaJobs import ImageJobRunner
+from openMultIA import OpenMultIA
+
+
+def test_jobs_run_and_resume(server, tmp_path):
+    with OpenMultIA(server.url) as client:
+        results = list(ImageJobRunner(client, tmp_path).run(["A cat", "A dog"], "mock-image"))
+        assert all(result.ok for result in results)
+        resumed = list(ImageJobRunner(client, tmp_path).run(["A cat", "A dog"], "mock-image"))
+    assert all(result.skipped for result in resumed)
+
+
+def test_unexpected_errors_fail_the_job(server, tmp_path):
+    with OpenMultIA(server.url, validate_models=True) as client:
+        runner = ImageJobRunner(client, tmp_path, backoff_factor=0)
+        results = list(runner.run(["A cat"], "missing-model"))
+    assert len(results) == 1 and isinstance(results[0].error, ValueError)
+    assert [record["status"] for record in runner.jobs.values()] == ["failed"]
+
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    with OpenMultIA(f"{server.url}/missing") as client:
+        runner = ImageJobRunner(client, tmp_path, retries=3, backoff_factor=0)
+        results = list(runner.run(["A cat"], "mock-image"))
+    assert results[0].error.status_code == 404
+    with open(runner.log_path, encoding="utf-8") as log:
+        attempts = [json.loads(line)["attempt"] for line in log if '"started"' in line]
+    assert attempts == [0]
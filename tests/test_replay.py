@@ -0,0 +1,25 @@
+import pytest
+
+from MultiaMockServer import MockServer
+from openMultIA import OpenMultIA
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_recorded_responses_are_replayed_without_a_server(tmp_path):
+    archive = str(tmp_path / "session.replay")
+    with MockServer(completion_tokens=5) as server:
+        url = server.url
+        with OpenMultIA(url, record=archive) as client:
+            completion = client.chat.completions.create("mock-chat", MESSAGES)
+            chunks = [chunk.choices[0].delta for chunk in
+                      client.chat.completions.create("mock-chat", MESSAGES, stream=True)]
+            image = b"".join(client.images.generate("mock-image", "A cat").iter_bytes())
+
+    with OpenMultIA(url, replay=archive, replay_time_scale=0) as client:
+        assert client.chat.completions.create("mock-chat", MESSAGES).raw == completion.raw
+        assert [chunk.choices[0].delta for chunk in
+                client.chat.completions.create("mock-chat", MESSAGES, stream=True)] == chunks
+        assert b"".join(client.images.generate("mock-image", "A cat").iter_bytes()) == image
+        with pytest.raises(KeyError, match="No response was recorded"):
+            client.chat.completions.create("mock-chat", [{"role": "user", "content": "Something else"}])
@@ -0,0 +1,34 @@
+import threading
+
+from MultiaMockServer import MockServer
+from MultiaScheduler import Scheduler
+from openMultIA import OpenMultIA
+
+
+def test_max_tokens_limits_the_requests_in_flight():
+    scheduler = Scheduler(max_concurrency=8, max_tokens=600)
+    requests = [{"model": "mock-chat", "messages": [{"role": "user", "content": "Hello"}], "max_tokens": 512,
+                 "budget": "trim"} for _ in range(3)]
+    samples = []
+    running = threading.Event()
+    running.set()
+
+    def sample():
+        while running.is_set():
+            samples.append(scheduler.stats())
+
+    sampler = threading.Thread(target=sample)
+    with MockServer(latency=0.2) as server, OpenMultIA(server.url, scheduler=scheduler) as client:
+        # The catalog is fetched once first, so only the chat requests are sampled.
+        client.tokens.context_length("mock-chat")
+        sampler.start()
+        try:
+            results = list(client.chat.completions.create_batch(requests, max_concurrency=3))
+        finally:
+            running.clear()
+            sampler.join()
+    assert all(result.ok for result in results)
+    # Two requests of more than 512 tokens do not fit in 600 tokens, so they are sent one after the other.
+    assert max(stats["active"] for stats in samples) == 1
+    assert max(stats["queued"] for stats in samples) >= 1
+    assert max(stats["active_tokens"] for stats in samples) <= 600
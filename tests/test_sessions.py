@@ -0,0 +1,45 @@
+import pytest
+
+from MultiaErrors import APIError
+from MultiaMockServer import MockServer
+from openMultIA import OpenMultIA
+
+
+def test_session_recovers_when_the_server_forgets_it():
+    with MockServer(sessions=True) as server, OpenMultIA(server.url) as client:
+        session = client.chat.sessions.create("mock-chat", [{"role": "system", "content": "Be nice"}], max_tokens=3)
+        session.send("Hello")
+        server.sessions.clear()
+        reply = session.send("Are you there?")
+    assert reply.choices[0].message
+    assert len(session.messages) == 5
+
+
+def test_streamed_session_recovers_when_the_server_forgets_it():
+    with MockServer(sessions=True, completion_tokens=3) as server, OpenMultIA(server.url) as client:
+        session = client.chat.sessions.create("mock-chat", [{"role": "system", "content": "Be nice"}])
+        session.send("Hello")
+        server.sessions.clear()
+        chunks = list(session.send("Are you there?", stream=True))
+        assert chunks
+        assert session.messages[-1]["content"].split() == ["token"] * 3
+        # The next delta builds on the prefix of the new session.
+        assert session.send("And now?").choices[0].message
+    assert len(session.messages) == 7
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_session_raises_other_client_errors(monkeypatch, stream):
+    with MockServer(sessions=True) as server, OpenMultIA(server.url) as client:
+        session = client.chat.sessions.create("mock-chat", [{"role": "system", "content": "Be nice"}], max_tokens=3)
+        session.send("Hello")
+        session_id = session.session_id
+
+        def rate_limited(options):
+            raise APIError(429, b'{"detail": "Too Many Requests"}')
+        monkeypatch.setattr(session, "_create", rate_limited)
+        with pytest.raises(APIError, match="Too Many Requests"):
+            reply = session.send("Are you there?", stream=stream)
+            if stream:
+                list(reply)
+    assert session.session_id == session_id
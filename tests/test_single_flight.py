@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from MultiaInstrumentation import Instrumentation
+from MultiaMockServer import MockServer
+from MultiaSingleFlight import SingleFlight
+from openMultIA import OpenMultIA
+
+
+def test_identical_image_requests_share_one_response():
+    instrumentation = Instrumentation()
+    with MockServer(latency=0.3) as server, OpenMultIA(server.url, coalesce_requests=True,
+                                                        instrumentation=instrumentation) as client:
+        def generate(_):
+            return b"".join(client.images.generate("mock-image", "A cat").iter_bytes())
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            images = list(executor.map(generate, range(4)))
+        coalesced = client.single_flight.coalesced
+    assert len(set(images)) == 1 and images[0]
+    assert coalesced == 3
+    assert instrumentation.collector.summary()[("/images/generations", "mock-image", "total")]["count"] == 1
+
+
+def test_shared_body_is_spooled_to_disk():
+    flight = SingleFlight(max_memory=1024)
+    with MockServer(latency=0.3, image_size=256 * 1024) as server, OpenMultIA(server.url) as client:
+        def send():
+            return client.transport.post("/images/generations", json={"prompt": "A cat", "model": "mock-image",
+                                                                       "n": 1}, stream=True)
+
+        def read(_):
+            view = flight.stream("a cat", send)
+            try:
+                return b"".join(view.iter_content(chunk_size=4096))
+            finally:
+                view.close()
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            bodies = list(executor.map(read, range(3)))
+    assert len(bodies[0]) > 1024
+    assert bodies[1] == bodies[0] and bodies[2] == bodies[0]
+    assert flight.coalesced == 2
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from MultiaErrors import APIError
+from openMultIA import AsyncOpenMultIA, OpenMultIA
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_stream_yields_chunks(server):
+    with OpenMultIA(server.url) as client:
+        chunks = list(client.chat.completions.create("mock-chat", MESSAGES, stream=True))
+    assert chunks and chunks[-1].usage["completion_tokens"] == 32
+
+
+def test_stream_raises_on_error_status(server):
+    with OpenMultIA(f"{server.url}/missing") as client:
+        stream = client.chat.completions.create("mock-chat", MESSAGES, stream=True)
+        with pytest.raises(APIError, match="Not Found") as error:
+            list(stream)
+    assert error.value.status_code == 404
+
+
+def test_async_stream_raises_on_error_status(server):
+    async def consume():
+        async with AsyncOpenMultIA(f"{server.url}/missing") as client:
+            stream = await client.chat.completions.create("mock-chat", MESSAGES, stream=True)
+            return [chunk async for chunk in stream]
+
+    with pytest.raises(APIError, match="Not Found"):
+        asyncio.run(consume())
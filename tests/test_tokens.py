@@ -0,0 +1,35 @@
+from MultiaTokens import TokenBudget, trim_messages
+
+MESSAGES = [
+    {"role": "system", "content": "Be nice"},
+    {"role": "user", "content": "first question with many words"},
+    {"role": "assistant", "content": "first answer with many words"},
+    {"role": "system", "content": "Answer in French"},
+    {"role": "user", "content": "second question"},
+    {"role": "assistant", "content": "second answer"},
+    {"role": "user", "content": "third question"},
+]
+
+
+def count(messages):
+    return sum(len(message["content"].split()) for message in messages)
+
+
+def test_trim_keeps_system_messages_in_place():
+    kept, dropped = trim_messages(MESSAGES, count, 12)
+    assert kept == [MESSAGES[0], MESSAGES[3], *MESSAGES[4:]]
+    assert dropped == MESSAGES[1:3]
+
+
+def test_summary_replaces_the_oldest_turns(server):
+    from openMultIA import OpenMultIA
+
+    with OpenMultIA(server.url) as client:
+        budget = TokenBudget(client)
+        budget.configure("mock-chat", context_length=80)
+        report = budget.fit("mock-chat", MESSAGES, max_tokens=25, policy="summarize",
+                            summarize=lambda messages: "two questions")
+    assert [message["role"] for message in report.messages] == ["system", "system", "system", "user", "assistant",
+                                                                 "user"]
+    assert report.messages[1]["content"].endswith("two questions")
+    assert report.messages[2] == MESSAGES[3]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from MultiaErrors import APIError
+from MultiaInstrumentation import Instrumentation
+from MultiaMockServer import MockServer
+from MultiaScheduler import Scheduler
+from openMultIA import OpenMultIA
+
+
+def test_scheduler_slot_is_released_when_the_body_is_read(server):
+    scheduler = Scheduler(max_concurrency=1)
+    with OpenMultIA(server.url, scheduler=scheduler, read_timeout=10) as client:
+        assert client.audio.speech.create("mock-audio", "Hello").speech.content
+        assert scheduler.stats()["active"] == 0
+        for _ in client.audio.speech.create("mock-audio", "Hello").iter_bytes():
+            pass
+        assert scheduler.stats()["active"] == 0
+        # With a leaked slot, this request would wait forever.
+        assert b"".join(client.images.generate("mock-image", "A cat").iter_bytes())
+        assert scheduler.stats()["active"] == 0
+
+
+def test_endpoint_and_timing_are_released_when_the_body_is_read(server):
+    instrumentation = Instrumentation()
+    with OpenMultIA([server.url, server.url], instrumentation=instrumentation, health_check_interval=3600) as client:
+        for _ in client.audio.speech.create("mock-audio", "Hello").iter_bytes():
+            pass
+        assert [endpoint.outstanding for endpoint in client.transport.endpoints] == [0, 0]
+    assert ("/audio/speech", "mock-audio", "total") in instrumentation.collector.summary()
+
+
+def test_scheduler_slot_is_released_on_errors(server, tmp_path):
+    scheduler = Scheduler(max_concurrency=1)
+    with OpenMultIA(server.url, scheduler=scheduler, read_timeout=10) as client:
+        with pytest.raises(ValueError, match="jpg"):
+            client.images.generate("mock-image", "A cat").stream_to_file(str(tmp_path / "cat.png"))
+        assert scheduler.stats()["active"] == 0
+    with OpenMultIA(f"{server.url}/missing", scheduler=scheduler, read_timeout=10) as client:
+        with pytest.raises(APIError, match="Not Found"):
+            client.images.generate("mock-image", "A cat")
+        with pytest.raises(APIError, match="Not Found"):
+            client.audio.speech.create("mock-audio", "Hello")
+        assert scheduler.stats()["active"] == 0
+
+
+def test_requests_are_spread_over_the_servers():
+    instrumentation = Instrumentation()
+    urls = []
+    instrumentation.on_response(lambda timing: urls.append(timing.url))
+    requests = [{"model": "mock-chat", "messages": [{"role": "user", "content": "Hello"}]} for _ in range(4)]
+    with MockServer(latency=0.3) as first, MockServer(latency=0.3) as second:
+        with OpenMultIA([first.url, second.url], instrumentation=instrumentation,
+                        health_check_interval=3600) as client:
+            results = list(client.chat.completions.create_batch(requests, max_concurrency=4))
+    assert all(result.ok for result in results)
+    served = [url.rsplit("/", 2)[0] for url in urls if url.endswith("/chat/completions")]
+    assert sorted(served) == sorted([first.url] * 2 + [second.url] * 2)
+
+
+def test_requests_fail_over_to_a_live_server(server):
+    stopped = MockServer()
+    stopped.start()
+    stopped.stop()
+    with OpenMultIA([stopped.url, server.url], max_retries=0, failure_threshold=1,
+                    health_check_interval=3600) as client:
+        for _ in range(3):
+            assert client.chat.completions.create("mock-chat", [{"role": "user", "content": "Hello"}]).choices
+        dead = client.transport.endpoints[0]
+    assert dead.failures >= 1 and not dead.available(time.monotonic())
@@ -0,0 +1,29 @@
+from MultiaCache import MemoryCache
+from openMultIA import OpenMultIA
+
+
+def test_generate_many_accepts_a_single_image_path(server, tmp_path):
+    path = tmp_path / "cat.jpg"
+    path.write_bytes(b"\xff\xd8" + b"\0" * 300)
+    with OpenMultIA(server.url) as client:
+        results = list(client.vision.generate_many("mock-vision", str(path), "Describe it"))
+    assert [(result.index, result.ok) for result in results] == [(0, True)]
+
+
+def test_generate_many_reads_a_directory_in_name_order(server, tmp_path):
+    for name in ("b.jpg", "a.png", "notes.txt"):
+        (tmp_path / name).write_bytes(b"\0" * 30)
+    with OpenMultIA(server.url) as client:
+        results = list(client.vision.generate_many("mock-vision", tmp_path, "Describe it"))
+    assert [result.image for result in results] == [str(tmp_path / "a.png"), str(tmp_path / "b.jpg")]
+    assert all(result.ok for result in results)
+
+
+def test_generate_many_uses_the_cache(server):
+    cache = MemoryCache()
+    with OpenMultIA(server.url, cache=cache) as client:
+        images = [b"\xff\xd8 first", b"\xff\xd8 second"]
+        first = list(client.vision.generate_many("mock-vision", images, "Describe it", cache=True))
+        second = list(client.vision.generate_many("mock-vision", images, "Describe it", cache=True))
+    assert [result.content for result in second] == [result.content for result in first]
+    assert cache.stats()["hits"] == 2